@@ -1,7 +1,13 @@
 """
 Handling the AI moves.
 """
+import argparse
+import hashlib
+import json
 import random
+import time
+import chessCache
+import chessEngine
 
 piece_score = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "p": 1}
 
@@ -61,39 +67,341 @@ piece_position_scores = {"wN": knight_scores,
                          "wp": pawn_scores,
                          "bp": pawn_scores[::-1]}
 
+# pawn structure terms, in pawns
+DOUBLED_PAWN_PENALTY = 0.2  # for every pawn behind another pawn of its side on the same file
+ISOLATED_PAWN_PENALTY = 0.15  # pawn without pawns of its side on the neighbouring files
+PASSED_PAWN_BONUS = [0.0, 0.05, 0.1, 0.2, 0.35, 0.6, 0.9, 0.0]  # by rank seen from the pawn's side, 0 is rank 1
+# a passed pawn with an enemy piece right in front of it only gets this part of its bonus
+BLOCKED_PASSED_PAWN_FACTOR = 0.5
+
 CHECKMATE = 1000
 STALEMATE = 0
 DEPTH = 3
+LIMIT_CHECK_INTERVAL = 128  # nodes between checks of the stop signal and the node and time limits
+CACHE_MIN_DEPTH = 2  # nodes closer to the leaves are not looked up in or written to the analysis cache
+EVALUATION_CACHE_SIZE = 1 << 16  # entries of the evaluation cache, a power of two
+PAWN_HASH_SIZE = 1 << 14  # entries of the pawn hash table, a power of two
+
+search_depth = DEPTH  # depth of the root of the current search
+nodes_searched = 0
+node_limit = None
+search_deadline = None
+search_stop_event = None
+search_cache = None  # chessCache.AnalysisCache of the current search
+search_root_moves_excluded = False  # the current search leaves out some root moves
+search_pseudo_legal = False  # the current search generates pseudo-legal moves below the root
+analysis_caches = {}  # the caches this process opened, by path
+principal_variations = [[]]  # principal_variations[ply] is the best line found from the node at that ply
+
+
+class HashTable:
+    """
+    Fixed-size table of values by 64-bit hash. An entry goes to the slot given by the low bits of its hash
+    and replaces whatever was there. Counts its lookups and hits.
+    """
+
+    def __init__(self, size):
+        self.mask = size - 1
+        self.keys = [None] * size
+        self.values = [None] * size
+        self.probes = self.hits = 0
+
+    def get(self, key):
+        self.probes += 1
+        index = key & self.mask
+        if self.keys[index] == key:
+            self.hits += 1
+            return self.values[index]
+        return None
+
+    def put(self, key, value):
+        index = key & self.mask
+        self.keys[index] = key
+        self.values[index] = value
+
+    def clear(self):
+        self.keys = [None] * len(self.keys)
+        self.values = [None] * len(self.values)
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+
+evaluation_cache = HashTable(EVALUATION_CACHE_SIZE)  # scoreBoard results by position hash
+pawn_hash_table = HashTable(PAWN_HASH_SIZE)  # pawn structure scores and passed pawns by pawn hash
+
+
+def evaluationCacheStats():
+    """
+    Lookups and hit rates of the evaluation cache and the pawn hash table of this process.
+    """
+    return {"evaluation_probes": evaluation_cache.probes, "evaluation_hit_rate": evaluation_cache.hitRate(),
+            "pawn_probes": pawn_hash_table.probes, "pawn_hit_rate": pawn_hash_table.hitRate()}
+
+
+class SearchLimitReached(Exception):
+    """
+    Raised inside the search when it has to stop: the stop signal is set or the node or time limit is used up.
+    """
+
+
+def loadEvaluation(path):
+    """
+    Replace the piece values and piece-square tables with the ones in a JSON file written by chessTune.
+    The tables are changed in place, so the black tables in piece_position_scores change with them.
+    """
+    with open(path) as file:
+        evaluation = json.load(file)
+    piece_score.update(evaluation["piece_score"])
+    for name, table in (("knight_scores", knight_scores), ("bishop_scores", bishop_scores),
+                        ("rook_scores", rook_scores), ("queen_scores", queen_scores), ("pawn_scores", pawn_scores)):
+        for row, values in zip(table, evaluation[name]):
+            row[:] = values
+    evaluation_cache.clear()
+
+
+def evaluationSignature():
+    """
+    Hash of the piece values and piece-square tables, cached results of another evaluation are not used.
+    """
+    evaluation = json.dumps([piece_score, knight_scores, bishop_scores, rook_scores, queen_scores, pawn_scores,
+                             DOUBLED_PAWN_PENALTY, ISOLATED_PAWN_PENALTY, PASSED_PAWN_BONUS,
+                             BLOCKED_PASSED_PAWN_FACTOR], sort_keys=True)
+    return int.from_bytes(hashlib.blake2b(evaluation.encode(), digest_size=7).digest(), "big")
 
 
-def findBestMove(game_state, valid_moves, return_queue):
-    global next_move
-    next_move = None
+def openAnalysisCache(path):
+    """
+    The analysis cache in the file at path, opened once per process.
+    """
+    cache = analysis_caches.get(path)
+    if cache is None:
+        cache = analysis_caches[path] = chessCache.AnalysisCache(path, evaluationSignature())
+    else:
+        cache.signature = evaluationSignature()
+    return cache
+
+
+def findBestMove(game_state, valid_moves, return_queue, stop_event=None, max_time=None, cache_path=None):
+    """
+    Find the AI move and put it in return_queue.
+    Setting stop_event (a multiprocessing.Event) makes the search return the best move found so far.
+    """
+    cache = None if cache_path is None else openAnalysisCache(cache_path)
+    best_move = findBestMoveWithLimits(game_state, valid_moves, DEPTH, max_time=max_time, stop_event=stop_event,
+                                       cache=cache)[0]
+    return_queue.put(best_move)
+
+
+def findBestMoveWithLimits(game_state, valid_moves, depth=DEPTH, max_nodes=None, max_time=None, stop_event=None,
+                           cache=None, excluded_moves=(), on_iteration=None, pseudo_legal=False):
+    """
+    Iterative deepening search up to depth.
+    It stops early when max_nodes or max_time (seconds) is used up or stop_event is set,
+    the stop is noticed within LIMIT_CHECK_INTERVAL nodes.
+    With an analysis cache, results found in it are used instead of searching again
+    and the results of this search are written to it.
+    excluded_moves are not searched at the root, the result is then not stored for the root position.
+    on_iteration is called with the depth, best move, score and nodes searched after every finished iteration.
+    With pseudo_legal the nodes below the root generate pseudo-legal moves and skip the ones that turn out
+    to leave the king in check after they are made.
+    Returns (best move, its score for the side to move, nodes searched, principal variation),
+    the move, score and line are taken from the unfinished iteration if it already found a move.
+    """
+    global next_move, next_move_score, search_depth, nodes_searched, node_limit, search_deadline, \
+        search_stop_event, principal_variations, search_cache, search_root_moves_excluded, search_pseudo_legal
+    valid_moves = [move for move in valid_moves if move not in excluded_moves]
     random.shuffle(valid_moves)
-    findMoveNegaMaxAlphaBeta(game_state, valid_moves, DEPTH, -CHECKMATE, CHECKMATE,
-                             1 if game_state.white_to_move else -1)
-    return_queue.put(next_move)
+    if cache is not None and not excluded_moves:
+        entry = cache.probe(game_state.zobrist_key)
+        cached_move = None if entry is None else findMoveById(valid_moves, entry[3])
+        if cached_move is not None:
+            if entry[0] >= depth and entry[2] == chessCache.EXACT:
+                cache.recordHit(entry)
+                return cached_move, entry[1], 0, [cached_move]
+            valid_moves.remove(cached_move)
+            valid_moves.insert(0, cached_move)
+    best_move = valid_moves[0] if valid_moves else None
+    best_score = None
+    best_line = [best_move] if valid_moves else []
+    nodes_searched = 0
+    node_limit = max_nodes
+    search_deadline = None if max_time is None else time.perf_counter() + max_time
+    search_stop_event = stop_event
+    search_cache = cache
+    search_root_moves_excluded = bool(excluded_moves)
+    search_pseudo_legal = pseudo_legal
+    root_ply = len(game_state.move_log)
+    try:
+        for iteration_depth in range(1, depth + 1):
+            next_move = None
+            search_depth = iteration_depth
+            principal_variations = [[] for _ in range(iteration_depth + 1)]
+            findMoveNegaMaxAlphaBeta(game_state, valid_moves, iteration_depth, -CHECKMATE, CHECKMATE,
+                                     1 if game_state.white_to_move else -1)
+            if next_move is not None:
+                best_move, best_score, best_line = next_move, next_move_score, principal_variations[0]
+                # search the best move first in the next iteration
+                valid_moves.remove(best_move)
+                valid_moves.insert(0, best_move)
+            if on_iteration is not None:
+                on_iteration(iteration_depth, best_move, best_score, nodes_searched)
+    except SearchLimitReached:
+        while len(game_state.move_log) > root_ply:  # take back the moves of the unfinished iteration
+            game_state.undoMove()
+        # the previous best move is searched first, so any move found by now is at least as good
+        if next_move is not None:
+            best_move, best_score, best_line = next_move, next_move_score, principal_variations[0]
+    finally:
+        node_limit = None
+        search_deadline = None
+        search_stop_event = None
+        search_cache = None
+        if cache is not None:
+            cache.flush()
+    return best_move, best_score, nodes_searched, best_line
+
+
+def findBestMovesMultiPV(game_state, valid_moves, lines, depth=DEPTH, max_nodes=None, max_time=None,
+                         stop_event=None, cache=None, info=None, pseudo_legal=False):
+    """
+    The best lines moves, found by searching the root again for every line with the moves found so far excluded.
+    The passes share a transposition table (the analysis cache, or one in memory for this search),
+    so later passes take their scores and move ordering from the earlier ones.
+    The node and time limits are for all passes together. info is called with the search info line
+    of every move as it is found. pseudo_legal is passed on to every pass.
+    Returns a list of (move, score for the side to move, principal variation), best first,
+    and the number of nodes searched.
+    """
+    if cache is None:
+        cache = chessCache.TranspositionTable()
+    start = time.perf_counter()
+    deadline = None if max_time is None else start + max_time
+    results = []
+    total_nodes = 0
+    while len(results) < min(lines, len(valid_moves)):
+        nodes_left = None if max_nodes is None else max_nodes - total_nodes
+        time_left = None if deadline is None else deadline - time.perf_counter()
+        if results and ((nodes_left is not None and nodes_left <= 0) or (time_left is not None and time_left <= 0) or (
+                stop_event is not None and stop_event.is_set())):
+            break
+        move, score, nodes, line = findBestMoveWithLimits(game_state, valid_moves, depth, nodes_left, time_left,
+                                                          stop_event, cache, [result[0] for result in results],
+                                                          pseudo_legal=pseudo_legal)
+        total_nodes += nodes
+        if score is None:  # stopped before the first iteration finished
+            break
+        results.append((move, score, line))
+        if info is not None:
+            info(searchInfo(depth, len(results), score, total_nodes, time.perf_counter() - start, line))
+    return results, total_nodes
+
+
+def searchInfo(depth, line_number, score, nodes, seconds, line):
+    """
+    A search info line: "info depth 3 multipv 1 score +0.45 nodes 5210 nps 41000 time 127 pv e2e4 e7e5 ...".
+    The score is for the side to move, in pawns or # for a mate, time is in milliseconds.
+    """
+    return "info depth {} multipv {} score {} nodes {} nps {} time {} pv {}".format(
+        depth, line_number, formatScore(score), nodes, int(nodes / seconds) if seconds > 0 else 0,
+        int(seconds * 1000), " ".join(moveCoordinates(move) for move in line))
+
+
+def moveCoordinates(move):
+    return move.getRankFile(move.start_row, move.start_col) + move.getRankFile(move.end_row, move.end_col)
+
+
+def formatScore(score):
+    """
+    Score in pawns, or the mate mark.
+    """
+    if abs(score) >= CHECKMATE:
+        return "#" if score > 0 else "-#"
+    return "{:+.2f}".format(score)
+
+
+def findMoveById(moves, move_id):
+    for move in moves:
+        if move.moveID == move_id:
+            return move
+    return None
+
+
+def searchLimitReached():
+    return (node_limit is not None and nodes_searched >= node_limit) or (
+            search_deadline is not None and time.perf_counter() >= search_deadline) or (
+            search_stop_event is not None and search_stop_event.is_set())
 
 
 def findMoveNegaMaxAlphaBeta(game_state, valid_moves, depth, alpha, beta, turn_multiplier):
-    global next_move
+    global next_move, next_move_score, nodes_searched
+    nodes_searched += 1
+    if nodes_searched % LIMIT_CHECK_INTERVAL == 0 and searchLimitReached():
+        raise SearchLimitReached()
+    ply = search_depth - depth
+    principal_variations[ply] = []
     if depth == 0:
         return turn_multiplier * scoreBoard(game_state)
+    use_cache = search_cache is not None and depth >= CACHE_MIN_DEPTH
+    if use_cache:
+        start_nodes = nodes_searched
+        start_time = time.perf_counter()
+        start_alpha = alpha
+        entry = search_cache.probe(game_state.zobrist_key) if ply > 0 else None
+        if entry is not None:
+            cached_depth, cached_score, bound, move_id = entry[:4]
+            cached_move = findMoveById(valid_moves, move_id)
+            if cached_depth >= depth and (bound == chessCache.EXACT or (
+                    bound == chessCache.LOWER_BOUND and cached_score >= beta) or (
+                    bound == chessCache.UPPER_BOUND and cached_score <= alpha)):
+                search_cache.recordHit(entry)
+                principal_variations[ply] = [cached_move] if cached_move is not None else []
+                return cached_score
+            if cached_move is not None:  # search the best move of the earlier search first
+                valid_moves.remove(cached_move)
+                valid_moves.insert(0, cached_move)
+    if not valid_moves and ply > 0 and not search_pseudo_legal:
+        return turn_multiplier * scoreBoard(game_state)  # checkmate or stalemate, getValidMoves found no move
     # move ordering - implement later //TODO
     max_score = -CHECKMATE
+    legal_moves = 0
+    in_check = search_pseudo_legal and game_state.inCheck()
     for move in valid_moves:
         game_state.makeMove(move)
-        next_moves = game_state.getValidMoves()
+        if search_pseudo_legal and game_state.moveLeftKingInCheck(in_check):
+            game_state.undoMove()
+            continue
+        legal_moves += 1
+        if depth == 1:  # the next node is a leaf, it only needs to know about checkmate and stalemate
+            game_state.hasLegalMove()
+            next_moves = []
+        elif search_pseudo_legal:
+            next_moves = game_state.getPseudoLegalMoves()
+        else:
+            next_moves = game_state.getValidMoves()
         score = -findMoveNegaMaxAlphaBeta(game_state, next_moves, depth - 1, -beta, -alpha, -turn_multiplier)
         if score > max_score:
             max_score = score
-            if depth == DEPTH:
+            principal_variations[ply] = [move] + principal_variations[ply + 1]
+            if depth == search_depth:
                 next_move = move
+                next_move_score = score
         game_state.undoMove()
         if max_score > alpha:
             alpha = max_score
         if alpha >= beta:
             break
+    if legal_moves == 0 and search_pseudo_legal and not in_check:
+        max_score = STALEMATE  # no pseudo-legal move was legal, without a check that is stalemate
+    if use_cache and principal_variations[ply] and (ply > 0 or not search_root_moves_excluded):
+        if max_score <= start_alpha:
+            bound = chessCache.UPPER_BOUND
+        elif max_score >= beta:
+            bound = chessCache.LOWER_BOUND
+        else:
+            bound = chessCache.EXACT
+        search_cache.store(game_state.zobrist_key, depth, max_score, bound, principal_variations[ply][0].moveID,
+                           nodes_searched - start_nodes, time.perf_counter() - start_time)
     return max_score
 
 
@@ -108,7 +416,10 @@ def scoreBoard(game_state):
             return CHECKMATE  # white wins
     elif game_state.stalemate:
         return STALEMATE
-    score = 0
+    score = evaluation_cache.get(game_state.zobrist_key)
+    if score is not None:
+        return score
+    score = scorePawnStructure(game_state)
     for row in range(len(game_state.board)):
         for col in range(len(game_state.board[row])):
             piece = game_state.board[row][col]
@@ -120,12 +431,103 @@ def scoreBoard(game_state):
                     score += piece_score[piece[1]] + piece_position_score
                 if piece[0] == "b":
                     score -= piece_score[piece[1]] + piece_position_score
+    evaluation_cache.put(game_state.zobrist_key, score)
+    return score
+
 
+def scorePawnStructure(game_state):
+    """
+    Doubled, isolated and passed pawns, positive when good for white.
+    The part that depends on the pawns only comes from the pawn hash table,
+    passed pawns blocked by an enemy piece are checked on the board.
+    """
+    entry = pawn_hash_table.get(game_state.pawn_key)
+    if entry is None:
+        entry = evaluatePawns(game_state.board)
+        pawn_hash_table.put(game_state.pawn_key, entry)
+    score, white_passed_pawns, black_passed_pawns = entry
+    board = game_state.board
+    while white_passed_pawns:
+        square = (white_passed_pawns & -white_passed_pawns).bit_length() - 1
+        white_passed_pawns &= white_passed_pawns - 1
+        row, col = divmod(square, 8)
+        if board[row - 1][col][0] == "b":
+            score -= PASSED_PAWN_BONUS[7 - row] * (1 - BLOCKED_PASSED_PAWN_FACTOR)
+    while black_passed_pawns:
+        square = (black_passed_pawns & -black_passed_pawns).bit_length() - 1
+        black_passed_pawns &= black_passed_pawns - 1
+        row, col = divmod(square, 8)
+        if board[row + 1][col][0] == "w":
+            score += PASSED_PAWN_BONUS[row] * (1 - BLOCKED_PASSED_PAWN_FACTOR)
     return score
 
 
+def evaluatePawns(board):
+    """
+    Pawn structure score for white and the squares (bits row * 8 + col) of the white and the black passed pawns.
+    """
+    white_pawns = []
+    black_pawns = []
+    # pawns per file and the rows of the most advanced pawns, with an empty file on both sides
+    white_counts = [0] * 10
+    black_counts = [0] * 10
+    white_last_rows = [-1] * 10  # largest row of a white pawn
+    black_first_rows = [8] * 10  # smallest row of a black pawn
+    for row in range(1, 7):
+        for col, piece in enumerate(board[row]):
+            if piece == "wp":
+                white_pawns.append((row, col))
+                white_counts[col + 1] += 1
+                white_last_rows[col + 1] = max(white_last_rows[col + 1], row)
+            elif piece == "bp":
+                black_pawns.append((row, col))
+                black_counts[col + 1] += 1
+                black_first_rows[col + 1] = min(black_first_rows[col + 1], row)
+    score = 0
+    white_passed_pawns = black_passed_pawns = 0
+    for file in range(1, 9):
+        score -= DOUBLED_PAWN_PENALTY * (max(white_counts[file] - 1, 0) - max(black_counts[file] - 1, 0))
+    for row, col in white_pawns:
+        if white_counts[col] == 0 and white_counts[col + 2] == 0:
+            score -= ISOLATED_PAWN_PENALTY
+        if min(black_first_rows[col:col + 3]) >= row:  # no black pawn in front on this or a neighbouring file
+            score += PASSED_PAWN_BONUS[7 - row]
+            white_passed_pawns |= 1 << (row * 8 + col)
+    for row, col in black_pawns:
+        if black_counts[col] == 0 and black_counts[col + 2] == 0:
+            score += ISOLATED_PAWN_PENALTY
+        if max(white_last_rows[col:col + 3]) <= row:
+            score -= PASSED_PAWN_BONUS[row]
+            black_passed_pawns |= 1 << (row * 8 + col)
+    return score, white_passed_pawns, black_passed_pawns
+
+
 def findRandomMove(valid_moves):
     """
     Picks and returns a random valid move.
     """
-    return random.choice(valid_moves)
\ No newline at end of file
+    return random.choice(valid_moves)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search a position and print the search info of the best moves.")
+    parser.add_argument("--fen", help="position to search (default: the start position)")
+    parser.add_argument("--depth", type=int, default=DEPTH)
+    parser.add_argument("--multipv", type=int, default=1, help="number of best moves to find")
+    parser.add_argument("--nodes", type=int, help="node limit of the whole search")
+    parser.add_argument("--time", type=float, help="time limit of the whole search in seconds")
+    parser.add_argument("--cache", help="analysis cache file to use and fill")
+    parser.add_argument("--pseudo-legal", action="store_true",
+                        help="generate pseudo-legal moves in the search and reject the illegal ones when made")
+    args = parser.parse_args()
+
+    game_state = chessEngine.GameState(args.fen)
+    cache = None if args.cache is None else openAnalysisCache(args.cache)
+    results, _ = findBestMovesMultiPV(game_state, game_state.getValidMoves(), args.multipv, args.depth, args.nodes,
+                                      args.time, cache=cache, info=print, pseudo_legal=args.pseudo_legal)
+    if results:
+        print("bestmove", moveCoordinates(results[0][0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Batch annotation of PGN games.
+Games from a directory of PGN files are spread over worker processes, every worker runs its own engine
+and searches each position with a fixed node or time budget.
+Annotated games are written as they finish and a checkpoint file lets an interrupted run resume.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import time
+import chessAI
+import chessMatch
+import chessPGN
+
+engine = None  # the engine configuration of the worker process
+
+
+def initWorker(engine_config):
+    global engine
+    engine = engine_config
+
+
+def gameKey(path, game):
+    return "{}:{}".format(os.path.basename(path), game.offset)
+
+
+def findGames(directory, done):
+    """
+    Generator over (key, game) for every game in the PGN files of the directory that was not annotated yet.
+    """
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith(".pgn"):
+            continue
+        path = os.path.join(directory, name)
+        for game in chessPGN.readGames(path):
+            key = gameKey(path, game)
+            if key not in done:
+                yield key, game
+
+
+def annotateGame(task):
+    """
+    Search every position of a game. Runs in a worker process.
+    Returns (key, game, annotations, moves played, error, search stats) where every annotation is a dict with
+    the move played, the evaluation of the position for white and the engine's best move if it differs.
+    The search stats are the nodes searched and the analysis cache's probes, hits, nodes saved and seconds saved.
+    """
+    key, game = task
+    annotations = []
+    move_log = []
+    nodes_searched = 0
+    cache = engine.analysisCache()
+    if cache is not None:
+        cache.takeStats()
+
+    def searchStats():
+        return (nodes_searched,) + (cache.takeStats() if cache is not None else (0, 0, 0, 0.0))
+
+    try:
+        for game_state, valid_moves, move in game.replay():
+            best_move, score, nodes, _ = engine.search(game_state, valid_moves)
+            nodes_searched += nodes
+            annotation = {"ply": len(move_log) + 1, "move": chessPGN.moveToSAN(game_state, move, valid_moves)}
+            if score is not None:
+                annotation["eval"] = round(score if game_state.white_to_move else -score, 2)
+            if best_move is not None and best_move != move:
+                annotation["best"] = chessPGN.moveToSAN(game_state, best_move, valid_moves)
+            annotations.append(annotation)
+            move_log.append(move)
+    except ValueError as error:
+        return key, game, annotations, move_log, str(error), searchStats()
+    return key, game, annotations, move_log, None, searchStats()
+
+
+def formatGame(game, annotations, move_log, output_format):
+    if output_format == "json":
+        return json.dumps({"headers": game.headers, "result": game.result, "moves": annotations}) + "\n"
+    comments = []
+    for annotation in annotations:
+        comment = []
+        if "eval" in annotation:
+            comment.append("[%eval {}]".format(chessAI.formatScore(annotation["eval"])))
+        if "best" in annotation:
+            comment.append("best " + annotation["best"])
+        comments.append(" ".join(comment) or None)
+    headers = dict(game.headers)
+    headers["Annotator"] = "chessAnnotate"
+    return chessPGN.gameToPGN(headers, move_log, game.headers.get("FEN"), comments)
+
+
+def loadCheckpoint(path):
+    if not os.path.exists(path):
+        return set()
+    with open(path) as file:
+        return set(line.strip() for line in file if line.strip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Annotate every move of a directory of PGN games.")
+    parser.add_argument("directory", help="directory with the PGN files to annotate")
+    parser.add_argument("--output", default="annotated.pgn", help="file the annotated games are appended to")
+    parser.add_argument("--format", choices=("pgn", "json"), default="pgn")
+    parser.add_argument("--checkpoint", help="file of finished games (default: output file + .done)")
+    parser.add_argument("--engine", default="name=engine,nodes=5000",
+                        help="engine and budget per position, e.g. depth=4,nodes=20000 or time=0.2, "
+                             "add cache=analysis.db to reuse the results of earlier runs")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    checkpoint_path = args.checkpoint or args.output + ".done"
+    done = loadCheckpoint(checkpoint_path)
+    if done:
+        print("resuming, {} games already annotated".format(len(done)))
+    games = positions = 0
+    total_stats = [0] * 5  # nodes, cache probes, cache hits, nodes and seconds saved by the cache
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers, initWorker, (chessMatch.EngineConfig(args.engine),)) as pool, \
+            open(args.output, "a") as output, open(checkpoint_path, "a") as checkpoint:
+        for key, game, annotations, move_log, error, stats in pool.imap_unordered(
+                annotateGame, findGames(args.directory, done)):
+            if error is not None:
+                print("{}: {} (annotated up to ply {})".format(key, error, len(annotations)))
+            output.write(formatGame(game, annotations, move_log, args.format))
+            output.flush()
+            checkpoint.write(key + "\n")
+            checkpoint.flush()
+            games += 1
+            positions += len(annotations)
+            total_stats = [total + value for total, value in zip(total_stats, stats)]
+            elapsed = time.perf_counter() - start
+            status = "{} games  {} positions  {:.1f} positions/s".format(games, positions, positions / elapsed)
+            if total_stats[1]:
+                status += "  cache hits {:.1%}".format(total_stats[2] / total_stats[1])
+            print(status, flush=True)
+    nodes, probes, hits, nodes_saved, seconds_saved = total_stats
+    if probes:
+        print("{} nodes searched, analysis cache: {} probes  {} hits ({:.1%})  {} nodes and {:.1f}s of search "
+              "saved".format(nodes, probes, hits, hits / probes, nodes_saved, seconds_saved))
+
+
+if __name__ == "__main__":
+    main()
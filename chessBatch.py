@@ -0,0 +1,452 @@
+"""
+Batched move generation for many positions at once with NumPy.
+A PositionBatch holds N positions as uint64 bitboard arrays (one array of N per piece, bit row * 8 + col
+like chessBitboard), so attack sets, checkers, pin masks and legal-move masks are computed for all positions
+with the same vectorized shifts and masks. Positions with black to move are mirrored so the side to move
+always moves up the board, mirroring a bitboard vertically is swapping its bytes.
+Moves come out as one flat array of 16-bit codes (the chessIndex move encoding) with offsets per position,
+and applyMoves makes them on the whole batch, which gives the successors and a batched perft.
+Like the engine, pawns only promote to a queen.
+"""
+import argparse
+import random
+import time
+import numpy as np
+import chessBitboard
+import chessEngine
+import chessIndex
+import chessPerft
+
+ONE = np.uint64(1)
+FULL = np.uint64((1 << 64) - 1)
+NOT_FILE_A = np.uint64(~chessBitboard.FILE_A & ((1 << 64) - 1))
+NOT_FILE_H = np.uint64(~chessBitboard.FILE_H & ((1 << 64) - 1))
+NOT_FILES_AB = np.uint64(~(chessBitboard.FILE_A | chessBitboard.FILE_A << 1) & ((1 << 64) - 1))
+NOT_FILES_GH = np.uint64(~(chessBitboard.FILE_H | chessBitboard.FILE_H >> 1) & ((1 << 64) - 1))
+ROW_5 = np.uint64(chessBitboard.ROW_MASKS[5])  # where the single pushes from the pawns' start row land
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)  # piece indexes, black pieces are 6 higher (chessBitboard order)
+PIECE_INDEXES = {name: index for index, name in enumerate(chessBitboard.PIECE_NAMES)}
+QUEEN_PROMOTION = chessIndex.PROMOTION_CODES["Q"] << 12
+NO_ENPASSANT = -1
+# castling squares seen from white: squares that must be empty, squares the king must not be attacked on
+KINGSIDE_EMPTY = np.uint64(1 << 61 | 1 << 62)
+QUEENSIDE_EMPTY = np.uint64(1 << 57 | 1 << 58 | 1 << 59)
+QUEENSIDE_SAFE = np.uint64(1 << 58 | 1 << 59)
+KING_START = 60
+# (shift, mask of the squares it can land on) of the directions of chessTables.DIRECTIONS, a positive shift is to
+# higher squares
+SHIFT_DIRECTIONS = tuple((row_step * 8 + col_step, NOT_FILE_A if col_step > 0 else NOT_FILE_H if col_step < 0 else FULL)
+                         for row_step, col_step in chessEngine.DIRECTIONS)
+ROOK_SHIFTS = SHIFT_DIRECTIONS[:4]
+BISHOP_SHIFTS = SHIFT_DIRECTIONS[4:]
+DEFAULT_CHUNK = 200000  # positions expanded at a time in perft
+
+knight_table = np.array(chessBitboard.knight_attacks, dtype=np.uint64)
+king_table = np.array(chessBitboard.king_attacks, dtype=np.uint64)
+# squares a pawn moving up the board attacks from a square, and the squares it is attacked from by one
+pawn_attacks_up = np.array(chessBitboard.pawn_attack_masks["w"], dtype=np.uint64)
+pawn_attacks_down = np.array(chessBitboard.pawn_attack_masks["b"], dtype=np.uint64)
+between_table = np.array(chessBitboard.between_masks, dtype=np.uint64)
+line_table = np.array(chessBitboard.line_masks, dtype=np.uint64)
+castling_rights_table = np.array(chessEngine.castling_rights_masks, dtype=np.uint8)
+# bit index of a single bit: a de Bruijn sequence multiplied by the bit has a different top 6 bits for every bit
+DE_BRUIJN = np.uint64(0x03F79D71B4CB0A89)
+de_bruijn_indexes = np.zeros(64, dtype=np.int64)
+for bit_index in range(64):
+    de_bruijn_indexes[((0x03F79D71B4CB0A89 << bit_index) & ((1 << 64) - 1)) >> 58] = bit_index
+
+
+def shift(bitboards, amount):
+    return bitboards << np.uint64(amount) if amount > 0 else bitboards >> np.uint64(-amount)
+
+
+def lowestBit(bitboards):
+    return bitboards & (~bitboards + ONE)
+
+
+def bitIndexes(bitboards):
+    """
+    Square of the lowest set bit of every bitboard, the bitboards must not be 0.
+    """
+    return de_bruijn_indexes[(lowestBit(bitboards) * DE_BRUIJN) >> np.uint64(58)]
+
+
+def slidingAttacks(sliders, empty, directions):
+    """
+    Squares attacked by the sliders along the directions, with a Kogge-Stone fill over the empty squares.
+    Works for any number of sliders in every bitboard.
+    """
+    attacks = np.zeros_like(sliders)
+    for amount, mask in directions:
+        generators = sliders
+        propagators = empty & mask
+        generators = generators | (propagators & shift(generators, amount))
+        propagators = propagators & shift(propagators, amount)
+        generators = generators | (propagators & shift(generators, 2 * amount))
+        propagators = propagators & shift(propagators, 2 * amount)
+        generators = generators | (propagators & shift(generators, 4 * amount))
+        attacks |= shift(generators, amount) & mask
+    return attacks
+
+
+def knightAttacks(knights):
+    left_one = (knights >> ONE) & NOT_FILE_H
+    left_two = (knights >> np.uint64(2)) & NOT_FILES_GH
+    right_one = (knights << ONE) & NOT_FILE_A
+    right_two = (knights << np.uint64(2)) & NOT_FILES_AB
+    one = left_one | right_one
+    two = left_two | right_two
+    return (one << np.uint64(16)) | (one >> np.uint64(16)) | (two << np.uint64(8)) | (two >> np.uint64(8))
+
+
+def kingAttacks(kings):
+    sides = ((kings >> ONE) & NOT_FILE_H) | ((kings << ONE) & NOT_FILE_A)
+    row = kings | sides
+    return sides | (row << np.uint64(8)) | (row >> np.uint64(8))
+
+
+class PositionBatch:
+    """
+    N positions: pieces is a (12, N) uint64 array in the order of chessBitboard.PIECE_NAMES,
+    white_to_move a bool array, castling_rights the chessEngine masks and enpassant the square or NO_ENPASSANT.
+    """
+
+    def __init__(self, pieces, white_to_move, castling_rights, enpassant):
+        self.pieces = pieces
+        self.white_to_move = white_to_move
+        self.castling_rights = castling_rights
+        self.enpassant = enpassant
+
+    @classmethod
+    def fromGameStates(cls, game_states):
+        pieces = np.zeros((12, len(game_states)), dtype=np.uint64)
+        for position, game_state in enumerate(game_states):
+            for row in range(8):
+                for col in range(8):
+                    piece = game_state.board[row][col]
+                    if piece != "--":
+                        pieces[PIECE_INDEXES[piece], position] |= ONE << np.uint64(row * 8 + col)
+        return cls(pieces, np.array([game_state.white_to_move for game_state in game_states], dtype=bool),
+                   np.array([game_state.castling_rights for game_state in game_states], dtype=np.uint8),
+                   np.array([NO_ENPASSANT if game_state.enpassant_possible == () else
+                             game_state.enpassant_possible[0] * 8 + game_state.enpassant_possible[1]
+                             for game_state in game_states], dtype=np.int8))
+
+    @classmethod
+    def fromFENs(cls, fens):
+        return cls.fromGameStates([chessEngine.GameState(fen) for fen in fens])
+
+    def __len__(self):
+        return len(self.white_to_move)
+
+    def sideToMove(self):
+        """
+        The pieces of the side to move and of the other side as (6, N) arrays, mirrored where black is to move,
+        the castling rights of the side to move (bit 0 king-side, bit 1 queen-side) and the mirrored
+        en-passant squares.
+        """
+        black = ~self.white_to_move
+        ours = np.where(black, self.pieces[6:].byteswap(), self.pieces[:6])
+        theirs = np.where(black, self.pieces[:6].byteswap(), self.pieces[6:])
+        rights = np.where(black, self.castling_rights >> 2, self.castling_rights) & 3
+        enpassant = np.where(black & (self.enpassant >= 0), self.enpassant ^ 56, self.enpassant)
+        return ours, theirs, rights, enpassant
+
+
+class MoveList:
+    """
+    The legal moves of a batch: codes[offsets[i]:offsets[i + 1]] are the moves of position i
+    and positions holds the position of every move.
+    """
+
+    def __init__(self, positions, codes, count):
+        order = np.argsort(positions, kind="stable")
+        self.positions = positions[order]
+        self.codes = codes[order]
+        self.counts = np.bincount(self.positions, minlength=count)
+        self.offsets = np.concatenate(([0], np.cumsum(self.counts)))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def movesOf(self, position):
+        return self.codes[self.offsets[position]:self.offsets[position + 1]]
+
+
+def serialise(positions, targets, sources, moves):
+    """
+    Append (positions, from squares, to squares) of every target bit to moves.
+    sources is an array of start squares, or an int: the start square is then the target square plus it.
+    """
+    nonzero = targets != 0
+    positions, targets = positions[nonzero], targets[nonzero]
+    if not isinstance(sources, int):
+        sources = sources[nonzero]
+    while len(targets):
+        to_squares = bitIndexes(targets)
+        moves.append((positions, sources if not isinstance(sources, int) else to_squares + sources, to_squares))
+        targets = targets & (targets - ONE)
+        nonzero = targets != 0
+        positions, targets = positions[nonzero], targets[nonzero]
+        if not isinstance(sources, int):
+            sources = sources[nonzero]
+
+
+def concatenateMoves(moves):
+    if not moves:
+        return (np.zeros(0, dtype=np.int64),) * 3
+    return tuple(np.concatenate(column) for column in zip(*moves))
+
+
+def generateMoves(batch):
+    """
+    The legal moves of every position of the batch as a MoveList.
+    """
+    count = len(batch)
+    all_positions = np.arange(count)
+    ours, theirs, rights, enpassant = batch.sideToMove()
+    own = np.bitwise_or.reduce(ours, axis=0)
+    enemy = np.bitwise_or.reduce(theirs, axis=0)
+    occupied = own | enemy
+    empty = ~occupied
+    king = ours[KING]
+    king_squares = bitIndexes(king)
+    their_rooks = theirs[ROOK] | theirs[QUEEN]
+    their_bishops = theirs[BISHOP] | theirs[QUEEN]
+
+    # squares the other side attacks, through our king so it can't step back along a checking line
+    empty_without_king = empty | king
+    attacked = ((theirs[PAWN] << np.uint64(9)) & NOT_FILE_A) | ((theirs[PAWN] << np.uint64(7)) & NOT_FILE_H) | \
+        knightAttacks(theirs[KNIGHT]) | kingAttacks(theirs[KING]) | \
+        slidingAttacks(their_rooks, empty_without_king, ROOK_SHIFTS) | \
+        slidingAttacks(their_bishops, empty_without_king, BISHOP_SHIFTS)
+
+    checkers = (knight_table[king_squares] & theirs[KNIGHT]) | (pawn_attacks_up[king_squares] & theirs[PAWN]) | \
+        (slidingAttacks(king, empty, ROOK_SHIFTS) & their_rooks) | \
+        (slidingAttacks(king, empty, BISHOP_SHIFTS) & their_bishops)
+    checker_count = np.bitwise_count(checkers)
+    single_checker = np.where(checker_count == 1, checkers, king)  # the king stands in for a missing checker
+    check_mask = np.where(checker_count == 0, FULL, np.where(
+        checker_count == 1, checkers | between_table[king_squares, bitIndexes(single_checker)], np.uint64(0)))
+
+    # a piece is pinned when the king's ray through it goes on to a slider of the other side
+    pinned = np.zeros(count, dtype=np.uint64)
+    for direction_index, direction in enumerate(SHIFT_DIRECTIONS):
+        sliders = their_rooks if direction_index < 4 else their_bishops
+        blockers = slidingAttacks(king, empty, (direction,)) & own
+        pinners = slidingAttacks(king, empty | blockers, (direction,)) & sliders
+        pinned |= np.where(pinners != 0, blockers, np.uint64(0))
+
+    moves = []
+    pawns = ours[PAWN]
+    single_pushes = (pawns >> np.uint64(8)) & empty
+    serialise(all_positions, single_pushes, 8, moves)
+    serialise(all_positions, ((single_pushes & ROW_5) >> np.uint64(8)) & empty, 16, moves)
+    serialise(all_positions, (pawns >> np.uint64(9)) & NOT_FILE_H & enemy, 9, moves)
+    serialise(all_positions, (pawns >> np.uint64(7)) & NOT_FILE_A & enemy, 7, moves)
+    for piece_index in (KNIGHT, BISHOP, ROOK, QUEEN):
+        remaining = ours[piece_index].copy()
+        positions = all_positions
+        while True:
+            nonzero = remaining != 0
+            positions, remaining = positions[nonzero], remaining[nonzero]
+            if not len(remaining):
+                break
+            piece = lowestBit(remaining)
+            if piece_index == KNIGHT:
+                targets = knight_table[bitIndexes(piece)]
+            else:
+                targets = slidingAttacks(piece, empty[positions], SHIFT_DIRECTIONS[
+                    4 if piece_index == BISHOP else 0:4 if piece_index == ROOK else 8])
+            serialise(positions, targets & ~own[positions], bitIndexes(piece), moves)
+            remaining = remaining ^ piece
+
+    positions, from_squares, to_squares = concatenateMoves(moves)
+    to_bits = ONE << to_squares.astype(np.uint64)
+    # moves other than the king's must capture or block a single checker and stay on the pin line of a pinned piece
+    legal = ((check_mask[positions] & to_bits) != 0) & (
+            ((pinned[positions] >> from_squares.astype(np.uint64)) & ONE == 0) |
+            ((line_table[king_squares[positions], from_squares] & to_bits) != 0))
+    positions, from_squares, to_squares = positions[legal], from_squares[legal], to_squares[legal]
+    is_pawn_move = (pawns[positions] >> from_squares.astype(np.uint64)) & ONE != 0
+    promotions = np.where(is_pawn_move & (to_squares < 8), QUEEN_PROMOTION, 0)  # onto the top row
+    columns = [(positions, from_squares, to_squares, promotions)]
+
+    king_moves = []
+    serialise(all_positions, king_table[king_squares] & ~own & ~attacked, king_squares, king_moves)
+    castling = (checker_count == 0) & (king_squares == KING_START)
+    kingside = castling & (rights & 1 != 0) & (occupied & KINGSIDE_EMPTY == 0) & (attacked & KINGSIDE_EMPTY == 0)
+    queenside = castling & (rights & 2 != 0) & (occupied & QUEENSIDE_EMPTY == 0) & (attacked & QUEENSIDE_SAFE == 0)
+    for castle_positions, to_square in ((all_positions[kingside], KING_START + 2),
+                                        (all_positions[queenside], KING_START - 2)):
+        king_moves.append((castle_positions, np.full(len(castle_positions), KING_START),
+                           np.full(len(castle_positions), to_square)))
+    for positions, from_squares, to_squares in king_moves:
+        columns.append((positions, from_squares, to_squares, np.zeros(len(positions), dtype=np.int64)))
+
+    # en-passant: make the capture on the occupancy and look for attacks on the king, this also covers
+    # the two pawns leaving the king's row together and captures of a checking pawn
+    enpassant_positions = all_positions[enpassant >= 0]
+    enpassant_squares = enpassant[enpassant_positions].astype(np.int64)
+    capturers = pawn_attacks_down[enpassant_squares] & pawns[enpassant_positions]
+    while len(enpassant_positions):
+        nonzero = capturers != 0
+        enpassant_positions, enpassant_squares, capturers = \
+            enpassant_positions[nonzero], enpassant_squares[nonzero], capturers[nonzero]
+        if not len(enpassant_positions):
+            break
+        capturer = lowestBit(capturers)
+        target = ONE << enpassant_squares.astype(np.uint64)
+        captured = target << np.uint64(8)
+        empty_after = ~(occupied[enpassant_positions] ^ capturer ^ captured ^ target)
+        their_pawns = theirs[PAWN][enpassant_positions] ^ captured
+        king_after = king[enpassant_positions]
+        safe = ((slidingAttacks(king_after, empty_after, ROOK_SHIFTS) & their_rooks[enpassant_positions]) |
+                (slidingAttacks(king_after, empty_after, BISHOP_SHIFTS) & their_bishops[enpassant_positions]) |
+                (knight_table[king_squares[enpassant_positions]] & theirs[KNIGHT][enpassant_positions]) |
+                (pawn_attacks_up[king_squares[enpassant_positions]] & their_pawns)) == 0
+        columns.append((enpassant_positions[safe], bitIndexes(capturer)[safe], enpassant_squares[safe],
+                        np.zeros(int(np.count_nonzero(safe)), dtype=np.int64)))
+        capturers = capturers ^ capturer
+
+    positions, from_squares, to_squares, promotions = (np.concatenate(column) for column in zip(*columns))
+    mirror = np.where(batch.white_to_move[positions], 0, 56)  # back to the real squares
+    codes = ((from_squares ^ mirror) | (to_squares ^ mirror) << 6 | promotions).astype(np.uint16)
+    return MoveList(positions, codes, count)
+
+
+def applyMoves(batch, positions, codes):
+    """
+    The batch of the positions after every move: position positions[i] of the batch with move codes[i] made.
+    """
+    count = len(codes)
+    moves = np.arange(count)
+    codes = codes.astype(np.int64)
+    from_squares, to_squares, promotions = codes & 63, codes >> 6 & 63, codes >> 12
+    from_bits = ONE << from_squares.astype(np.uint64)
+    to_bits = ONE << to_squares.astype(np.uint64)
+    pieces = batch.pieces[:, positions]
+    white = batch.white_to_move[positions]
+    color_offset = np.where(white, 0, 6)
+    moved = np.argmax((pieces & from_bits) != 0, axis=0)
+    is_pawn = moved == color_offset + PAWN
+    is_king = moved == color_offset + KING
+    enpassant = batch.enpassant[positions].astype(np.int64)
+    is_enpassant = is_pawn & (to_squares == enpassant) & ((from_squares & 7) != (to_squares & 7))
+
+    pieces &= ~(from_bits | to_bits)  # the moved piece leaves its square, a captured piece its square
+    placed = np.where(promotions != 0, color_offset + QUEEN, moved)
+    pieces[placed, moves] |= to_bits
+    # the pawn captured en-passant is beside the capturing pawn's start square
+    captured_squares = np.where(white, to_squares + 8, to_squares - 8)
+    pieces[(6 - color_offset + PAWN)[is_enpassant], moves[is_enpassant]] &= \
+        ~(ONE << captured_squares[is_enpassant].astype(np.uint64))
+    is_castle = is_king & (np.abs(to_squares - from_squares) == 2)
+    rook_from = np.where(to_squares > from_squares, from_squares + 3, from_squares - 4)[is_castle]
+    rook_to = np.where(to_squares > from_squares, from_squares + 1, from_squares - 1)[is_castle]
+    pieces[(color_offset + ROOK)[is_castle], moves[is_castle]] ^= \
+        (ONE << rook_from.astype(np.uint64)) | (ONE << rook_to.astype(np.uint64))
+
+    castling_rights = batch.castling_rights[positions] & castling_rights_table[from_squares] & \
+        castling_rights_table[to_squares]
+    new_enpassant = np.where(is_pawn & (np.abs(to_squares - from_squares) == 16), (from_squares + to_squares) // 2,
+                             NO_ENPASSANT).astype(np.int8)
+    return PositionBatch(pieces, ~white, castling_rights, new_enpassant)
+
+
+def perft(batch, depth, chunk=DEFAULT_CHUNK):
+    """
+    Leaf nodes of the legal move trees of the given depth of all positions of the batch together.
+    The successors are expanded chunk positions at a time to bound the memory.
+    """
+    move_list = generateMoves(batch)
+    if depth == 1:
+        return len(move_list)
+    nodes = 0
+    for start in range(0, len(move_list), chunk):
+        end = start + chunk
+        nodes += perft(applyMoves(batch, move_list.positions[start:end], move_list.codes[start:end]), depth - 1,
+                       chunk)
+    return nodes
+
+
+def crossCheck(game_states, move_list):
+    """
+    Compare the batched moves with getValidMoves of every position.
+    Returns the FENs of the positions that differ.
+    """
+    differences = []
+    for position, game_state in enumerate(game_states):
+        expected = sorted(chessIndex.encodeMove(move) for move in game_state.getValidMoves())
+        if expected != sorted(int(code) for code in move_list.movesOf(position)):
+            differences.append(game_state.getFEN())
+    return differences
+
+
+def randomPositions(count, seed=1, max_plies=120):
+    """
+    Positions of random games, a random ply of each game.
+    """
+    rng = random.Random(seed)
+    game_states = []
+    while len(game_states) < count:
+        game_state = chessEngine.GameState()
+        for _ in range(rng.randrange(max_plies)):
+            moves = game_state.getValidMoves()
+            if not moves:
+                break
+            game_state.makeMove(rng.choice(moves))
+        game_states.append(chessEngine.GameState(game_state.getFEN()))
+    return game_states
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the moves of many positions at once with NumPy.")
+    parser.add_argument("--fens", help="file with one FEN per line (default: random positions)")
+    parser.add_argument("--positions", type=int, default=2000, help="number of random positions")
+    parser.add_argument("--repeat", type=int, default=5, help="times the batch is generated for the timing")
+    parser.add_argument("--check", action="store_true", help="compare every move list with chessEngine")
+    parser.add_argument("--perft", action="store_true", help="run the perft suite with the batched generator")
+    args = parser.parse_args()
+
+    if args.perft:
+        all_passed = True
+        for name, fen, depth, expected in chessPerft.PERFT_SUITE:
+            start = time.perf_counter()
+            nodes = perft(PositionBatch.fromFENs([fen]), depth)
+            elapsed = time.perf_counter() - start
+            all_passed = all_passed and nodes == expected
+            print("{:<16} depth {}  {:>9} nodes  {:>8.2f}s  {:>9.0f} nps  {}".format(
+                name, depth, nodes, elapsed, nodes / elapsed,
+                "ok" if nodes == expected else "FAILED (expected " + str(expected) + ")"))
+        raise SystemExit(0 if all_passed else 1)
+
+    if args.fens is not None:
+        with open(args.fens) as file:
+            game_states = [chessEngine.GameState(line.strip()) for line in file if line.strip()]
+    else:
+        game_states = randomPositions(args.positions)
+    batch = PositionBatch.fromGameStates(game_states)
+    generateMoves(batch)  # warm up
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        move_list = generateMoves(batch)
+    batched_seconds = (time.perf_counter() - start) / args.repeat
+    start = time.perf_counter()
+    for game_state in game_states:
+        game_state.getValidMoves()
+    single_seconds = time.perf_counter() - start
+    print("{} positions  {} moves  batched {:.0f} positions/s  getValidMoves {:.0f} positions/s  ({:.1f}x)".format(
+        len(batch), len(move_list), len(batch) / batched_seconds, len(batch) / single_seconds,
+        single_seconds / batched_seconds))
+    if args.check:
+        differences = crossCheck(game_states, move_list)
+        for fen in differences:
+            print("differs:", fen)
+        print("{} of {} positions match chessEngine".format(len(game_states) - len(differences), len(game_states)))
+        if differences:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+"""
+Benchmarks of the engine's hot paths on a fixed set of positions.
+Every benchmark is timed several times, the samples (nanoseconds per operation) are written to JSON
+together with a fingerprint of the machine and the commit.
+The compare command tests two runs for slowdowns with a Mann-Whitney U test,
+so noise between samples is not reported as a regression.
+"""
+import argparse
+import datetime
+import gc
+import json
+import math
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import chessAI
+import chessEngine
+import chessPerft
+
+# (name, phase, FEN)
+CORPUS = [
+    ("start position", "opening", chessEngine.STARTING_FEN),
+    ("open game", "opening", "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3"),
+    ("queen's gambit", "opening", "rnbqkb1r/ppp2ppp/4pn2/3p4/2PP4/2N5/PP2PPPP/R1BQKBNR w KQkq - 2 4"),
+    ("kiwipete", "middlegame", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1"),
+    ("italian middlegame", "middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10"),
+    ("queen's gambit declined", "middlegame", "r1bq1rk1/pp2bppp/2n1pn2/3p4/2PP4/2N2N2/PP2BPPP/R2QKB1R w KQ - 0 8"),
+    ("rook endgame", "endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"),
+    ("pawn endgame", "endgame", "8/5k2/3p4/1p1Pp2p/pP2Pp1P/P4P1K/8/8 b - - 0 1"),
+    ("queen endgame", "endgame", "8/6k1/6p1/8/3Q4/6P1/5qK1/8 w - - 0 1"),
+]
+
+SEARCH_DEPTH = 3
+SEARCH_SEED = 1
+DEFAULT_REPEAT = 10
+DEFAULT_THRESHOLD = 0.03  # slowdowns smaller than this fraction of the old median are not reported
+DEFAULT_ALPHA = 0.01
+
+
+def loadCorpus(game_state_class):
+    return [game_state_class(fen) for _, _, fen in CORPUS]
+
+
+def benchMakeUndo(game_states):
+    """
+    makeMove and undoMove of every valid move of every position.
+    """
+    work = [(game_state, game_state.getValidMoves()) for game_state in game_states]
+
+    def run():
+        for game_state, moves in work:
+            make_move, undo_move = game_state.makeMove, game_state.undoMove
+            for move in moves:
+                make_move(move)
+                undo_move()
+    return run, sum(len(moves) for _, moves in work)
+
+
+def benchValidMoves(game_states):
+    def run():
+        for game_state in game_states:
+            game_state.getValidMoves()
+    return run, len(game_states)
+
+
+def benchSquareUnderAttack(game_states):
+    """
+    squareUnderAttack of every square of every position.
+    """
+    squares = [(row, col) for row in range(8) for col in range(8)]
+
+    def run():
+        for game_state in game_states:
+            square_under_attack = game_state.squareUnderAttack
+            for row, col in squares:
+                square_under_attack(row, col)
+    return run, len(game_states) * len(squares)
+
+
+def benchPinsAndChecks(game_states):
+    def run():
+        for game_state in game_states:
+            game_state.checkForPinsAndChecks()
+    return run, len(game_states)
+
+
+def benchScoreBoard(game_states):
+    """
+    scoreBoard of every position and of the positions after each of their moves,
+    with the evaluation cache cleared before every sample so each position is evaluated once.
+    """
+    positions = []
+    for game_state in game_states:
+        positions.append(game_state.getFEN())
+        for move in game_state.getValidMoves():
+            game_state.makeMove(move)
+            positions.append(game_state.getFEN())
+            game_state.undoMove()
+    work = [type(game_states[0])(fen) for fen in positions]
+    for game_state in work:
+        game_state.hasLegalMove()  # the leaves of the search know about checkmate and stalemate
+
+    def setUp():
+        chessAI.evaluation_cache.clear()
+        chessAI.pawn_hash_table.clear()
+
+    def run():
+        for game_state in work:
+            chessAI.scoreBoard(game_state)
+    return run, len(work), setUp
+
+
+def benchSearch(game_states, pseudo_legal=False):
+    """
+    A search of every position to SEARCH_DEPTH with a fixed seed, nanoseconds per node.
+    The node count is part of the result, a different count means the search itself changed.
+    """
+    nodes = []
+
+    def setUp():
+        chessAI.evaluation_cache.clear()
+        chessAI.pawn_hash_table.clear()
+        random.seed(SEARCH_SEED)
+        nodes.clear()
+
+    def run():
+        for game_state in game_states:
+            nodes.append(chessAI.findBestMoveWithLimits(game_state, game_state.getValidMoves(), SEARCH_DEPTH,
+                                                        pseudo_legal=pseudo_legal)[2])
+    setUp()
+    run()
+    return run, sum(nodes), setUp
+
+
+def benchSearchPseudoLegal(game_states):
+    """
+    The search benchmark with pseudo-legal move generation, to compare its nodes per second with the legal one.
+    """
+    return benchSearch(game_states, pseudo_legal=True)
+
+
+BENCHMARKS = {
+    "make_undo": benchMakeUndo,
+    "valid_moves": benchValidMoves,
+    "square_under_attack": benchSquareUnderAttack,
+    "pins_and_checks": benchPinsAndChecks,
+    "score_board": benchScoreBoard,
+    "search": benchSearch,
+    "search_pseudo_legal": benchSearchPseudoLegal,
+}
+
+
+def measure(benchmark, repeat, min_sample_time=0.2):
+    """
+    Samples of nanoseconds per operation. Every sample runs the benchmark often enough to take
+    at least min_sample_time, with the garbage collector off like timeit does.
+    """
+    run, operations = benchmark[:2]
+    set_up = benchmark[2] if len(benchmark) > 2 else None
+    if set_up is not None:
+        set_up()
+    start = time.perf_counter()
+    run()
+    loops = max(1, math.ceil(min_sample_time / max(time.perf_counter() - start, 1e-9)))
+    samples = []
+    for _ in range(repeat):
+        elapsed = 0
+        gc.collect()
+        gc.disable()
+        try:
+            for _ in range(loops):
+                if set_up is not None:
+                    set_up()
+                start = time.perf_counter_ns()
+                run()
+                elapsed += time.perf_counter_ns() - start
+        finally:
+            gc.enable()
+        samples.append(elapsed / (loops * operations))
+    return samples, operations
+
+
+def machineFingerprint():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"platform": platform.platform(), "machine": platform.machine(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "python": platform.python_version(),
+            "implementation": platform.python_implementation(), "node": platform.node(), "commit": commit}
+
+
+def runSuite(game_state_class, names, repeat, verbose=True):
+    results = {}
+    for name in names:
+        game_states = loadCorpus(game_state_class)
+        samples, operations = measure(BENCHMARKS[name](game_states), repeat)
+        results[name] = {"operations": operations, "median_ns": statistics.median(samples),
+                         "min_ns": min(samples), "samples_ns": samples}
+        if verbose:
+            print("{:<20} {:>10} ops  median {:>10.1f} ns/op  min {:>10.1f} ns/op".format(
+                name, operations, results[name]["median_ns"], results[name]["min_ns"]), flush=True)
+    return results
+
+
+def mannWhitneyGreater(old, new):
+    """
+    One-sided p-value of the Mann-Whitney U test that the new samples are larger than the old ones,
+    with the normal approximation and average ranks for ties.
+    """
+    values = sorted([(value, 0) for value in old] + [(value, 1) for value in new])
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(values):
+        j = i
+        while j + 1 < len(values) and values[j + 1][0] == values[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        i = j + 1
+    rank_sum = sum(rank for rank, (_, group) in zip(ranks, values) if group == 1)
+    n_old, n_new = len(old), len(new)
+    u = rank_sum - n_new * (n_new + 1) / 2
+    mean = n_old * n_new / 2
+    deviation = math.sqrt(n_old * n_new * (n_old + n_new + 1) / 12)
+    if deviation == 0:
+        return 1.0
+    z = (u - mean - 0.5) / deviation  # with continuity correction
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compareRuns(old_run, new_run, threshold=DEFAULT_THRESHOLD, alpha=DEFAULT_ALPHA):
+    """
+    Print the change of every benchmark in both runs. Returns the names of the significant slowdowns.
+    """
+    if old_run["machine"] != new_run["machine"] or old_run["backend"] != new_run["backend"]:
+        print("warning: the runs are from different machines, Python versions or backends")
+    regressions = []
+    for name, new in new_run["results"].items():
+        old = old_run["results"].get(name)
+        if old is None:
+            continue
+        change = new["median_ns"] / old["median_ns"] - 1
+        p_slower = mannWhitneyGreater(old["samples_ns"], new["samples_ns"])
+        p_faster = mannWhitneyGreater(new["samples_ns"], old["samples_ns"])
+        if change > threshold and p_slower < alpha:
+            verdict = "SLOWER"
+            regressions.append(name)
+        elif change < -threshold and p_faster < alpha:
+            verdict = "faster"
+        else:
+            verdict = ""
+        note = "  (operations {} -> {})".format(old["operations"], new["operations"]) \
+            if old["operations"] != new["operations"] else ""
+        print("{:<20} {:>10.1f} -> {:>10.1f} ns/op  {:>+7.1%}  p {:.4f}  {}{}".format(
+            name, old["median_ns"], new["median_ns"], change, min(p_slower, p_faster), verdict, note))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the engine's hot paths and compare runs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    run_parser = subparsers.add_parser("run", help="run the benchmarks and write the results as JSON")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="samples per benchmark")
+    run_parser.add_argument("--backend", choices=sorted(chessPerft.BACKENDS), default="strings")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="benchmarks to run")
+    compare_parser = subparsers.add_parser("compare", help="report significant changes between two runs")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="smallest relative change of the median that is reported")
+    compare_parser.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="significance level")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = runSuite(chessPerft.BACKENDS[args.backend], args.only or list(BENCHMARKS), args.repeat)
+        run = {"date": datetime.datetime.now().isoformat(timespec="seconds"), "machine": machineFingerprint(),
+               "backend": args.backend, "search_depth": SEARCH_DEPTH, "search_seed": SEARCH_SEED,
+               "corpus": [fen for _, _, fen in CORPUS], "results": results}
+        with open(args.output, "w") as file:
+            json.dump(run, file, indent=1)
+        print("written to", args.output)
+    else:
+        with open(args.old) as file:
+            old_run = json.load(file)
+        with open(args.new) as file:
+            new_run = json.load(file)
+        # machine fingerprints differ in the commit, which is expected between runs
+        old_run["machine"] = dict(old_run["machine"], commit=None)
+        new_run["machine"] = dict(new_run["machine"], commit=None)
+        regressions = compareRuns(old_run, new_run, args.threshold, args.alpha)
+        if regressions:
+            print("significant slowdowns:", ", ".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
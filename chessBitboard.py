@@ -0,0 +1,340 @@
+"""
+Game state with bitboard move generation.
+Next to the 8x8 list of strings the position is kept in 12 piece bitboards and 2 colour occupancy masks,
+Python ints where bit row * 8 + col is set for an occupied square.
+Sliding attacks come from the classical ray lookup: the ray of a direction minus the ray behind its first blocker.
+Legal moves are generated with a check mask (the squares that capture or block the checking piece)
+and pin lines, so no move has to be made to test whether it leaves the king attacked.
+The string board stays the one makeMove, undoMove, Move and the GUI work with, the bitboards follow it.
+"""
+import chessEngine
+from chessEngine import Move
+from chessTables import DIRECTIONS, knight_targets, king_targets, pawn_attacks, rays, between_squares, line_through
+
+FULL_BOARD = (1 << 64) - 1
+FILE_A = sum(1 << (row * 8) for row in range(8))
+FILE_H = FILE_A << 7
+ROW_MASKS = tuple(0xFF << (row * 8) for row in range(8))
+PIECE_NAMES = tuple(color + piece_type for color in "wb" for piece_type in "pNBRQK")
+square_coordinates = tuple(divmod(square, 8) for square in range(64))
+bit_coordinates = {1 << square: divmod(square, 8) for square in range(64)}  # (row, col) of a single bit
+
+
+def squareMask(squares):
+    mask = 0
+    for row, col in squares:
+        mask |= 1 << (row * 8 + col)
+    return mask
+
+
+knight_attacks = tuple(squareMask(knight_targets[square]) for square in range(64))
+king_attacks = tuple(squareMask(king_targets[square]) for square in range(64))
+pawn_attack_masks = {color: tuple(squareMask(pawn_attacks[color][square]) for square in range(64)) for color in "wb"}
+between_masks = tuple(tuple(squareMask(between_squares[a][b]) for b in range(64)) for a in range(64))
+line_masks = tuple(tuple(squareMask(line_through[a][b]) for b in range(64)) for a in range(64))
+# ray_masks[direction][square], the directions are those of chessTables.DIRECTIONS
+ray_masks = tuple(tuple(squareMask(rays[square][direction]) for square in range(64)) for direction in range(8))
+# directions going to higher square numbers meet their first blocker at the lowest set bit
+INCREASING_DIRECTIONS = tuple(row_step * 8 + col_step > 0 for row_step, col_step in DIRECTIONS)
+ROOK_DIRECTIONS = tuple((ray_masks[direction], INCREASING_DIRECTIONS[direction]) for direction in range(4))
+BISHOP_DIRECTIONS = tuple((ray_masks[direction], INCREASING_DIRECTIONS[direction]) for direction in range(4, 8))
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + BISHOP_DIRECTIONS
+# the squares a rook or bishop attacks on an empty board
+rook_lines = tuple(ray_masks[0][square] | ray_masks[1][square] | ray_masks[2][square] | ray_masks[3][square]
+                   for square in range(64))
+bishop_lines = tuple(ray_masks[4][square] | ray_masks[5][square] | ray_masks[6][square] | ray_masks[7][square]
+                     for square in range(64))
+
+
+def slidingAttacks(square, occupied, directions):
+    attacks = 0
+    for direction_rays, increasing in directions:
+        ray = direction_rays[square]
+        blockers = ray & occupied
+        if blockers:
+            if increasing:
+                first_blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                first_blocker = blockers.bit_length() - 1
+            ray ^= direction_rays[first_blocker]  # squares behind the blocker are not attacked
+        attacks |= ray
+    return attacks
+
+
+def rookAttacks(square, occupied):
+    return slidingAttacks(square, occupied, ROOK_DIRECTIONS)
+
+
+def bishopAttacks(square, occupied):
+    return slidingAttacks(square, occupied, BISHOP_DIRECTIONS)
+
+
+class BitboardGameState(chessEngine.GameState):
+    """
+    GameState with getValidMoves working on bitboards.
+    pieces maps every piece ("wp", "bK", ...) to its bitboard and occupancy maps "w" and "b" to their pieces.
+    """
+
+    def __init__(self, fen=None):
+        self.pieces = {}
+        self.occupancy = {}
+        super().__init__(fen)
+        self.syncBitboards()
+
+    def syncBitboards(self):
+        """
+        Set the bitboards from the string board.
+        """
+        self.pieces = {piece: 0 for piece in PIECE_NAMES}
+        self.occupancy = {"w": 0, "b": 0}
+        for square in range(64):
+            piece = self.board[square >> 3][square & 7]
+            if piece != "--":
+                self.pieces[piece] |= 1 << square
+                self.occupancy[piece[0]] |= 1 << square
+
+    def loadFEN(self, fen):
+        super().loadFEN(fen)
+        self.syncBitboards()
+
+    @staticmethod
+    def changedSquares(move):
+        """
+        Squares a move changes.
+        """
+        squares = [move.start_row * 8 + move.start_col, move.end_row * 8 + move.end_col]
+        if move.is_enpassant_move:
+            squares.append(move.start_row * 8 + move.end_col)
+        elif move.is_castle_move:
+            if move.end_col == 6:
+                squares += [move.end_row * 8 + 5, move.end_row * 8 + 7]
+            else:
+                squares += [move.end_row * 8, move.end_row * 8 + 3]
+        return squares
+
+    def updateBitboards(self, squares, pieces_before):
+        for square, before in zip(squares, pieces_before):
+            after = self.board[square >> 3][square & 7]
+            if before != after:
+                bit = 1 << square
+                if before != "--":
+                    self.pieces[before] ^= bit
+                    self.occupancy[before[0]] ^= bit
+                if after != "--":
+                    self.pieces[after] ^= bit
+                    self.occupancy[after[0]] ^= bit
+
+    def makeMove(self, move):
+        squares = self.changedSquares(move)
+        pieces_before = [self.board[square >> 3][square & 7] for square in squares]
+        super().makeMove(move)
+        self.updateBitboards(squares, pieces_before)
+
+    def undoMove(self):
+        if len(self.move_log) != 0:
+            squares = self.changedSquares(self.move_log[-1])
+            pieces_before = [self.board[square >> 3][square & 7] for square in squares]
+            super().undoMove()
+            self.updateBitboards(squares, pieces_before)
+
+    def attackersTo(self, square, enemy_color, occupied):
+        """
+        Bitboard of the pieces of enemy_color attacking the square, with the given occupancy for the sliders.
+        """
+        pieces = self.pieces
+        ally_color = "b" if enemy_color == "w" else "w"
+        return (knight_attacks[square] & pieces[enemy_color + "N"]) | (
+                king_attacks[square] & pieces[enemy_color + "K"]) | (
+                pawn_attack_masks[ally_color][square] & pieces[enemy_color + "p"]) | (
+                rookAttacks(square, occupied) & (pieces[enemy_color + "R"] | pieces[enemy_color + "Q"])) | (
+                bishopAttacks(square, occupied) & (pieces[enemy_color + "B"] | pieces[enemy_color + "Q"]))
+
+    def isAttacked(self, square, enemy_color, occupied):
+        """
+        Same as attackersTo(...) != 0, stopping at the first kind of piece found attacking.
+        """
+        pieces = self.pieces
+        if knight_attacks[square] & pieces[enemy_color + "N"] or king_attacks[square] & pieces[enemy_color + "K"] or \
+                pawn_attack_masks["b" if enemy_color == "w" else "w"][square] & pieces[enemy_color + "p"]:
+            return True
+        sliders = pieces[enemy_color + "B"] | pieces[enemy_color + "Q"]
+        if sliders and slidingAttacks(square, occupied, BISHOP_DIRECTIONS) & sliders:
+            return True
+        sliders = pieces[enemy_color + "R"] | pieces[enemy_color + "Q"]
+        return bool(sliders and slidingAttacks(square, occupied, ROOK_DIRECTIONS) & sliders)
+
+    def squareUnderAttack(self, row, col):
+        enemy_color = "b" if self.white_to_move else "w"
+        return self.isAttacked(row * 8 + col, enemy_color, self.occupancy["w"] | self.occupancy["b"])
+
+    def inCheck(self):
+        ally_color = "w" if self.white_to_move else "b"
+        king_square = self.pieces[ally_color + "K"].bit_length() - 1
+        return self.squareUnderAttack(king_square >> 3, king_square & 7)
+
+    def hasLegalMove(self):
+        return len(self.getValidMoves()) > 0
+
+    def getValidMoves(self):
+        """
+        All moves considering checks.
+        """
+        moves = []
+        board = self.board
+        pieces = self.pieces
+        if self.white_to_move:
+            ally_color, enemy_color, forward, pawn_start_row = "w", "b", -8, 6
+        else:
+            ally_color, enemy_color, forward, pawn_start_row = "b", "w", 8, 1
+        own = self.occupancy[ally_color]
+        enemy = self.occupancy[enemy_color]
+        occupied = own | enemy
+        king_square = pieces[ally_color + "K"].bit_length() - 1
+        king_start = square_coordinates[king_square]
+        enemy_rooks = pieces[enemy_color + "R"] | pieces[enemy_color + "Q"]
+        enemy_bishops = pieces[enemy_color + "B"] | pieces[enemy_color + "Q"]
+        checkers = (knight_attacks[king_square] & pieces[enemy_color + "N"]) | (
+                pawn_attack_masks[ally_color][king_square] & pieces[enemy_color + "p"])
+
+        # enemy sliders on a line with the king give check when nothing is between them,
+        # and pin the piece between them when it is a single ally piece
+        pinned = 0
+        snipers = (rook_lines[king_square] & enemy_rooks) | (bishop_lines[king_square] & enemy_bishops)
+        while snipers:
+            sniper = snipers & -snipers
+            snipers ^= sniper
+            blockers = between_masks[king_square][sniper.bit_length() - 1] & occupied
+            if blockers == 0:
+                checkers |= sniper
+            elif blockers & own and blockers & (blockers - 1) == 0:
+                pinned |= blockers
+
+        # squares the other pieces may move to: anywhere, only onto the check line or nowhere in double check
+        if checkers == 0:
+            target_mask = ~own & FULL_BOARD
+        elif checkers & (checkers - 1) == 0:
+            target_mask = between_masks[king_square][checkers.bit_length() - 1] | checkers
+        else:
+            target_mask = 0
+
+        if target_mask:
+            # target_mask has no ally pieces: without check it is every other square, in check the checking line
+            bitboard = pieces[ally_color + "N"] & ~pinned  # a pinned knight can't move
+            while bitboard:
+                bit = bitboard & -bitboard
+                bitboard ^= bit
+                square = bit.bit_length() - 1
+                targets = knight_attacks[square] & target_mask
+                start = square_coordinates[square]
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    moves.append(Move(start, bit_coordinates[target], board))
+            for piece, directions in ((ally_color + "B", BISHOP_DIRECTIONS), (ally_color + "R", ROOK_DIRECTIONS),
+                                      (ally_color + "Q", QUEEN_DIRECTIONS)):
+                bitboard = pieces[piece]
+                while bitboard:
+                    bit = bitboard & -bitboard
+                    bitboard ^= bit
+                    square = bit.bit_length() - 1
+                    targets = slidingAttacks(square, occupied, directions) & target_mask
+                    if bit & pinned:
+                        targets &= line_masks[king_square][square]
+                    start = square_coordinates[square]
+                    while targets:
+                        target = targets & -targets
+                        targets ^= target
+                        moves.append(Move(start, bit_coordinates[target], board))
+
+            # pawns that are not pinned are moved all at once by shifting their bitboard
+            pawns = pieces[ally_color + "p"]
+            free_pawns = pawns & ~pinned
+            if self.white_to_move:
+                single_pushes = (free_pawns >> 8) & ~occupied
+                double_pushes = ((single_pushes & ROW_MASKS[5]) >> 8) & ~occupied
+                left_captures = ((free_pawns & ~FILE_A) >> 9) & enemy
+                right_captures = ((free_pawns & ~FILE_H) >> 7) & enemy
+            else:
+                single_pushes = (free_pawns << 8) & ~occupied & FULL_BOARD
+                double_pushes = ((single_pushes & ROW_MASKS[2]) << 8) & ~occupied
+                left_captures = ((free_pawns & ~FILE_A) << 7) & enemy
+                right_captures = ((free_pawns & ~FILE_H) << 9) & enemy
+            for targets, distance in ((single_pushes, forward), (double_pushes, 2 * forward),
+                                      (left_captures, forward - 1), (right_captures, forward + 1)):
+                targets &= target_mask
+                while targets:
+                    target = targets & -targets
+                    targets ^= target
+                    target_square = target.bit_length() - 1
+                    moves.append(Move(square_coordinates[target_square - distance], square_coordinates[target_square],
+                                      board))
+            bitboard = pawns & pinned
+            while bitboard:
+                bit = bitboard & -bitboard
+                bitboard ^= bit
+                square = bit.bit_length() - 1
+                start = square_coordinates[square]
+                allowed = target_mask & line_masks[king_square][square]
+                target = square + forward
+                if not occupied >> target & 1:  # pawn advances
+                    if allowed >> target & 1:
+                        moves.append(Move(start, square_coordinates[target], board))
+                    if start[0] == pawn_start_row and not occupied >> (target + forward) & 1 and \
+                            allowed >> (target + forward) & 1:
+                        moves.append(Move(start, square_coordinates[target + forward], board))
+                captures = pawn_attack_masks[ally_color][square] & enemy & allowed
+                while captures:
+                    capture = captures & -captures
+                    captures ^= capture
+                    moves.append(Move(start, square_coordinates[capture.bit_length() - 1], board))
+            if self.enpassant_possible != ():
+                enpassant_square = self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+                captured = 1 << (enpassant_square - forward)
+                # the ally pawns attacking the square are on the squares an enemy pawn on it would attack
+                bitboard = pawn_attack_masks[enemy_color][enpassant_square] & pawns
+                while bitboard:
+                    bit = bitboard & -bitboard
+                    bitboard ^= bit
+                    # both pawns leave their squares, look at the king's attackers on the resulting board
+                    occupied_after = (occupied ^ bit ^ captured) | 1 << enpassant_square
+                    if not (knight_attacks[king_square] & pieces[enemy_color + "N"]) and not (
+                            pawn_attack_masks[ally_color][king_square] & pieces[enemy_color + "p"] & ~captured) and \
+                            not (rookAttacks(king_square, occupied_after) & enemy_rooks) and \
+                            not (bishopAttacks(king_square, occupied_after) & enemy_bishops):
+                        moves.append(Move(square_coordinates[bit.bit_length() - 1], self.enpassant_possible, board,
+                                          is_enpassant_move=True))
+
+        # king moves, with the king taken off the board so it does not hide squares behind it from sliders
+        occupied_without_king = occupied ^ (1 << king_square)
+        targets = king_attacks[king_square] & ~own
+        while targets:
+            target = targets & -targets
+            targets ^= target
+            target_square = target.bit_length() - 1
+            if not self.isAttacked(target_square, enemy_color, occupied_without_king):
+                moves.append(Move(king_start, square_coordinates[target_square], board))
+
+        if checkers == 0:
+            self.getCastleMoves(king_start[0], king_start[1], moves)
+
+        self.in_check = checkers != 0
+        self.checkmate = len(moves) == 0 and self.in_check
+        self.stalemate = len(moves) == 0 and not self.in_check
+        return moves
+
+    def getCastleMoves(self, row, col, moves):
+        """
+        Castle moves of the king at row col when it is not in check.
+        """
+        square = row * 8 + col
+        occupied = self.occupancy["w"] | self.occupancy["b"]
+        enemy_color = "b" if self.white_to_move else "w"
+        if self.castling_rights & (chessEngine.WHITE_KINGSIDE if self.white_to_move else chessEngine.BLACK_KINGSIDE):
+            if not occupied & (3 << (square + 1)) and not self.isAttacked(square + 1, enemy_color, occupied) and \
+                    not self.isAttacked(square + 2, enemy_color, occupied):
+                moves.append(Move((row, col), (row, col + 2), self.board, is_castle_move=True))
+        if self.castling_rights & (
+                chessEngine.WHITE_QUEENSIDE if self.white_to_move else chessEngine.BLACK_QUEENSIDE):
+            if not occupied & (7 << (square - 3)) and not self.isAttacked(square - 1, enemy_color, occupied) and \
+                    not self.isAttacked(square - 2, enemy_color, occupied):
+                moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
@@ -0,0 +1,233 @@
+"""
+Opening book built from a PGN archive.
+The builder streams the games, replays the first plies of each and counts every (position, move) pair
+with the wins, draws and losses of the games it was played in, seen from the side that played it.
+The counts are kept in memory up to a limit, then sorted and spilled to temporary run files that are
+merged at the end, so archives of any size can be built with bounded memory.
+Pairs played in fewer than a minimum number of games are left out, the rest are written as fixed-width
+records sorted by Zobrist key and move, which the book reader memory-maps and binary-searches like chessIndex.
+"""
+import argparse
+import bisect
+import heapq
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import time
+import chessIndex
+import chessPGN
+
+MAGIC = b"CHESSBOK"
+HEADER = struct.Struct(">8sQHI")  # magic, number of records, plies replayed per game, minimum games per move
+RECORD = struct.Struct(">QHIII")  # position key, move, wins, draws and losses of the side that played it
+ENTRY_SIZE = 10  # bytes of the key and the move, records with the same ones are counts of the same pair
+DEFAULT_PLIES = 20
+DEFAULT_MIN_GAMES = 3
+DEFAULT_MAX_ENTRIES = 1000000  # pairs counted in memory before they are spilled to a run file
+WIN, DRAW, LOSS = 0, 1, 2
+# outcome of the game for white and for black by result
+RESULT_OUTCOMES = {"1-0": (WIN, LOSS), "0-1": (LOSS, WIN), "1/2-1/2": (DRAW, DRAW)}
+
+
+def bookEntries(task):
+    """
+    (key << 16 | move code, outcome for the player of the move) of the first plies of a game.
+    Runs in a worker process. Games without a result and moves after an illegal move are left out.
+    """
+    game, plies = task
+    outcomes = RESULT_OUTCOMES.get(game.result)
+    if outcomes is None:
+        return []
+    entries = []
+    try:
+        for game_state, _, move in game.replay():
+            if len(entries) == plies:
+                break
+            entries.append((game_state.zobrist_key << 16 | chessIndex.encodeMove(move),
+                            outcomes[0 if game_state.white_to_move else 1]))
+    except ValueError:
+        pass
+    return entries
+
+
+def spill(counts, directory):
+    """
+    Write the counts as a sorted run file, returns its path.
+    """
+    return chessIndex.writeRun([RECORD.pack(entry >> 16, entry & 0xFFFF, *outcomes)
+                                for entry, outcomes in counts.items()], directory)
+
+
+def mergeCounts(records, output, min_games):
+    """
+    Add up the counts of the sorted records of the same pair and write the pairs played in at least min_games.
+    Returns the number of records written.
+    """
+    count = 0
+    buffer = []
+    entry = None
+    totals = [0, 0, 0]
+
+    def flush():
+        if entry is not None and sum(totals) >= min_games:
+            buffer.append(entry + struct.pack(">III", *totals))
+
+    for record in records:
+        if record[:ENTRY_SIZE] != entry:
+            flush()
+            if len(buffer) >= chessIndex.MERGE_BUFFER_RECORDS:
+                output.write(b"".join(buffer))
+                count += len(buffer)
+                buffer = []
+            entry = record[:ENTRY_SIZE]
+            totals = [0, 0, 0]
+        _, _, wins, draws, losses = RECORD.unpack(record)
+        totals[WIN] += wins
+        totals[DRAW] += draws
+        totals[LOSS] += losses
+    flush()
+    output.write(b"".join(buffer))
+    return count + len(buffer)
+
+
+def buildBook(pgn_paths, book_path, plies=DEFAULT_PLIES, min_games=DEFAULT_MIN_GAMES, workers=1,
+              max_entries=DEFAULT_MAX_ENTRIES, verbose=True):
+    """
+    Build a book of the first plies of the games of the PGN files.
+    Returns (games, positions counted, records written).
+    """
+    directory = os.path.dirname(os.path.abspath(book_path))
+    run_paths = []
+    counts = {}
+    games = positions = 0
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        tasks = ((game, plies) for path in pgn_paths for game in chessPGN.readGames(path))
+        results = pool.imap(bookEntries, tasks, 16) if pool is not None else map(bookEntries, tasks)
+        for entries in results:
+            games += 1
+            positions += len(entries)
+            for entry, outcome in entries:
+                outcomes = counts.get(entry)
+                if outcomes is None:
+                    outcomes = counts[entry] = [0, 0, 0]
+                outcomes[outcome] += 1
+            if len(counts) >= max_entries:
+                run_paths.append(spill(counts, directory))
+                counts = {}
+            if verbose and games % 10000 == 0:
+                elapsed = time.perf_counter() - start
+                print("{} games  {} positions  {} runs  {:.0f} games/s".format(
+                    games, positions, len(run_paths), games / elapsed), flush=True)
+        in_memory = sorted(RECORD.pack(entry >> 16, entry & 0xFFFF, *outcomes) for entry, outcomes in counts.items())
+        counts = {}
+        temporary_path = "{}.{}.tmp".format(book_path, os.getpid())
+        with open(temporary_path, "wb") as output:
+            output.write(HEADER.pack(MAGIC, 0, plies, min_games))
+            records = heapq.merge(in_memory, *(chessIndex.readRun(path, RECORD.size) for path in run_paths))
+            count = mergeCounts(records, output, min_games)
+            output.seek(0)
+            output.write(HEADER.pack(MAGIC, count, plies, min_games))
+        os.replace(temporary_path, book_path)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for path in run_paths:
+            os.remove(path)
+    return games, positions, count
+
+
+class OpeningBook:
+    """
+    Read access to a book written by buildBook.
+    """
+
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.plies, self.min_games = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not an opening book: " + path)
+        self.keys = chessIndex.KeyView(self.data, self.count, HEADER.size, RECORD.size)
+
+    def lookup(self, key):
+        """
+        (move code, wins, draws, losses) of every move of the position with the Zobrist key.
+        """
+        target = key.to_bytes(chessIndex.KEY_SIZE, "big")
+        first = bisect.bisect_left(self.keys, target)
+        last = bisect.bisect_right(self.keys, target, first)
+        records = self.data[HEADER.size + first * RECORD.size:HEADER.size + last * RECORD.size]
+        return [(move_code, wins, draws, losses) for _, move_code, wins, draws, losses in RECORD.iter_unpack(records)]
+
+    def bookMoves(self, game_state, valid_moves):
+        """
+        (move, wins, draws, losses) of the valid moves that are in the book, the most played first.
+        """
+        moves = {chessIndex.encodeMove(move): move for move in valid_moves}
+        entries = [(moves[code], wins, draws, losses) for code, wins, draws, losses in
+                   self.lookup(game_state.zobrist_key) if code in moves]
+        entries.sort(key=lambda entry: entry[1] + entry[2] + entry[3], reverse=True)
+        return entries
+
+    def chooseMove(self, game_state, valid_moves, rng=random):
+        """
+        A book move picked at random in proportion to the games it was played in, or None when out of book.
+        """
+        entries = self.bookMoves(game_state, valid_moves)
+        if not entries:
+            return None
+        return rng.choices([entry[0] for entry in entries],
+                           [entry[1] + entry[2] + entry[3] for entry in entries])[0]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query an opening book of a PGN archive.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="count the opening moves of PGN files")
+    build_parser.add_argument("pgn", nargs="+")
+    build_parser.add_argument("--output", default="book.bin")
+    build_parser.add_argument("--plies", type=int, default=DEFAULT_PLIES, help="plies of every game to count")
+    build_parser.add_argument("--min-games", type=int, default=DEFAULT_MIN_GAMES,
+                              help="moves played in fewer games are left out")
+    build_parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    build_parser.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES,
+                              help="pairs counted in memory before they are written to a temporary run file")
+    query_parser = subparsers.add_parser("query", help="book moves of a position")
+    query_parser.add_argument("book")
+    query_parser.add_argument("moves", nargs="*", help="moves from the start position, e.g. e2e4 e7e5 or e4 e5")
+    query_parser.add_argument("--fen", help="position to start the moves from")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        games, positions, count = buildBook(args.pgn, args.output, args.plies, args.min_games, args.workers,
+                                            args.max_entries)
+        elapsed = time.perf_counter() - start
+        print("{} games  {} positions  {} book moves in {:.1f}s, {:.0f} games/s".format(
+            games, positions, count, elapsed, games / elapsed))
+    else:
+        book = OpeningBook(args.book)
+        game_state = chessIndex.setUpPosition(args.fen, args.moves)
+        valid_moves = game_state.getValidMoves()
+        entries = book.bookMoves(game_state, valid_moves)
+        if not entries:
+            print("out of book")
+        for move, wins, draws, losses in entries:
+            games = wins + draws + losses
+            print("  {:<8} {:>8} games  {:5.1%} won  {:5.1%} drawn  {:5.1%} lost".format(
+                chessPGN.moveToSAN(game_state, move, valid_moves), games, wins / games, draws / games,
+                losses / games))
+        book.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Persistent cache of search results.
+Entries are keyed by the Zobrist hash of the position and hold the depth searched, the score for the side
+to move, whether the score is exact or a bound, the best move, and the nodes and seconds the search took.
+The cache is an SQLite database in WAL mode, so any number of processes can read it while one writes.
+Results of a search are kept in memory and written in one transaction when the search ends.
+TranspositionTable is the same without the database, for results that are only needed during one task.
+"""
+import sqlite3
+
+EXACT, LOWER_BOUND, UPPER_BOUND = 0, 1, 2
+SCHEMA_VERSION = 1
+BUSY_TIMEOUT = 30  # seconds a writer waits for another process to finish its transaction
+
+
+def toSigned(key):
+    """
+    SQLite integers are signed 64-bit, Zobrist keys are unsigned.
+    """
+    return key - (1 << 64) if key >= 1 << 63 else key
+
+
+class AnalysisCache:
+    """
+    signature identifies the evaluation the results were searched with,
+    entries with a different signature are stale and treated as missing.
+    An entry is replaced by a search of the same position to at least the same depth, or when it is stale.
+    """
+
+    def __init__(self, path, signature=0):
+        self.path = path
+        self.signature = signature
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS analysis (key INTEGER PRIMARY KEY, signature INTEGER, "
+                                "depth INTEGER, score REAL, bound INTEGER, move INTEGER, nodes INTEGER, "
+                                "seconds REAL)")
+        self.connection.execute("PRAGMA user_version={}".format(SCHEMA_VERSION))
+        self.pending = {}  # results of the current search that are not written yet
+        self.probes = self.hits = self.nodes_saved = 0
+        self.seconds_saved = 0.0
+
+    def probe(self, key):
+        """
+        Returns (depth, score, bound, move id, nodes, seconds) or None.
+        """
+        self.probes += 1
+        entry = self.pending.get(key)
+        if entry is not None:
+            return entry
+        return self.connection.execute("SELECT depth, score, bound, move, nodes, seconds FROM analysis "
+                                       "WHERE key = ? AND signature = ?", (toSigned(key), self.signature)).fetchone()
+
+    def recordHit(self, entry):
+        self.hits += 1
+        self.nodes_saved += entry[4]
+        self.seconds_saved += entry[5]
+
+    def store(self, key, depth, score, bound, move_id, nodes, seconds):
+        entry = self.pending.get(key)
+        if entry is None or depth >= entry[0]:
+            self.pending[key] = (depth, score, bound, move_id, nodes, seconds)
+
+    def flush(self):
+        if not self.pending:
+            return
+        rows = [(toSigned(key), self.signature) + entry for key, entry in self.pending.items()]
+        self.pending = {}
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.executemany(
+                "INSERT INTO analysis VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+                "signature = excluded.signature, depth = excluded.depth, score = excluded.score, "
+                "bound = excluded.bound, move = excluded.move, nodes = excluded.nodes, seconds = excluded.seconds "
+                "WHERE excluded.depth >= analysis.depth OR excluded.signature != analysis.signature", rows)
+
+    def takeStats(self):
+        """
+        Returns (probes, hits, nodes saved, seconds saved) since the last call and resets them.
+        The saved nodes and seconds are what the searches of the cached results took.
+        """
+        stats = self.probes, self.hits, self.nodes_saved, self.seconds_saved
+        self.probes = self.hits = self.nodes_saved = 0
+        self.seconds_saved = 0.0
+        return stats
+
+    def __len__(self):
+        return self.connection.execute("SELECT COUNT(*) FROM analysis").fetchone()[0]
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+class TranspositionTable(AnalysisCache):
+    """
+    An analysis cache in memory for the searches of one task, for example the passes of a MultiPV search.
+    """
+
+    def __init__(self):
+        self.signature = 0
+        self.pending = {}
+        self.probes = self.hits = self.nodes_saved = 0
+        self.seconds_saved = 0.0
+
+    def probe(self, key):
+        self.probes += 1
+        return self.pending.get(key)
+
+    def flush(self):
+        pass
+
+    def __len__(self):
+        return len(self.pending)
+
+    def close(self):
+        self.pending = {}
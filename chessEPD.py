@@ -0,0 +1,147 @@
+"""
+Runner for EPD test suites such as WAC.
+Every position has best moves (bm) or moves to avoid (am). The positions are searched on a process pool
+with a time or node limit per position, and a position counts as solved when the search ends on a right move.
+The time to solution is when the search settled on a right move: the end of the first iteration
+from which on every iteration chose a right move.
+"""
+import argparse
+import multiprocessing
+import re
+import time
+import chessAI
+import chessEngine
+import chessPGN
+
+MAX_DEPTH = 64  # the search depth when a time or node limit ends the search
+
+operation_pattern = re.compile(r'\s*(\w+)\s*((?:"[^"]*"|[^;])*);?')
+
+
+class EPDPosition:
+    def __init__(self, fen, operations, number):
+        self.fen = fen
+        self.operations = operations
+        self.id = operations.get("id", "position {}".format(number))
+        self.best_moves = operations.get("bm", "").split()
+        self.avoid_moves = operations.get("am", "").split()
+
+
+def parseEPD(line, number):
+    """
+    An EPD line: the first four fields of a FEN, then operations like bm Qg6; id "WAC.001";
+    Returns None for empty lines and comments.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    fields = line.split(None, 4)
+    if len(fields) < 4:
+        raise ValueError("Invalid EPD: " + line)
+    operations = {}
+    for opcode, operand in operation_pattern.findall(fields[4] if len(fields) > 4 else ""):
+        operations[opcode] = operand.strip().strip('"')
+    # the halfmove clock and move number operations fill in the rest of the FEN
+    fen = " ".join(fields[:4] + [operations.get("hmvc", "0"), operations.get("fmvn", "1")])
+    return EPDPosition(fen, operations, number)
+
+
+def loadSuite(path):
+    with open(path) as file:
+        return [position for position in (parseEPD(line, number) for number, line in enumerate(file, 1))
+                if position is not None]
+
+
+def solutionChecker(game_state, position):
+    """
+    A function that tells if a move solves the position, and the valid moves of the position.
+    """
+    valid_moves = game_state.getValidMoves()
+    best = set()
+    avoid = set()
+    for sans, moves in ((position.best_moves, best), (position.avoid_moves, avoid)):
+        for san in sans:
+            try:
+                moves.add(chessPGN.parseSAN(game_state, san, valid_moves).moveID)
+            except ValueError:  # for example an under-promotion, the engine only promotes to a queen
+                pass
+    if position.best_moves:
+        return (lambda move: move.moveID in best), valid_moves
+    return (lambda move: move.moveID not in avoid), valid_moves
+
+
+def solvePosition(task):
+    """
+    Search one position. Runs in a worker process.
+    Returns (position, solved, time to solution, move found in SAN, nodes, seconds, depth reached).
+    A position without legal moves is not searched and has no move.
+    """
+    position, depth, max_nodes, max_time = task
+    game_state = chessEngine.GameState(position.fen)
+    isSolution, valid_moves = solutionChecker(game_state, position)
+    if not valid_moves:
+        return position, False, None, None, 0, 0.0, 0
+    settled_time = None
+    reached_depth = 0
+    start = time.perf_counter()
+
+    def onIteration(iteration_depth, move, score, nodes):
+        nonlocal settled_time, reached_depth
+        reached_depth = iteration_depth
+        if move is None or not isSolution(move):
+            settled_time = None
+        elif settled_time is None:
+            settled_time = time.perf_counter() - start
+
+    move, _, nodes, _ = chessAI.findBestMoveWithLimits(game_state, valid_moves, depth, max_nodes, max_time,
+                                                       on_iteration=onIteration)
+    seconds = time.perf_counter() - start
+    solved = move is not None and isSolution(move)
+    if solved and settled_time is None:  # found by the iteration the limit stopped
+        settled_time = seconds
+    san = chessPGN.moveToSAN(game_state, move, valid_moves) if move is not None else None
+    return position, solved, settled_time if solved else None, san, nodes, seconds, reached_depth
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run an EPD test suite and report the solved positions.")
+    parser.add_argument("epd", help="EPD file with bm or am operations")
+    parser.add_argument("--time", type=float, help="seconds per position")
+    parser.add_argument("--nodes", type=int, help="nodes per position")
+    parser.add_argument("--depth", type=int,
+                        help="maximum depth (default: {} with a time or node limit, else {})".format(
+                            MAX_DEPTH, chessAI.DEPTH))
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--quiet", action="store_true", help="only print the summary")
+    args = parser.parse_args()
+
+    depth = args.depth or (MAX_DEPTH if args.time is not None or args.nodes is not None else chessAI.DEPTH)
+    positions = loadSuite(args.epd)
+    tasks = [(position, depth, args.nodes, args.time) for position in positions]
+    solved = 0
+    solution_times = []
+    total_nodes = 0
+    total_seconds = 0.0
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool:
+        for position, is_solved, solution_time, san, nodes, seconds, reached_depth in pool.imap_unordered(
+                solvePosition, tasks):
+            total_nodes += nodes
+            total_seconds += seconds
+            if is_solved:
+                solved += 1
+                solution_times.append(solution_time)
+            if not args.quiet:
+                expected = ("bm " + " ".join(position.best_moves)) if position.best_moves else \
+                    ("am " + " ".join(position.avoid_moves))
+                print("{:<12} {:<7} {:<8} {:<20} depth {:>2}  {}".format(
+                    position.id, "solved" if is_solved else "failed" if san else "skipped", san or "-", expected, reached_depth,
+                    "{:.2f}s".format(solution_time) if is_solved else ""), flush=True)
+    elapsed = time.perf_counter() - start
+    print("solved {}/{}  average time to solution {:.3f}s  {} nodes  {:.0f} nps  {:.1f}s".format(
+        solved, len(positions), sum(solution_times) / len(solution_times) if solution_times else 0.0,
+        total_nodes, total_nodes / total_seconds if total_seconds else 0.0, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,61 @@ Storing all the information about the current state of chess game.
 Determining valid moves at current state.
 It will keep move log.
 """
+import random
+import struct
+from chessTables import DIRECTIONS, knight_targets, king_targets, pawn_attacks, rays, between_squares, line_through
+
+# castling rights are kept as a 4-bit mask
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+ALL_CASTLING_RIGHTS = WHITE_KINGSIDE | WHITE_QUEENSIDE | BLACK_KINGSIDE | BLACK_QUEENSIDE
+
+# castling rights kept after a move from or to a square (indexed by row * 8 + col)
+castling_rights_masks = [ALL_CASTLING_RIGHTS] * 64
+castling_rights_masks[0] = ALL_CASTLING_RIGHTS & ~BLACK_QUEENSIDE  # a8 rook
+castling_rights_masks[4] = ALL_CASTLING_RIGHTS & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)  # e8 king
+castling_rights_masks[7] = ALL_CASTLING_RIGHTS & ~BLACK_KINGSIDE  # h8 rook
+castling_rights_masks[56] = ALL_CASTLING_RIGHTS & ~WHITE_QUEENSIDE  # a1 rook
+castling_rights_masks[60] = ALL_CASTLING_RIGHTS & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)  # e1 king
+castling_rights_masks[63] = ALL_CASTLING_RIGHTS & ~WHITE_KINGSIDE  # h1 rook
+
+
+STARTING_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+UNDO_STACK_SIZE = 512  # initial number of undo records, the stack grows if a game gets longer
+
+# serialised game states: a version byte, a flags byte, the position (64 piece codes, side to move and
+# castling rights, en-passant square or 255, halfmove clock, fullmove number) and, with the history,
+# the number of moves and a 16-bit code per move, the position is then the one before the first move
+SERIALISATION_VERSION = 1
+HISTORY_FLAG = 1
+CHECKMATE_FLAG = 2
+STALEMATE_FLAG = 4
+PIECE_CODES = ("--", "wp", "wR", "wN", "wB", "wQ", "wK", "bp", "bR", "bN", "bB", "bQ", "bK")
+PIECE_INDEXES = {piece: code for code, piece in enumerate(PIECE_CODES)}
+PROMOTION_PIECES = ("", "N", "B", "R", "Q")
+packed_position = struct.Struct(">64sBBHH")
+
+# zobrist keys used for hashing positions, the seed is fixed so hashes are the same in every process
+zobrist_random = random.Random(2024)
+zobrist_piece_keys = {color + piece_type: [zobrist_random.getrandbits(64) for _ in range(64)]
+                      for color in "wb" for piece_type in "pRNBQK"}
+zobrist_castling_keys = [zobrist_random.getrandbits(64) for _ in range(16)]
+zobrist_enpassant_keys = [zobrist_random.getrandbits(64) for _ in range(8)]
+zobrist_black_to_move_key = zobrist_random.getrandbits(64)
 
 
 class GameState:
-    def __init__(self):
+    pickle_move_history = False  # see __getstate__
+
+    def __init__(self, fen=None):
         """
         Board is an 8x8 2d list, each element in list has 2 characters.
         The first character represents the color of the piece: 'b' or 'w'.
         The second character represents the type of the piece: 'R', 'N', 'B', 'Q', 'K' or 'p'.
         "--" represents an empty space with no piece.
+        A FEN string can be passed to start from a different position.
         """
         self.board = [
             ["bR", "bN", "bB", "bQ", "bK", "bB", "bN", "bR"],
@@ -34,16 +80,229 @@ class GameState:
         self.pins = []
         self.checks = []
         self.enpassant_possible = ()  # coordinates for the square where en-passant capture is possible
-        self.enpassant_possible_log = [self.enpassant_possible]
-        self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
+        self.castling_rights = ALL_CASTLING_RIGHTS
+        self.halfmove_clock = 0  # plies since the last capture or pawn advance
+        self.fullmove_number = 1
+        # one record per made move: (piece captured, castling rights, en-passant square, halfmove clock, hash,
+        # pawn hash)
+        self.undo_stack = [None] * UNDO_STACK_SIZE
+        if fen is not None:
+            self.loadFEN(fen)
+        self.zobrist_key = self.computeZobristKey()
+        self.pawn_key = self.computePawnKey()
+        self.first_position = self.packPosition()  # the position before the first move of the move log
+
+    def loadFEN(self, fen):
+        """
+        Set up the position described by a FEN string and clear the move log.
+        """
+        fields = fen.split()
+        if len(fields) < 4:
+            raise ValueError("Invalid FEN: " + fen)
+        board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row.extend(["--"] * int(char))
+                elif char.lower() in "prnbqk":
+                    piece_type = "p" if char.lower() == "p" else char.upper()
+                    row.append(("w" if char.isupper() else "b") + piece_type)
+                else:
+                    raise ValueError("Invalid FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("Invalid FEN: " + fen)
+            board.append(row)
+        if len(board) != 8:
+            raise ValueError("Invalid FEN: " + fen)
+        self.board = board
+        for row in range(8):
+            for col in range(8):
+                if board[row][col] == "wK":
+                    self.white_king_location = (row, col)
+                elif board[row][col] == "bK":
+                    self.black_king_location = (row, col)
+        self.white_to_move = fields[1] == "w"
+        self.castling_rights = 0
+        for char, right in (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE),
+                            ("q", BLACK_QUEENSIDE)):
+            if char in fields[2]:
+                self.castling_rights |= right
+        if fields[3] == "-":
+            self.enpassant_possible = ()
+        else:
+            self.enpassant_possible = (Move.ranks_to_rows[fields[3][1]], Move.files_to_cols[fields[3][0]])
+        self.halfmove_clock = int(fields[4]) if len(fields) > 4 else 0
+        self.fullmove_number = int(fields[5]) if len(fields) > 5 else 1
+        self.move_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.zobrist_key = self.computeZobristKey()
+        self.pawn_key = self.computePawnKey()
+        self.first_position = self.packPosition()
+
+    def getFEN(self):
+        """
+        Describe the current position as a FEN string.
+        """
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                char = "P" if piece[1] == "p" else piece[1]
+                rank += char if piece[0] == "w" else char.lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        castling = ""
+        for char, right in (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE), ("k", BLACK_KINGSIDE),
+                            ("q", BLACK_QUEENSIDE)):
+            if self.castling_rights & right:
+                castling += char
+        enpassant = "-"
+        if self.enpassant_possible != ():
+            enpassant = Move.cols_to_files[self.enpassant_possible[1]] + Move.rows_to_ranks[self.enpassant_possible[0]]
+        return " ".join(("/".join(ranks), "w" if self.white_to_move else "b", castling or "-", enpassant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def packPosition(self):
+        board = bytes([PIECE_INDEXES[piece] for row in self.board for piece in row])
+        side_and_castling = (0 if self.white_to_move else 1) | self.castling_rights << 1
+        enpassant = 255 if self.enpassant_possible == () else self.enpassant_possible[0] * 8 + self.enpassant_possible[1]
+        return packed_position.pack(board, side_and_castling, enpassant, self.halfmove_clock, self.fullmove_number)
+
+    def toBytes(self, include_history=False):
+        """
+        The game state in about 70 bytes, or 2 more bytes per move with the move history,
+        which lets undoMove take back the moves after fromBytes.
+        """
+        flags = (CHECKMATE_FLAG if self.checkmate else 0) | (STALEMATE_FLAG if self.stalemate else 0)
+        if not include_history or not self.move_log:
+            return bytes([SERIALISATION_VERSION, flags]) + self.packPosition()
+        codes = [(move.start_row * 8 + move.start_col) | (move.end_row * 8 + move.end_col) << 6 | (
+            PROMOTION_PIECES.index(move.promotion_piece) << 12 if move.is_pawn_promotion else 0)
+            for move in self.move_log]
+        return bytes([SERIALISATION_VERSION, flags | HISTORY_FLAG]) + self.first_position + \
+            struct.pack(">H{}H".format(len(codes)), len(codes), *codes)
+
+    @classmethod
+    def fromBytes(cls, data):
+        game_state = cls.__new__(cls)
+        game_state.__setstate__(data)
+        return game_state
+
+    def __getstate__(self):
+        """
+        Pickles hold the toBytes form. The move history is only included when pickle_move_history is set,
+        a search in another process doesn't need it.
+        """
+        return self.toBytes(self.pickle_move_history)
+
+    def __setstate__(self, data):
+        if data[0] != SERIALISATION_VERSION:
+            raise ValueError("Unknown game state version: {}".format(data[0]))
+        board, side_and_castling, enpassant, halfmove_clock, fullmove_number = packed_position.unpack_from(data, 2)
+        ranks = []
+        for row in range(8):
+            rank = ""
+            empty = 0
+            for code in board[row * 8:row * 8 + 8]:
+                if code == 0:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                piece = PIECE_CODES[code]
+                char = "P" if piece[1] == "p" else piece[1]
+                rank += char if piece[0] == "w" else char.lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        castling = "".join(char for char, right in (("K", WHITE_KINGSIDE), ("Q", WHITE_QUEENSIDE),
+                                                    ("k", BLACK_KINGSIDE), ("q", BLACK_QUEENSIDE))
+                           if side_and_castling >> 1 & right)
+        enpassant_square = "-" if enpassant == 255 else Move.cols_to_files[enpassant % 8] + \
+            Move.rows_to_ranks[enpassant // 8]
+        self.__init__(" ".join(("/".join(ranks), "b" if side_and_castling & 1 else "w", castling or "-",
+                                enpassant_square, str(halfmove_clock), str(fullmove_number))))
+        if data[1] & HISTORY_FLAG:
+            count = struct.unpack_from(">H", data, 2 + packed_position.size)[0]
+            for code in struct.unpack_from(">{}H".format(count), data, 4 + packed_position.size):
+                start_row, start_col = divmod(code & 63, 8)
+                end_row, end_col = divmod(code >> 6 & 63, 8)
+                piece = self.board[start_row][start_col]
+                is_enpassant_move = piece[1] == "p" and start_col != end_col and self.board[end_row][end_col] == "--"
+                is_castle_move = piece[1] == "K" and abs(end_col - start_col) == 2
+                self.makeMove(Move((start_row, start_col), (end_row, end_col), self.board, is_enpassant_move,
+                                   is_castle_move, PROMOTION_PIECES[code >> 12] or "Q"))
+        self.checkmate = bool(data[1] & CHECKMATE_FLAG)
+        self.stalemate = bool(data[1] & STALEMATE_FLAG)
+
+    def computeZobristKey(self):
+        """
+        Compute the hash of the current position from scratch.
+        makeMove updates it incrementally, this is only needed when a position is set up.
+        """
+        key = zobrist_castling_keys[self.castling_rights]
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece != "--":
+                    key ^= zobrist_piece_keys[piece][row * 8 + col]
+        if self.enpassant_possible != ():
+            key ^= zobrist_enpassant_keys[self.enpassant_possible[1]]
+        if not self.white_to_move:
+            key ^= zobrist_black_to_move_key
+        return key
+
+    def computePawnKey(self):
+        """
+        Hash of the pawns only, for the pawn structure evaluation. makeMove updates it incrementally.
+        """
+        key = 0
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece[1] == "p":
+                    key ^= zobrist_piece_keys[piece][row * 8 + col]
+        return key
 
     def makeMove(self, move):
         """
         Takes a Move as a parameter and executes it.
-        (this will not work for castling, pawn promotion and en-passant)
         """
+        ply = len(self.move_log)
+        if ply == len(self.undo_stack):
+            self.undo_stack.extend([None] * ply)
+        self.undo_stack[ply] = (move.piece_captured, self.castling_rights, self.enpassant_possible,
+                                self.halfmove_clock, self.zobrist_key, self.pawn_key)
+        key = self.zobrist_key ^ zobrist_black_to_move_key ^ zobrist_castling_keys[self.castling_rights]
+        if self.enpassant_possible != ():
+            key ^= zobrist_enpassant_keys[self.enpassant_possible[1]]
+        start_square = move.start_row * 8 + move.start_col
+        end_square = move.end_row * 8 + move.end_col
+        key ^= zobrist_piece_keys[move.piece_moved][start_square]
+        if move.piece_captured != "--":
+            if move.is_enpassant_move:
+                key ^= zobrist_piece_keys[move.piece_captured][move.start_row * 8 + move.end_col]
+                self.pawn_key ^= zobrist_piece_keys[move.piece_captured][move.start_row * 8 + move.end_col]
+            else:
+                key ^= zobrist_piece_keys[move.piece_captured][end_square]
+                if move.piece_captured[1] == "p":
+                    self.pawn_key ^= zobrist_piece_keys[move.piece_captured][end_square]
+        if move.piece_moved[1] == "p":
+            self.pawn_key ^= zobrist_piece_keys[move.piece_moved][start_square]
+            if not move.is_pawn_promotion:
+                self.pawn_key ^= zobrist_piece_keys[move.piece_moved][end_square]
+
         self.board[move.start_row][move.start_col] = "--"
         self.board[move.end_row][move.end_col] = move.piece_moved
         self.move_log.append(move)  # log the move so we can undo it later
@@ -60,7 +319,8 @@ class GameState:
             #    promoted_piece = input("Promote to Q, R, B, or N:") #take this to UI later
             #    self.board[move.end_row][move.end_col] = move.piece_moved[0] + promoted_piece
             # else:
-            self.board[move.end_row][move.end_col] = move.piece_moved[0] + "Q"
+            self.board[move.end_row][move.end_col] = move.piece_moved[0] + move.promotion_piece
+        key ^= zobrist_piece_keys[self.board[move.end_row][move.end_col]][end_square]
 
         # enpassant move
         if move.is_enpassant_move:
@@ -69,26 +329,32 @@ class GameState:
         # update enpassant_possible variable
         if move.piece_moved[1] == "p" and abs(move.start_row - move.end_row) == 2:  # only on 2 square pawn advance
             self.enpassant_possible = ((move.start_row + move.end_row) // 2, move.start_col)
+            key ^= zobrist_enpassant_keys[move.start_col]
         else:
             self.enpassant_possible = ()
 
         # castle move
         if move.is_castle_move:
             if move.end_col - move.start_col == 2:  # king-side castle move
-                self.board[move.end_row][move.end_col - 1] = self.board[move.end_row][
-                    move.end_col + 1]  # moves the rook to its new square
-                self.board[move.end_row][move.end_col + 1] = '--'  # erase old rook
+                rook_start_col, rook_end_col = move.end_col + 1, move.end_col - 1
             else:  # queen-side castle move
-                self.board[move.end_row][move.end_col + 1] = self.board[move.end_row][
-                    move.end_col - 2]  # moves the rook to its new square
-                self.board[move.end_row][move.end_col - 2] = '--'  # erase old rook
-
-        self.enpassant_possible_log.append(self.enpassant_possible)
-
-        # update castling rights - whenever it is a rook or king move
-        self.updateCastleRights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                                   self.current_castling_rights.wqs, self.current_castling_rights.bqs))
+                rook_start_col, rook_end_col = move.end_col - 2, move.end_col + 1
+            rook = self.board[move.end_row][rook_start_col]
+            self.board[move.end_row][rook_end_col] = rook  # moves the rook to its new square
+            self.board[move.end_row][rook_start_col] = '--'  # erase old rook
+            key ^= zobrist_piece_keys[rook][move.end_row * 8 + rook_start_col]
+            key ^= zobrist_piece_keys[rook][move.end_row * 8 + rook_end_col]
+
+        # update castling rights - whenever a king or rook leaves its square or a rook is captured
+        self.castling_rights &= castling_rights_masks[start_square] & castling_rights_masks[end_square]
+        self.zobrist_key = key ^ zobrist_castling_keys[self.castling_rights]
+
+        if move.piece_moved[1] == "p" or move.piece_captured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if self.white_to_move:  # black has just moved
+            self.fullmove_number += 1
 
     def undoMove(self):
         """
@@ -96,9 +362,13 @@ class GameState:
         """
         if len(self.move_log) != 0:  # make sure that there is a move to undo
             move = self.move_log.pop()
+            piece_captured, self.castling_rights, self.enpassant_possible, self.halfmove_clock, \
+                self.zobrist_key, self.pawn_key = self.undo_stack[len(self.move_log)]
             self.board[move.start_row][move.start_col] = move.piece_moved
-            self.board[move.end_row][move.end_col] = move.piece_captured
+            self.board[move.end_row][move.end_col] = piece_captured
             self.white_to_move = not self.white_to_move  # swap players
+            if not self.white_to_move:
+                self.fullmove_number -= 1
             # update the king's position if needed
             if move.piece_moved == "wK":
                 self.white_king_location = (move.start_row, move.start_col)
@@ -107,15 +377,7 @@ class GameState:
             # undo en passant move
             if move.is_enpassant_move:
                 self.board[move.end_row][move.end_col] = "--"  # leave landing square blank
-                self.board[move.start_row][move.end_col] = move.piece_captured
-
-            self.enpassant_possible_log.pop()
-            self.enpassant_possible = self.enpassant_possible_log[-1]
-
-            # undo castle rights
-            self.castle_rights_log.pop()  # get rid of the new castle rights from the move we are undoing
-            self.current_castling_rights = self.castle_rights_log[
-                -1]  # set the current castle rights to the last one in the list
+                self.board[move.start_row][move.end_col] = piece_captured
             # undo the castle move
             if move.is_castle_move:
                 if move.end_col - move.start_col == 2:  # king-side
@@ -127,46 +389,10 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
-    def updateCastleRights(self, move):
-        """
-        Update the castle rights given the move
-        """
-        if move.piece_captured == "wR":
-            if move.end_col == 0:  # left rook
-                self.current_castling_rights.wqs = False
-            elif move.end_col == 7:  # right rook
-                self.current_castling_rights.wks = False
-        elif move.piece_captured == "bR":
-            if move.end_col == 0:  # left rook
-                self.current_castling_rights.bqs = False
-            elif move.end_col == 7:  # right rook
-                self.current_castling_rights.bks = False
-
-        if move.piece_moved == 'wK':
-            self.current_castling_rights.wqs = False
-            self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bK':
-            self.current_castling_rights.bqs = False
-            self.current_castling_rights.bks = False
-        elif move.piece_moved == 'wR':
-            if move.start_row == 7:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.wqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.wks = False
-        elif move.piece_moved == 'bR':
-            if move.start_row == 0:
-                if move.start_col == 0:  # left rook
-                    self.current_castling_rights.bqs = False
-                elif move.start_col == 7:  # right rook
-                    self.current_castling_rights.bks = False
-
     def getValidMoves(self):
         """
         All moves considering checks.
         """
-        temp_castle_rights = CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                          self.current_castling_rights.wqs, self.current_castling_rights.bqs)
         # advanced algorithm
         moves = []
         self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
@@ -178,33 +404,7 @@ class GameState:
             king_row = self.black_king_location[0]
             king_col = self.black_king_location[1]
         if self.in_check:
-            if len(self.checks) == 1:  # only 1 check, block the check or move the king
-                moves = self.getAllPossibleMoves()
-                # to block the check you must put a piece into one of the squares between the enemy piece and your king
-                check = self.checks[0]  # check information
-                check_row = check[0]
-                check_col = check[1]
-                piece_checking = self.board[check_row][check_col]
-                valid_squares = []  # squares that pieces can move to
-                # if knight, must capture the knight or move your king, other pieces can be blocked
-                if piece_checking[1] == "N":
-                    valid_squares = [(check_row, check_col)]
-                else:
-                    for i in range(1, 8):
-                        valid_square = (king_row + check[2] * i,
-                                        king_col + check[3] * i)  # check[2] and check[3] are the check directions
-                        valid_squares.append(valid_square)
-                        if valid_square[0] == check_row and valid_square[
-                            1] == check_col:  # once you get to piece and check
-                            break
-                # get rid of any moves that don't block check or move king
-                for i in range(len(moves) - 1, -1, -1):  # iterate through the list backwards when removing elements
-                    if moves[i].piece_moved[1] != "K":  # move doesn't move king so it must block or capture
-                        if not (moves[i].end_row,
-                                moves[i].end_col) in valid_squares:  # move doesn't block or capture piece
-                            moves.remove(moves[i])
-            else:  # double check, king has to move
-                self.getKingMoves(king_row, king_col, moves)
+            self.getCheckEvasionMoves(king_row, king_col, moves)
         else:  # not in check - all moves are fine
             moves = self.getAllPossibleMoves()
             if self.white_to_move:
@@ -222,7 +422,136 @@ class GameState:
             self.checkmate = False
             self.stalemate = False
 
-        self.current_castling_rights = temp_castle_rights
+        return moves
+
+    def getCheckEvasionMoves(self, king_row, king_col, moves):
+        """
+        Generate the valid moves when in check and add them to the list: king moves and,
+        in single check, the moves that capture the checking piece or block the check.
+        Only the pieces that can reach the checking piece or a square between it and the king are looked at.
+        """
+        self.getKingMoves(king_row, king_col, moves)
+        if len(self.checks) != 1:  # double check, king has to move
+            return
+        check_row, check_col = self.checks[0][0], self.checks[0][1]
+        if self.white_to_move:
+            ally_color = "w"
+            move_amount = -1
+            pawn_start_row = 6
+        else:
+            ally_color = "b"
+            move_amount = 1
+            pawn_start_row = 1
+        # a pinned piece can never capture the checking piece or block the check
+        pinned = [(pin[0], pin[1]) for pin in self.pins]
+        # capture the checking piece or put a piece between it and the king (there are no squares between for knights)
+        for end_row, end_col in ((check_row, check_col),) + between_squares[king_row * 8 + king_col][
+                check_row * 8 + check_col]:
+            for row_step, col_step in ((-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)):
+                row, col = end_row + row_step, end_col + col_step
+                while 0 <= row <= 7 and 0 <= col <= 7:
+                    piece = self.board[row][col]
+                    if piece != "--":
+                        if piece[0] == ally_color and (piece[1] == "Q" or piece[1] == (
+                                "R" if row_step == 0 or col_step == 0 else "B")) and (row, col) not in pinned:
+                            moves.append(Move((row, col), (end_row, end_col), self.board))
+                        break
+                    row, col = row + row_step, col + col_step
+            for row_step, col_step in ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2)):
+                row, col = end_row + row_step, end_col + col_step
+                if 0 <= row <= 7 and 0 <= col <= 7 and self.board[row][col] == ally_color + "N" and (
+                        row, col) not in pinned:
+                    moves.append(Move((row, col), (end_row, end_col), self.board))
+            row = end_row - move_amount  # the row pawns move to the square from
+            if not 0 <= row <= 7:
+                continue
+            if self.board[end_row][end_col] == "--":  # pawn advances onto an empty square
+                if self.board[row][end_col] == ally_color + "p":
+                    if (row, end_col) not in pinned:
+                        moves.append(Move((row, end_col), (end_row, end_col), self.board))
+                elif self.board[row][end_col] == "--" and row - move_amount == pawn_start_row and \
+                        self.board[pawn_start_row][end_col] == ally_color + "p" and (
+                        pawn_start_row, end_col) not in pinned:
+                    moves.append(Move((pawn_start_row, end_col), (end_row, end_col), self.board))
+                if (end_row, end_col) == self.enpassant_possible:  # en-passant capture onto the blocking square
+                    for col in (end_col - 1, end_col + 1):
+                        if 0 <= col <= 7 and self.board[row][col] == ally_color + "p" and (row, col) not in pinned:
+                            moves.append(Move((row, col), (end_row, end_col), self.board, is_enpassant_move=True))
+            else:  # pawn captures the checking piece
+                for col in (end_col - 1, end_col + 1):
+                    if 0 <= col <= 7 and self.board[row][col] == ally_color + "p" and (row, col) not in pinned:
+                        moves.append(Move((row, col), (end_row, end_col), self.board))
+        # a pawn that just advanced two squares and gives check can also be captured en-passant
+        if self.board[check_row][check_col][1] == "p" and self.enpassant_possible == (
+                check_row + move_amount, check_col):
+            for col in (check_col - 1, check_col + 1):
+                if 0 <= col <= 7 and self.board[check_row][col] == ally_color + "p" and (check_row, col) not in pinned:
+                    moves.append(Move((check_row, col), self.enpassant_possible, self.board, is_enpassant_move=True))
+
+    def hasLegalMove(self):
+        """
+        Determine if the player to move has any valid move, stopping at the first one found.
+        Sets checkmate and stalemate like getValidMoves, so it can replace it when only those are needed.
+        Castle moves are not looked at: when castling is possible, so is the king's one square step.
+        """
+        self.in_check, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.white_to_move:
+            ally_color = "w"
+            king_row, king_col = self.white_king_location
+        else:
+            ally_color = "b"
+            king_row, king_col = self.black_king_location
+        has_move = False
+        if self.in_check:
+            moves = []
+            self.getCheckEvasionMoves(king_row, king_col, moves)
+            has_move = len(moves) > 0
+        else:
+            for row in range(8):
+                for col in range(8):
+                    piece = self.board[row][col]
+                    if piece[0] == ally_color and piece[1] != "K":
+                        moves = []
+                        self.moveFunctions[piece[1]](row, col, moves)
+                        if moves:
+                            has_move = True
+                            break
+                if has_move:
+                    break
+        if not has_move:
+            moves = []
+            self.getKingMoves(king_row, king_col, moves)
+            has_move = len(moves) > 0
+
+        self.checkmate = not has_move and self.in_check
+        self.stalemate = not has_move and not self.in_check
+        return has_move
+
+    def getPseudoLegalMoves(self):
+        """
+        All moves without considering pins or the squares the king steps onto, so a move can leave the own king
+        attacked. The search makes each move and takes back the ones moveLeftKingInCheck rejects,
+        which is cheaper than proving every move legal before it is searched.
+        Castle moves are only generated when legal, the squares the king passes can't be tested after the move.
+        """
+        self.pins = []  # the generators skip the pin restrictions
+        self.checks = []
+        moves = []
+        ally_color = "w" if self.white_to_move else "b"
+        for row in range(8):
+            for col in range(8):
+                piece = self.board[row][col]
+                if piece[0] == ally_color:
+                    if piece[1] == "K":
+                        self.getPseudoLegalKingMoves(row, col, moves)
+                    else:
+                        self.moveFunctions[piece[1]](row, col, moves)
+        if self.inCheck():  # like in getValidMoves, some backends' getCastleMoves expect the king not in check
+            return moves
+        if self.white_to_move:
+            self.getCastleMoves(self.white_king_location[0], self.white_king_location[1], moves)
+        else:
+            self.getCastleMoves(self.black_king_location[0], self.black_king_location[1], moves)
         return moves
 
     def inCheck(self):
@@ -234,16 +563,60 @@ class GameState:
         else:
             return self.squareUnderAttack(self.black_king_location[0], self.black_king_location[1])
 
+    def moveLeftKingInCheck(self, was_in_check=True):
+        """
+        Determine if the move just made left the king of the player who made it in check, which makes it illegal.
+        When that player was not in check before the move, any other move than a king move or an en-passant capture
+        can only open the line from the king through the square the piece left, so only that line is looked at.
+        """
+        move = self.move_log[-1]
+        king_row, king_col = self.black_king_location if self.white_to_move else self.white_king_location
+        if not was_in_check and move.piece_moved[1] != "K" and not move.is_enpassant_move:
+            if not line_through[king_row * 8 + king_col][move.start_row * 8 + move.start_col]:
+                return False
+            enemy_color = "w" if self.white_to_move else "b"
+            row_step = (move.start_row > king_row) - (move.start_row < king_row)
+            col_step = (move.start_col > king_col) - (move.start_col < king_col)
+            row, col = king_row + row_step, king_col + col_step
+            while 0 <= row <= 7 and 0 <= col <= 7:
+                piece = self.board[row][col]
+                if piece != "--":
+                    return piece[0] == enemy_color and (piece[1] == "Q" or piece[1] == (
+                        "R" if row_step == 0 or col_step == 0 else "B"))
+                row, col = row + row_step, col + col_step
+            return False
+        self.white_to_move = not self.white_to_move
+        in_check = self.inCheck()
+        self.white_to_move = not self.white_to_move
+        return in_check
+
     def squareUnderAttack(self, row, col):
         """
         Determine if enemy can attack the square row col
         """
-        self.white_to_move = not self.white_to_move  # switch to opponent's point of view
-        opponents_moves = self.getAllPossibleMoves()
-        self.white_to_move = not self.white_to_move
-        for move in opponents_moves:
-            if move.end_row == row and move.end_col == col:  # square is under attack
+        if self.white_to_move:
+            ally_color, enemy_color = "w", "b"
+        else:
+            ally_color, enemy_color = "b", "w"
+        square = row * 8 + col
+        for end_row, end_col in knight_targets[square]:
+            if self.board[end_row][end_col] == enemy_color + "N":
                 return True
+        for end_row, end_col in king_targets[square]:
+            if self.board[end_row][end_col] == enemy_color + "K":
+                return True
+        # enemy pawns attack the square from the squares an ally pawn on it would attack
+        for end_row, end_col in pawn_attacks[ally_color][square]:
+            if self.board[end_row][end_col] == enemy_color + "p":
+                return True
+        for j in range(8):
+            for end_row, end_col in rays[square][j]:
+                end_piece = self.board[end_row][end_col]
+                if end_piece != "--":
+                    if end_piece[0] == enemy_color and (end_piece[1] == "Q" or end_piece[1] == (
+                            "R" if j < 4 else "B")):
+                        return True
+                    break
         return False
 
     def getAllPossibleMoves(self):
@@ -274,68 +647,52 @@ class GameState:
             start_row = self.black_king_location[0]
             start_col = self.black_king_location[1]
         # check outwards from king for pins and checks, keep track of pins
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
-        for j in range(len(directions)):
-            direction = directions[j]
+        king_rays = rays[start_row * 8 + start_col]
+        for j in range(8):
             possible_pin = ()  # reset possible pins
-            for i in range(1, 8):
-                end_row = start_row + direction[0] * i
-                end_col = start_col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] == ally_color and end_piece[1] != "K":
-                        if possible_pin == ():  # first allied piece could be pinned
-                            possible_pin = (end_row, end_col, direction[0], direction[1])
-                        else:  # 2nd allied piece - no check or pin from this direction
+            i = 0
+            for end_row, end_col in king_rays[j]:
+                i += 1
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "--":
+                    continue
+                if end_piece[0] == ally_color and end_piece[1] != "K":
+                    if possible_pin == ():  # first allied piece could be pinned
+                        possible_pin = (end_row, end_col, DIRECTIONS[j][0], DIRECTIONS[j][1])
+                    else:  # 2nd allied piece - no check or pin from this direction
+                        break
+                elif end_piece[0] == enemy_color:
+                    enemy_type = end_piece[1]
+                    # 5 possibilities in this complex conditional
+                    # 1.) orthogonally away from king and piece is a rook
+                    # 2.) diagonally away from king and piece is a bishop
+                    # 3.) 1 square away diagonally from king and piece is a pawn
+                    # 4.) any direction and piece is a queen
+                    # 5.) any direction 1 square away and piece is a king
+                    if (0 <= j <= 3 and enemy_type == "R") or (4 <= j <= 7 and enemy_type == "B") or (
+                            i == 1 and enemy_type == "p" and (
+                            (enemy_color == "w" and 6 <= j <= 7) or (enemy_color == "b" and 4 <= j <= 5))) or (
+                            enemy_type == "Q") or (i == 1 and enemy_type == "K"):
+                        if possible_pin == ():  # no piece blocking, so check
+                            in_check = True
+                            checks.append((end_row, end_col, DIRECTIONS[j][0], DIRECTIONS[j][1]))
                             break
-                    elif end_piece[0] == enemy_color:
-                        enemy_type = end_piece[1]
-                        # 5 possibilities in this complex conditional
-                        # 1.) orthogonally away from king and piece is a rook
-                        # 2.) diagonally away from king and piece is a bishop
-                        # 3.) 1 square away diagonally from king and piece is a pawn
-                        # 4.) any direction and piece is a queen
-                        # 5.) any direction 1 square away and piece is a king
-                        if (0 <= j <= 3 and enemy_type == "R") or (4 <= j <= 7 and enemy_type == "B") or (
-                                i == 1 and enemy_type == "p" and (
-                                (enemy_color == "w" and 6 <= j <= 7) or (enemy_color == "b" and 4 <= j <= 5))) or (
-                                enemy_type == "Q") or (i == 1 and enemy_type == "K"):
-                            if possible_pin == ():  # no piece blocking, so check
-                                in_check = True
-                                checks.append((end_row, end_col, direction[0], direction[1]))
-                                break
-                            else:  # piece blocking so pin
-                                pins.append(possible_pin)
-                                break
-                        else:  # enemy piece not applying checks
+                        else:  # piece blocking so pin
+                            pins.append(possible_pin)
                             break
-                else:
-                    break  # off board
+                    else:  # enemy piece not applying checks
+                        break
         # check for knight checks
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
-        for move in knight_moves:
-            end_row = start_row + move[0]
-            end_col = start_col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] == enemy_color and end_piece[1] == "N":  # enemy knight attacking a king
-                    in_check = True
-                    checks.append((end_row, end_col, move[0], move[1]))
+        for end_row, end_col in knight_targets[start_row * 8 + start_col]:
+            if self.board[end_row][end_col] == enemy_color + "N":  # enemy knight attacking a king
+                in_check = True
+                checks.append((end_row, end_col, end_row - start_row, end_col - start_col))
         return in_check, pins, checks
 
     def getPawnMoves(self, row, col, moves):
         """
         Get all the pawn moves for the pawn located at row, col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
         if self.white_to_move:
             move_amount = -1
             start_row = 6
@@ -347,13 +704,22 @@ class GameState:
             enemy_color = "w"
             king_row, king_col = self.black_king_location
 
+        piece_pinned = False
+        pin_line = ()
+        for pin in self.pins:
+            if pin[0] == row and pin[1] == col:
+                # a pinned pawn can only move along the line through its king and itself
+                piece_pinned = True
+                pin_line = line_through[king_row * 8 + king_col][row * 8 + col]
+                break
+
         if self.board[row + move_amount][col] == "--":  # 1 square pawn advance
-            if not piece_pinned or pin_direction == (move_amount, 0):
+            if not piece_pinned or (row + move_amount, col) in pin_line:
                 moves.append(Move((row, col), (row + move_amount, col), self.board))
                 if row == start_row and self.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
                     moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
         if col - 1 >= 0:  # capture to the left
-            if not piece_pinned or pin_direction == (move_amount, -1):
+            if not piece_pinned or (row + move_amount, col - 1) in pin_line:
                 if self.board[row + move_amount][col - 1][0] == enemy_color:
                     moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
                 if (row + move_amount, col - 1) == self.enpassant_possible:
@@ -370,16 +736,18 @@ class GameState:
                         for i in inside_range:
                             if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
                                 blocking_piece = True
-                        for i in outside_range:
+                        for i in outside_range:  # only the first piece beyond the pawns matters
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
                                 attacking_piece = True
+                                break
                             elif square != "--":
                                 blocking_piece = True
+                                break
                     if not attacking_piece or blocking_piece:
                         moves.append(Move((row, col), (row + move_amount, col - 1), self.board, is_enpassant_move=True))
         if col + 1 <= 7:  # capture to the right
-            if not piece_pinned or pin_direction == (move_amount, +1):
+            if not piece_pinned or (row + move_amount, col + 1) in pin_line:
                 if self.board[row + move_amount][col + 1][0] == enemy_color:
                     moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
                 if (row + move_amount, col + 1) == self.enpassant_possible:
@@ -396,12 +764,14 @@ class GameState:
                         for i in inside_range:
                             if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
                                 blocking_piece = True
-                        for i in outside_range:
+                        for i in outside_range:  # only the first piece beyond the pawns matters
                             square = self.board[row][i]
                             if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
                                 attacking_piece = True
+                                break
                             elif square != "--":
                                 blocking_piece = True
+                                break
                     if not attacking_piece or blocking_piece:
                         moves.append(Move((row, col), (row + move_amount, col + 1), self.board, is_enpassant_move=True))
 
@@ -409,126 +779,87 @@ class GameState:
         """
         Get all the rook moves for the rook located at row, col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                if self.board[row][col][
-                    1] != "Q":  # can't remove queen from pin on rook moves, only remove it on bishop moves
-                    self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, 0), (0, -1), (1, 0), (0, 1))  # up, left, down, right
-        enemy_color = "b" if self.white_to_move else "w"
-        for direction in directions:
-            for i in range(1, 8):
-                end_row = row + direction[0] * i
-                end_col = col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check for possible moves only in boundaries of the board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:  # friendly piece
-                            break
-                else:  # off board
-                    break
+        self.getSlidingMoves(row, col, range(4), moves)
 
     def getKnightMoves(self, row, col, moves):
         """
         Get all the knight moves for the knight located at row col and add the moves to the list.
         """
-        piece_pinned = False
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                self.pins.remove(self.pins[i])
-                break
-
-        knight_moves = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2),
-                        (1, -2))  # up/left up/right right/up right/down down/left down/right left/up left/down
+        for pin in self.pins:
+            if pin[0] == row and pin[1] == col:  # a pinned knight can't move
+                return
         ally_color = "w" if self.white_to_move else "b"
-        for move in knight_moves:
-            end_row = row + move[0]
-            end_col = col + move[1]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                if not piece_pinned:
-                    end_piece = self.board[end_row][end_col]
-                    if end_piece[0] != ally_color:  # so its either enemy piece or empty square
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
+        for end_row, end_col in knight_targets[row * 8 + col]:
+            if self.board[end_row][end_col][0] != ally_color:  # so its either enemy piece or empty square
+                moves.append(Move((row, col), (end_row, end_col), self.board))
 
     def getBishopMoves(self, row, col, moves):
         """
         Get all the bishop moves for the bishop located at row col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
-
-        directions = ((-1, -1), (-1, 1), (1, 1), (1, -1))  # diagonals: up/left up/right down/right down/left
-        enemy_color = "b" if self.white_to_move else "w"
-        for direction in directions:
-            for i in range(1, 8):
-                end_row = row + direction[0] * i
-                end_col = col + direction[1] * i
-                if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check if the move is on board
-                    if not piece_pinned or pin_direction == direction or pin_direction == (
-                            -direction[0], -direction[1]):
-                        end_piece = self.board[end_row][end_col]
-                        if end_piece == "--":  # empty space is valid
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                        elif end_piece[0] == enemy_color:  # capture enemy piece
-                            moves.append(Move((row, col), (end_row, end_col), self.board))
-                            break
-                        else:  # friendly piece
-                            break
-                else:  # off board
-                    break
+        self.getSlidingMoves(row, col, range(4, 8), moves)
 
     def getQueenMoves(self, row, col, moves):
         """
         Get all the queen moves for the queen located at row col and add the moves to the list.
         """
-        self.getBishopMoves(row, col, moves)
-        self.getRookMoves(row, col, moves)
+        self.getSlidingMoves(row, col, range(8), moves)
+
+    def getSlidingMoves(self, row, col, direction_indexes, moves):
+        """
+        Get the moves of the rook, bishop or queen located at row col along the rays of the given DIRECTIONS.
+        """
+        pin_line = ()
+        for pin in self.pins:
+            if pin[0] == row and pin[1] == col:
+                # a pinned piece can only move along the line through its king and itself
+                pin_line = (pin[2], pin[3])
+                break
+        enemy_color = "b" if self.white_to_move else "w"
+        piece_rays = rays[row * 8 + col]
+        for j in direction_indexes:
+            if pin_line and pin_line != DIRECTIONS[j] and pin_line != (-DIRECTIONS[j][0], -DIRECTIONS[j][1]):
+                continue
+            for end_row, end_col in piece_rays[j]:
+                end_piece = self.board[end_row][end_col]
+                if end_piece == "--":  # empty space is valid
+                    moves.append(Move((row, col), (end_row, end_col), self.board))
+                elif end_piece[0] == enemy_color:  # capture enemy piece
+                    moves.append(Move((row, col), (end_row, end_col), self.board))
+                    break
+                else:  # friendly piece
+                    break
 
     def getKingMoves(self, row, col, moves):
         """
         Get all the king moves for the king located at row col and add the moves to the list.
         """
-        row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
-        col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = "w" if self.white_to_move else "b"
-        for i in range(8):
-            end_row = row + row_moves[i]
-            end_col = col + col_moves[i]
-            if 0 <= end_row <= 7 and 0 <= end_col <= 7:
-                end_piece = self.board[end_row][end_col]
-                if end_piece[0] != ally_color:  # not an ally piece - empty or enemy
-                    # place king on end square and check for checks
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
-                        moves.append(Move((row, col), (end_row, end_col), self.board))
-                    # place king back on original location
-                    if ally_color == "w":
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
+        for end_row, end_col in king_targets[row * 8 + col]:
+            end_piece = self.board[end_row][end_col]
+            if end_piece[0] != ally_color:  # not an ally piece - empty or enemy
+                # place king on end square and check for checks
+                if ally_color == "w":
+                    self.white_king_location = (end_row, end_col)
+                else:
+                    self.black_king_location = (end_row, end_col)
+                in_check, pins, checks = self.checkForPinsAndChecks()
+                if not in_check:
+                    moves.append(Move((row, col), (end_row, end_col), self.board))
+                # place king back on original location
+                if ally_color == "w":
+                    self.white_king_location = (row, col)
+                else:
+                    self.black_king_location = (row, col)
+
+    def getPseudoLegalKingMoves(self, row, col, moves):
+        """
+        Get the king moves for the king located at row col without checking the squares for attacks.
+        """
+        ally_color = "w" if self.white_to_move else "b"
+        for end_row, end_col in king_targets[row * 8 + col]:
+            if self.board[end_row][end_col][0] != ally_color:
+                moves.append(Move((row, col), (end_row, end_col), self.board))
 
     def getCastleMoves(self, row, col, moves):
         """
@@ -536,11 +867,9 @@ class GameState:
         """
         if self.squareUnderAttack(row, col):
             return  # can't castle while in check
-        if (self.white_to_move and self.current_castling_rights.wks) or (
-                not self.white_to_move and self.current_castling_rights.bks):
+        if self.castling_rights & (WHITE_KINGSIDE if self.white_to_move else BLACK_KINGSIDE):
             self.getKingsideCastleMoves(row, col, moves)
-        if (self.white_to_move and self.current_castling_rights.wqs) or (
-                not self.white_to_move and self.current_castling_rights.bqs):
+        if self.castling_rights & (WHITE_QUEENSIDE if self.white_to_move else BLACK_QUEENSIDE):
             self.getQueensideCastleMoves(row, col, moves)
 
     def getKingsideCastleMoves(self, row, col, moves):
@@ -554,14 +883,6 @@ class GameState:
                 moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
 
 
-class CastleRights:
-    def __init__(self, wks, bks, wqs, bqs):
-        self.wks = wks
-        self.bks = bks
-        self.wqs = wqs
-        self.bqs = bqs
-
-
 class Move:
     # in chess, fields on the board are described by two symbols, one of them being number between 1-8 (which is corresponding to rows)
     # and the second one being a letter between a-f (corresponding to columns), in order to use this notation we need to map our [row][col] coordinates
@@ -573,7 +894,8 @@ class Move:
                      "e": 4, "f": 5, "g": 6, "h": 7}
     cols_to_files = {v: k for k, v in files_to_cols.items()}
 
-    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False):
+    def __init__(self, start_square, end_square, board, is_enpassant_move=False, is_castle_move=False,
+                 promotion_piece="Q"):
         self.start_row = start_square[0]
         self.start_col = start_square[1]
         self.end_row = end_square[0]
@@ -583,6 +905,7 @@ class Move:
         # pawn promotion
         self.is_pawn_promotion = (self.piece_moved == "wp" and self.end_row == 0) or (
                 self.piece_moved == "bp" and self.end_row == 7)
+        self.promotion_piece = promotion_piece
         # en passant
         self.is_enpassant_move = is_enpassant_move
         if self.is_enpassant_move:
@@ -601,30 +924,39 @@ class Move:
             return self.moveID == other.moveID
         return False
 
-    def getChessNotation(self):
-        if self.is_pawn_promotion:
-            return self.getRankFile(self.end_row, self.end_col) + "Q"
+    def getChessNotation(self, valid_moves=()):
+        """
+        Standard algebraic notation of the move, without the check and checkmate marks.
+        valid_moves are the moves of the position the move is made from,
+        they are used to disambiguate two pieces of the same type that can reach the same square.
+        """
         if self.is_castle_move:
-            if self.end_col == 1:
-                return "0-0-0"
-            else:
-                return "0-0"
-        if self.is_enpassant_move:
-            return self.getRankFile(self.start_row, self.start_col)[0] + "x" + self.getRankFile(self.end_row,
-                                                                                                self.end_col) + " e.p."
-        if self.piece_captured != "--":
-            if self.piece_moved[1] == "p":
-                return self.getRankFile(self.start_row, self.start_col)[0] + "x" + self.getRankFile(self.end_row,
-                                                                                                    self.end_col)
-            else:
-                return self.piece_moved[1] + "x" + self.getRankFile(self.end_row, self.end_col)
-        else:
-            if self.piece_moved[1] == "p":
-                return self.getRankFile(self.end_row, self.end_col)
+            return "O-O" if self.end_col == 6 else "O-O-O"
+        end_square = self.getRankFile(self.end_row, self.end_col)
+        if self.piece_moved[1] == "p":
+            notation = self.cols_to_files[self.start_col] + "x" + end_square if self.is_capture else end_square
+            if self.is_pawn_promotion:
+                notation += "=" + self.promotion_piece
+            return notation
+
+        notation = self.piece_moved[1]
+        same_file = same_rank = ambiguous = False
+        for move in valid_moves:
+            if move.piece_moved == self.piece_moved and move.end_row == self.end_row and \
+                    move.end_col == self.end_col and move.moveID != self.moveID:
+                ambiguous = True
+                same_file = same_file or move.start_col == self.start_col
+                same_rank = same_rank or move.start_row == self.start_row
+        if ambiguous:
+            if not same_file:
+                notation += self.cols_to_files[self.start_col]
+            elif not same_rank:
+                notation += self.rows_to_ranks[self.start_row]
             else:
-                return self.piece_moved[1] + self.getRankFile(self.end_row, self.end_col)
-
-        # TODO Disambiguating moves
+                notation += self.getRankFile(self.start_row, self.start_col)
+        if self.is_capture:
+            notation += "x"
+        return notation + end_square
 
     def getRankFile(self, row, col):
         return self.cols_to_files[col] + self.rows_to_ranks[row]
@@ -639,7 +971,7 @@ class Move:
             if self.is_capture:
                 return self.cols_to_files[self.start_col] + "x" + end_square
             else:
-                return end_square + "Q" if self.is_pawn_promotion else end_square
+                return end_square + self.promotion_piece if self.is_pawn_promotion else end_square
 
         move_string = self.piece_moved[1]
         if self.is_capture:
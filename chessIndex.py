@@ -0,0 +1,325 @@
+"""
+Position index of a PGN archive.
+The indexer replays every game and writes one fixed-width record per position: the Zobrist key of the
+position, the byte offset of the game in the PGN file and the move played next.
+The records are sorted by key with an external merge sort, so archives bigger than memory can be indexed.
+Queries memory-map the index and binary-search it, which takes a few disk reads per lookup.
+"""
+import argparse
+import bisect
+import collections
+import heapq
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import tempfile
+import time
+import chessEngine
+import chessPGN
+
+MAGIC = b"CHESSIDX"
+HEADER = struct.Struct(">8sQQ")  # magic, number of records, size of the indexed PGN file
+RECORD = struct.Struct(">QQH")  # position key, game offset, next move
+KEY_SIZE = 8  # records are big-endian, so comparing their bytes compares the keys
+NO_MOVE = 0xFFFF  # the last position of a game
+PROMOTION_CODES = {"N": 1, "B": 2, "R": 3, "Q": 4}
+PROMOTION_PIECES = {code: piece for piece, code in PROMOTION_CODES.items()}
+DEFAULT_RUN_RECORDS = 2000000  # records sorted in memory at a time, about 150 MB
+MERGE_BUFFER_RECORDS = 4096  # records read at a time from every run while merging
+
+
+def encodeMove(move):
+    """
+    A move in 16 bits: start square, end square (row * 8 + col) and the promotion piece.
+    """
+    code = (move.start_row * 8 + move.start_col) | (move.end_row * 8 + move.end_col) << 6
+    if move.is_pawn_promotion:
+        code |= PROMOTION_CODES[move.promotion_piece] << 12
+    return code
+
+
+def decodeMove(code):
+    """
+    The move in coordinate notation, for example "e2e4" or "e7e8q", or None for NO_MOVE.
+    """
+    if code == NO_MOVE:
+        return None
+    start_row, start_col = divmod(code & 63, 8)
+    end_row, end_col = divmod(code >> 6 & 63, 8)
+    text = chessEngine.Move.cols_to_files[start_col] + chessEngine.Move.rows_to_ranks[start_row] + \
+        chessEngine.Move.cols_to_files[end_col] + chessEngine.Move.rows_to_ranks[end_row]
+    promotion = code >> 12
+    return text + PROMOTION_PIECES[promotion].lower() if promotion else text
+
+
+def indexGame(game):
+    """
+    The packed records of every position of a game. Runs in a worker process.
+    Returns (records, number of positions, error). A game with an illegal move is indexed up to that move.
+    """
+    records = []
+    pack = RECORD.pack
+    game_state = None
+    try:
+        for game_state, _, move in game.replay():
+            records.append(pack(game_state.zobrist_key, game.offset, encodeMove(move)))
+        if game_state is None:  # a game without moves
+            game_state = game.startingGameState()
+        # replay made the last move when the loop resumed it, game_state is the final position
+        records.append(pack(game_state.zobrist_key, game.offset, NO_MOVE))
+    except ValueError as error:
+        return b"".join(records), len(records), str(error)
+    return b"".join(records), len(records), None
+
+
+def writeRun(records, directory):
+    """
+    Sort a list of packed records and write them to a temporary run file. Returns its path.
+    """
+    records.sort()
+    file_descriptor, path = tempfile.mkstemp(suffix=".run", dir=directory)
+    with os.fdopen(file_descriptor, "wb") as file:
+        file.write(b"".join(records))
+    return path
+
+
+def readRun(path, size=RECORD.size):
+    """
+    Generator over the packed records of a run file, size is the record size.
+    """
+    with open(path, "rb") as file:
+        while True:
+            block = file.read(size * MERGE_BUFFER_RECORDS)
+            if not block:
+                return
+            for start in range(0, len(block), size):
+                yield block[start:start + size]
+
+
+def mergeRuns(run_paths, output):
+    """
+    Merge the sorted runs into the output file, returns the number of records written.
+    """
+    count = 0
+    buffer = []
+    for record in heapq.merge(*(readRun(path) for path in run_paths)):
+        buffer.append(record)
+        if len(buffer) == MERGE_BUFFER_RECORDS:
+            output.write(b"".join(buffer))
+            count += len(buffer)
+            buffer = []
+    output.write(b"".join(buffer))
+    return count + len(buffer)
+
+
+def buildIndex(pgn_path, index_path, workers=1, run_records=DEFAULT_RUN_RECORDS, verbose=True):
+    """
+    Index every position of the games of a PGN file.
+    Records are collected up to run_records at a time, sorted and written to temporary run files
+    next to the index, which are merged into the index at the end.
+    Returns (games, positions, games with errors).
+    """
+    directory = os.path.dirname(os.path.abspath(index_path))
+    run_paths = []
+    records = []
+    games = positions = errors = 0
+    start = time.perf_counter()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        games_iterator = chessPGN.readGames(pgn_path)
+        results = pool.imap(indexGame, games_iterator, 16) if pool is not None else map(indexGame, games_iterator)
+        size = RECORD.size
+        for packed, count, error in results:
+            games += 1
+            positions += count
+            errors += error is not None
+            records.extend(packed[offset:offset + size] for offset in range(0, len(packed), size))
+            if len(records) >= run_records:
+                run_paths.append(writeRun(records, directory))
+                records = []
+            if verbose and games % 1000 == 0:
+                elapsed = time.perf_counter() - start
+                print("{} games  {} positions  {:.0f} games/s".format(games, positions, games / elapsed), flush=True)
+        temporary_path = "{}.{}.tmp".format(index_path, os.getpid())
+        with open(temporary_path, "wb") as output:
+            output.write(HEADER.pack(MAGIC, 0, os.path.getsize(pgn_path)))
+            if run_paths:
+                if records:
+                    run_paths.append(writeRun(records, directory))
+                    records = []
+                count = mergeRuns(run_paths, output)
+            else:  # everything fitted in memory
+                records.sort()
+                output.write(b"".join(records))
+                count = len(records)
+            output.seek(0)
+            output.write(HEADER.pack(MAGIC, count, os.path.getsize(pgn_path)))
+        os.replace(temporary_path, index_path)
+    finally:
+        if pool is not None:
+            pool.terminate()
+        for path in run_paths:
+            os.remove(path)
+    return games, positions, errors
+
+
+class KeyView:
+    """
+    The keys of the records of a memory-mapped index as a sequence of bytes, for bisect.
+    Other files of sorted records after a header, like opening books, give their header and record sizes.
+    """
+
+    def __init__(self, data, count, header_size=HEADER.size, record_size=RECORD.size):
+        self.data = data
+        self.count = count
+        self.header_size = header_size
+        self.record_size = record_size
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = self.header_size + i * self.record_size
+        return self.data[start:start + KEY_SIZE]
+
+
+class PositionIndex:
+    """
+    Read access to an index built by buildIndex. pgn_path is only needed to load the games.
+    """
+
+    def __init__(self, path, pgn_path=None):
+        self.file = open(path, "rb")
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, self.pgn_size = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError("Not a position index: " + path)
+        self.keys = KeyView(self.data, self.count)
+        self.pgn_path = pgn_path
+
+    def lookup(self, key):
+        """
+        (game offset, move code) of every record of the position with the Zobrist key.
+        """
+        target = key.to_bytes(KEY_SIZE, "big")
+        first = bisect.bisect_left(self.keys, target)
+        last = bisect.bisect_right(self.keys, target, first)
+        records = self.data[HEADER.size + first * RECORD.size:HEADER.size + last * RECORD.size]
+        return [(game_offset, move_code) for _, game_offset, move_code in RECORD.iter_unpack(records)]
+
+    def gameOffsets(self, game_state):
+        """
+        Byte offsets in the PGN file of the games that reached the position, in file order.
+        """
+        return sorted(set(offset for offset, _ in self.lookup(game_state.zobrist_key)))
+
+    def nextMoves(self, game_state):
+        """
+        Counter of the moves played next from the position, in coordinate notation.
+        None counts the games that ended in it.
+        """
+        return collections.Counter(decodeMove(code) for _, code in self.lookup(game_state.zobrist_key))
+
+    def loadGame(self, offset):
+        with open(self.pgn_path, "rb") as file:
+            file.seek(offset)
+            game = next(chessPGN.readGames(file))
+        game.offset = offset
+        return game
+
+    def randomKeys(self, count, seed=1):
+        rng = random.Random(seed)
+        return [RECORD.unpack_from(self.data, HEADER.size + rng.randrange(self.count) * RECORD.size)[0]
+                for _ in range(count)]
+
+    def close(self):
+        self.data.close()
+        self.file.close()
+
+
+def setUpPosition(fen, moves):
+    game_state = chessEngine.GameState(fen)
+    for text in moves:
+        valid_moves = game_state.getValidMoves()
+        move = next((move for move in valid_moves if move.getRankFile(move.start_row, move.start_col) +
+                     move.getRankFile(move.end_row, move.end_col) == text[:4]), None)
+        if move is None:
+            move = chessPGN.parseSAN(game_state, text, valid_moves)
+        game_state.makeMove(move)
+    return game_state
+
+
+def benchmark(index, queries, seed=1):
+    """
+    Latency of lookups of positions that are in the index and of random keys that are almost surely not.
+    """
+    rng = random.Random(seed)
+    for name, keys in (("hit", index.randomKeys(queries, seed)),
+                       ("miss", [rng.getrandbits(64) for _ in range(queries)])):
+        latencies = []
+        records = 0
+        for key in keys:
+            start = time.perf_counter()
+            records += len(index.lookup(key))
+            latencies.append(time.perf_counter() - start)
+        latencies.sort()
+        print("{:<5} {} queries  p50 {:.1f}us  p99 {:.1f}us  max {:.1f}us  {:.1f} records/query".format(
+            name, queries, latencies[len(latencies) // 2] * 1e6, latencies[int(len(latencies) * 0.99)] * 1e6,
+            latencies[-1] * 1e6, records / queries))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a position index of a PGN archive.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="index the positions of a PGN file")
+    build_parser.add_argument("pgn")
+    build_parser.add_argument("--output", help="index file (default: the PGN file + .idx)")
+    build_parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    build_parser.add_argument("--run-records", type=int, default=DEFAULT_RUN_RECORDS,
+                              help="records sorted in memory before they are written to a temporary run file")
+    query_parser = subparsers.add_parser("query", help="games and next moves of a position")
+    query_parser.add_argument("index")
+    query_parser.add_argument("moves", nargs="*", help="moves from the start position, e.g. e2e4 e7e5 or e4 e5")
+    query_parser.add_argument("--fen", help="position to start the moves from")
+    query_parser.add_argument("--pgn", help="PGN file of the index, to show the players of the games")
+    query_parser.add_argument("--games", type=int, default=10, help="number of games to list")
+    bench_parser = subparsers.add_parser("bench", help="measure the query latency")
+    bench_parser.add_argument("index")
+    bench_parser.add_argument("--queries", type=int, default=10000)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        start = time.perf_counter()
+        games, positions, errors = buildIndex(args.pgn, args.output or args.pgn + ".idx", args.workers,
+                                              args.run_records)
+        elapsed = time.perf_counter() - start
+        print("{} games  {} positions in {:.1f}s, {:.0f} games/s  {:.0f} positions/s  {} games with errors".format(
+            games, positions, elapsed, games / elapsed, positions / elapsed, errors))
+    elif args.command == "query":
+        index = PositionIndex(args.index, args.pgn)
+        game_state = setUpPosition(args.fen, args.moves)
+        start = time.perf_counter()
+        next_moves = index.nextMoves(game_state)
+        offsets = index.gameOffsets(game_state)
+        elapsed = time.perf_counter() - start
+        print("{} games reached the position ({:.2f} ms)".format(len(offsets), elapsed * 1000))
+        for text, count in next_moves.most_common():
+            print("  {:<6} {}".format(text or "end", count))
+        for offset in offsets[:args.games]:
+            if args.pgn is None:
+                print("  game at byte {}".format(offset))
+            else:
+                headers = index.loadGame(offset).headers
+                print("  {} - {}  {}  {}".format(headers.get("White", "?"), headers.get("Black", "?"),
+                                                 headers.get("Date", "?"), headers.get("Result", "*")))
+    else:
+        index = PositionIndex(args.index)
+        print("{} records".format(index.count))
+        benchmark(index, args.queries)
+
+
+if __name__ == "__main__":
+    main()
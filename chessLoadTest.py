@@ -0,0 +1,114 @@
+"""
+Load generator for chessServer.
+Every simulated player holds its own connection and plays games against the server's engine:
+it asks for an engine move, answers with a random legal move and starts a new game when one ends.
+For every concurrency level it reports the moves per second and the latency percentiles of
+engine moves and of the player's moves.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import chessServer
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class Player:
+    def __init__(self, host, port, game_options, seed):
+        self.host = host
+        self.port = port
+        self.game_options = game_options
+        self.random = random.Random(seed)
+        self.engine_latencies = []
+        self.move_latencies = []
+        self.errors = 0
+        self.games = 0
+
+    async def request(self, reader, writer, request):
+        writer.write(json.dumps(request).encode() + b"\n")
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("server closed the connection")
+        return json.loads(line)
+
+    async def play(self, deadline):
+        reader, writer = await asyncio.open_connection(self.host, self.port, limit=chessServer.MAX_LINE_LENGTH)
+        try:
+            state = None
+            while time.perf_counter() < deadline:
+                if state is None or state.get("status") != "playing":
+                    if state is not None:
+                        await self.request(reader, writer, {"op": "close", "game": state["game"]})
+                    state = await self.request(reader, writer, dict(self.game_options, op="new"))
+                    self.games += 1
+                    continue
+                start = time.perf_counter()
+                reply = await self.request(reader, writer, {"op": "go", "game": state["game"]})
+                if "error" in reply:
+                    self.errors += 1
+                    state["status"] = reply["error"]
+                    continue
+                self.engine_latencies.append(time.perf_counter() - start)
+                state = reply
+                if state["status"] != "playing":
+                    continue
+                start = time.perf_counter()
+                reply = await self.request(reader, writer, {"op": "move", "game": state["game"],
+                                                            "move": self.random.choice(state["moves"])})
+                if "error" in reply:
+                    self.errors += 1
+                    state["status"] = reply["error"]
+                    continue
+                self.move_latencies.append(time.perf_counter() - start)
+                state = reply
+        finally:
+            writer.close()
+
+
+async def runLevel(host, port, concurrency, duration, game_options, seed):
+    players = [Player(host, port, game_options, seed + i) for i in range(concurrency)]
+    start = time.perf_counter()
+    await asyncio.gather(*(player.play(start + duration) for player in players))
+    elapsed = time.perf_counter() - start
+    engine_latencies = sorted(latency for player in players for latency in player.engine_latencies)
+    move_latencies = sorted(latency for player in players for latency in player.move_latencies)
+    return {"concurrency": concurrency, "seconds": elapsed,
+            "moves_per_second": (len(engine_latencies) + len(move_latencies)) / elapsed,
+            "engine_moves": len(engine_latencies),
+            "engine_p50": percentile(engine_latencies, 0.5), "engine_p99": percentile(engine_latencies, 0.99),
+            "move_p50": percentile(move_latencies, 0.5), "move_p99": percentile(move_latencies, 0.99),
+            "games": sum(player.games for player in players), "errors": sum(player.errors for player in players)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the throughput and latency of chessServer.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=chessServer.DEFAULT_PORT)
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma separated numbers of players")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per concurrency level")
+    parser.add_argument("--time", type=float, default=chessServer.DEFAULT_GAME_TIME,
+                        help="engine time budget of every game")
+    parser.add_argument("--depth", type=int, help="engine search depth (default: the server's)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    game_options = {"time": args.time}
+    if args.depth is not None:
+        game_options["depth"] = args.depth
+    print("{:>7} {:>10} {:>8} {:>10} {:>10} {:>10} {:>10} {:>6} {:>6}".format(
+        "players", "moves/s", "engine", "engine p50", "engine p99", "move p50", "move p99", "games", "errors"))
+    for concurrency in (int(level) for level in args.concurrency.split(",")):
+        result = asyncio.run(runLevel(args.host, args.port, concurrency, args.duration, game_options, args.seed))
+        print("{concurrency:>7} {moves_per_second:>10.1f} {engine_moves:>8} {engine_p50:>9.3f}s {engine_p99:>9.3f}s "
+              "{move_p50:>9.4f}s {move_p99:>9.4f}s {games:>6} {errors:>6}".format(**result), flush=True)
+
+
+if __name__ == "__main__":
+    main()
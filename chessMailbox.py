@@ -0,0 +1,386 @@
+"""
+Game state on a 10x12 mailbox board.
+Next to the 8x8 list of strings the position is kept in a flat list of 120 integers: the 64 squares
+surrounded by off-board sentinels (two rows above and below, one column left and right),
+so moving off the board is caught by the value of the square instead of bounds checks.
+Pieces are integers with a colour bit and a piece type in the low bits.
+The string board stays the one makeMove, undoMove, Move and the GUI work with, the mailbox follows it.
+"""
+import chessEngine
+from chessEngine import Move
+
+EMPTY = 0
+PAWN = 1
+KNIGHT = 2
+BISHOP = 3
+ROOK = 4
+QUEEN = 5
+KING = 6
+TYPE_MASK = 7
+WHITE = 8
+BLACK = 16
+OFF_BOARD = 32  # has no colour bit, so it is neither an ally nor an enemy piece
+
+piece_codes = {"--": EMPTY}
+for color_name, color in (("w", WHITE), ("b", BLACK)):
+    for type_name, piece_type in (("p", PAWN), ("N", KNIGHT), ("B", BISHOP), ("R", ROOK), ("Q", QUEEN),
+                                  ("K", KING)):
+        piece_codes[color_name + type_name] = color | piece_type
+
+NORTH = -10
+SOUTH = 10
+ORTHOGONAL_OFFSETS = (NORTH, -1, SOUTH, 1)
+DIAGONAL_OFFSETS = (NORTH - 1, NORTH + 1, SOUTH - 1, SOUTH + 1)
+QUEEN_OFFSETS = ORTHOGONAL_OFFSETS + DIAGONAL_OFFSETS
+KNIGHT_OFFSETS = (-21, -19, -12, -8, 8, 12, 19, 21)
+
+# (row, col) of the 120 mailbox squares, None for the sentinels
+square_coordinates = [None] * 120
+for board_row in range(8):
+    for board_col in range(8):
+        square_coordinates[21 + board_row * 10 + board_col] = (board_row, board_col)
+BOARD_SQUARES = tuple(square for square in range(120) if square_coordinates[square] is not None)
+
+
+def mailboxSquare(row, col):
+    return 21 + row * 10 + col
+
+
+class MailboxGameState(chessEngine.GameState):
+    """
+    GameState with the move generators working on the mailbox board.
+    While generating moves pins is a dict from the square of a pinned piece to the direction of the pin
+    and checks is a list of (square of the checking piece, direction from the king) in mailbox squares.
+    """
+
+    def __init__(self, fen=None):
+        self.mailbox = [OFF_BOARD] * 120
+        super().__init__(fen)
+        self.pins = {}
+        self.syncMailbox()
+
+    def syncMailbox(self):
+        """
+        Set the mailbox from the string board.
+        """
+        for square in BOARD_SQUARES:
+            row, col = square_coordinates[square]
+            self.mailbox[square] = piece_codes[self.board[row][col]]
+
+    def loadFEN(self, fen):
+        super().loadFEN(fen)
+        self.syncMailbox()
+
+    def updateSquares(self, move):
+        """
+        Copy the squares a move changes from the string board to the mailbox.
+        """
+        squares = [(move.start_row, move.start_col), (move.end_row, move.end_col)]
+        if move.is_enpassant_move:
+            squares.append((move.start_row, move.end_col))
+        elif move.is_castle_move:
+            squares += [(move.end_row, move.end_col - 2), (move.end_row, move.end_col - 1),
+                        (move.end_row, move.end_col + 1)]
+            if move.end_col == 6:
+                squares.append((move.end_row, 7))
+        for row, col in squares:
+            self.mailbox[21 + row * 10 + col] = piece_codes[self.board[row][col]]
+
+    def makeMove(self, move):
+        super().makeMove(move)
+        self.updateSquares(move)
+
+    def undoMove(self):
+        if len(self.move_log) != 0:
+            move = self.move_log[-1]
+            super().undoMove()
+            self.updateSquares(move)
+
+    def getSideToMove(self):
+        """
+        Ally colour, enemy colour, pawn direction and mailbox square of the king of the side to move.
+        """
+        if self.white_to_move:
+            return WHITE, BLACK, NORTH, 21 + self.white_king_location[0] * 10 + self.white_king_location[1]
+        return BLACK, WHITE, SOUTH, 21 + self.black_king_location[0] * 10 + self.black_king_location[1]
+
+    def squareAttacked(self, square, enemy):
+        """
+        Determine if a piece of the enemy colour attacks the mailbox square.
+        """
+        board = self.mailbox
+        knight = enemy | KNIGHT
+        for offset in KNIGHT_OFFSETS:
+            if board[square + offset] == knight:
+                return True
+        king = enemy | KING
+        for offset in QUEEN_OFFSETS:
+            if board[square + offset] == king:
+                return True
+        pawn = enemy | PAWN
+        pawn_offset = NORTH if enemy == BLACK else SOUTH  # enemy pawns attack from the squares in front
+        if board[square + pawn_offset - 1] == pawn or board[square + pawn_offset + 1] == pawn:
+            return True
+        queen = enemy | QUEEN
+        for offsets, slider in ((ORTHOGONAL_OFFSETS, enemy | ROOK), (DIAGONAL_OFFSETS, enemy | BISHOP)):
+            for offset in offsets:
+                target = square + offset
+                piece = board[target]
+                while piece == EMPTY:
+                    target += offset
+                    piece = board[target]
+                if piece == slider or piece == queen:
+                    return True
+        return False
+
+    def inCheck(self):
+        ally, enemy, _, king_square = self.getSideToMove()
+        return self.squareAttacked(king_square, enemy)
+
+    def squareUnderAttack(self, row, col):
+        return self.squareAttacked(21 + row * 10 + col, BLACK if self.white_to_move else WHITE)
+
+    def checkForPinsAndChecks(self):
+        board = self.mailbox
+        ally, enemy, forward, king_square = self.getSideToMove()
+        pins = {}
+        checks = []
+        queen = enemy | QUEEN
+        for offsets, slider in ((ORTHOGONAL_OFFSETS, enemy | ROOK), (DIAGONAL_OFFSETS, enemy | BISHOP)):
+            for offset in offsets:
+                possible_pin = None
+                target = king_square + offset
+                while True:
+                    piece = board[target]
+                    if piece == EMPTY:
+                        target += offset
+                    elif piece & ally and possible_pin is None:  # first allied piece could be pinned
+                        possible_pin = target
+                        target += offset
+                    else:
+                        if piece == slider or piece == queen:
+                            if possible_pin is None:
+                                checks.append((target, offset))
+                            else:
+                                pins[possible_pin] = offset
+                        break
+        pawn = enemy | PAWN
+        for offset in (forward - 1, forward + 1):
+            if board[king_square + offset] == pawn:
+                checks.append((king_square + offset, offset))
+        knight = enemy | KNIGHT
+        for offset in KNIGHT_OFFSETS:
+            if board[king_square + offset] == knight:
+                checks.append((king_square + offset, offset))
+        return len(checks) > 0, pins, checks
+
+    def getAllPossibleMoves(self):
+        moves = []
+        board = self.mailbox
+        ally = WHITE if self.white_to_move else BLACK
+        for square in BOARD_SQUARES:
+            piece = board[square]
+            if piece & ally:
+                row, col = square_coordinates[square]
+                piece_type = piece & TYPE_MASK
+                if piece_type == PAWN:
+                    self.getPawnMoves(row, col, moves)
+                elif piece_type == KNIGHT:
+                    self.getKnightMoves(row, col, moves)
+                elif piece_type == BISHOP:
+                    self.getSlidingMoves(square, DIAGONAL_OFFSETS, moves)
+                elif piece_type == ROOK:
+                    self.getSlidingMoves(square, ORTHOGONAL_OFFSETS, moves)
+                elif piece_type == QUEEN:
+                    self.getSlidingMoves(square, QUEEN_OFFSETS, moves)
+                else:
+                    self.getKingMoves(row, col, moves)
+        return moves
+
+    def getPseudoLegalMoves(self):
+        moves = []
+        self.pins = {}  # the generators skip the pin restrictions
+        self.checks = []
+        board = self.mailbox
+        ally, enemy, _, king_square = self.getSideToMove()
+        for square in BOARD_SQUARES:
+            piece = board[square]
+            if piece & ally:
+                row, col = square_coordinates[square]
+                if piece & TYPE_MASK == KING:
+                    self.getPseudoLegalKingMoves(row, col, moves)
+                else:
+                    self.moveFunctions[self.board[row][col][1]](row, col, moves)
+        self.getCastleMoves(*square_coordinates[king_square], moves)
+        return moves
+
+    def enpassantIsLegal(self, square, target, captured_square, king_square, enemy):
+        """
+        Make the en-passant capture on the mailbox and look if it leaves the king attacked,
+        this catches the two pawns leaving the king's rank together.
+        """
+        board = self.mailbox
+        pawn = board[square]
+        captured = board[captured_square]
+        board[square] = board[captured_square] = EMPTY
+        board[target] = pawn
+        legal = not self.squareAttacked(king_square, enemy)
+        board[target] = EMPTY
+        board[square] = pawn
+        board[captured_square] = captured
+        return legal
+
+    def getPawnMoves(self, row, col, moves):
+        board = self.mailbox
+        ally, enemy, forward, king_square = self.getSideToMove()
+        square = 21 + row * 10 + col
+        pin = self.pins.get(square)
+        target = square + forward
+        if board[target] == EMPTY and (pin is None or pin == forward or pin == -forward):
+            moves.append(Move((row, col), square_coordinates[target], self.board))
+            if row == (6 if ally == WHITE else 1) and board[target + forward] == EMPTY:  # 2 square pawn advance
+                moves.append(Move((row, col), square_coordinates[target + forward], self.board))
+        enpassant_square = None if self.enpassant_possible == () else mailboxSquare(*self.enpassant_possible)
+        for offset in (forward - 1, forward + 1):
+            if pin is not None and pin != offset and pin != -offset:
+                continue
+            target = square + offset
+            if board[target] & enemy:
+                moves.append(Move((row, col), square_coordinates[target], self.board))
+            elif target == enpassant_square and self.enpassantIsLegal(square, target, target - forward, king_square,
+                                                                       enemy):
+                moves.append(Move((row, col), square_coordinates[target], self.board, is_enpassant_move=True))
+
+    def getKnightMoves(self, row, col, moves):
+        square = 21 + row * 10 + col
+        if square in self.pins:
+            return
+        board = self.mailbox
+        enemy = BLACK if self.white_to_move else WHITE
+        for offset in KNIGHT_OFFSETS:
+            piece = board[square + offset]
+            if piece == EMPTY or piece & enemy:
+                moves.append(Move((row, col), square_coordinates[square + offset], self.board))
+
+    def getSlidingMoves(self, square, offsets, moves):
+        """
+        Moves of a bishop, rook or queen on the mailbox square along the given directions.
+        """
+        board = self.mailbox
+        enemy = BLACK if self.white_to_move else WHITE
+        start = square_coordinates[square]
+        pin = self.pins.get(square)
+        for offset in offsets:
+            if pin is not None and pin != offset and pin != -offset:
+                continue
+            target = square + offset
+            piece = board[target]
+            while piece == EMPTY:
+                moves.append(Move(start, square_coordinates[target], self.board))
+                target += offset
+                piece = board[target]
+            if piece & enemy:
+                moves.append(Move(start, square_coordinates[target], self.board))
+
+    def getBishopMoves(self, row, col, moves):
+        self.getSlidingMoves(21 + row * 10 + col, DIAGONAL_OFFSETS, moves)
+
+    def getRookMoves(self, row, col, moves):
+        self.getSlidingMoves(21 + row * 10 + col, ORTHOGONAL_OFFSETS, moves)
+
+    def getQueenMoves(self, row, col, moves):
+        self.getSlidingMoves(21 + row * 10 + col, QUEEN_OFFSETS, moves)
+
+    def getKingMoves(self, row, col, moves):
+        board = self.mailbox
+        square = 21 + row * 10 + col
+        king = board[square]
+        enemy = BLACK if king & WHITE else WHITE
+        board[square] = EMPTY  # the king must not block attacks along the line it moves on
+        for offset in QUEEN_OFFSETS:
+            piece = board[square + offset]
+            if (piece == EMPTY or piece & enemy) and not self.squareAttacked(square + offset, enemy):
+                moves.append(Move((row, col), square_coordinates[square + offset], self.board))
+        board[square] = king
+
+    def getPseudoLegalKingMoves(self, row, col, moves):
+        board = self.mailbox
+        square = 21 + row * 10 + col
+        enemy = BLACK if board[square] & WHITE else WHITE
+        for offset in QUEEN_OFFSETS:
+            piece = board[square + offset]
+            if piece == EMPTY or piece & enemy:
+                moves.append(Move((row, col), square_coordinates[square + offset], self.board))
+
+    def getCastleMoves(self, row, col, moves):
+        board = self.mailbox
+        square = 21 + row * 10 + col
+        enemy = BLACK if self.white_to_move else WHITE
+        if self.squareAttacked(square, enemy):
+            return  # can't castle while in check
+        if self.castling_rights & (chessEngine.WHITE_KINGSIDE if self.white_to_move else chessEngine.BLACK_KINGSIDE):
+            if board[square + 1] == EMPTY and board[square + 2] == EMPTY and not self.squareAttacked(
+                    square + 1, enemy) and not self.squareAttacked(square + 2, enemy):
+                moves.append(Move((row, col), (row, col + 2), self.board, is_castle_move=True))
+        if self.castling_rights & (
+                chessEngine.WHITE_QUEENSIDE if self.white_to_move else chessEngine.BLACK_QUEENSIDE):
+            if board[square - 1] == EMPTY and board[square - 2] == EMPTY and board[square - 3] == EMPTY and \
+                    not self.squareAttacked(square - 1, enemy) and not self.squareAttacked(square - 2, enemy):
+                moves.append(Move((row, col), (row, col - 2), self.board, is_castle_move=True))
+
+    def getCheckEvasionMoves(self, king_row, king_col, moves):
+        self.getKingMoves(king_row, king_col, moves)
+        if len(self.checks) != 1:  # double check, king has to move
+            return
+        board = self.mailbox
+        ally, enemy, forward, king_square = self.getSideToMove()
+        check_square, check_offset = self.checks[0]
+        targets = [check_square]
+        if board[check_square] & TYPE_MASK != KNIGHT:  # sliders can be blocked
+            target = king_square + check_offset
+            while target != check_square:
+                targets.append(target)
+                target += check_offset
+        pins = self.pins
+        knight = ally | KNIGHT
+        pawn = ally | PAWN
+        queen = ally | QUEEN
+        enpassant_square = None if self.enpassant_possible == () else mailboxSquare(*self.enpassant_possible)
+        for target in targets:
+            end = square_coordinates[target]
+            for offsets, slider in ((ORTHOGONAL_OFFSETS, ally | ROOK), (DIAGONAL_OFFSETS, ally | BISHOP)):
+                for offset in offsets:
+                    square = target + offset
+                    piece = board[square]
+                    while piece == EMPTY:
+                        square += offset
+                        piece = board[square]
+                    if (piece == slider or piece == queen) and square not in pins:
+                        moves.append(Move(square_coordinates[square], end, self.board))
+            for offset in KNIGHT_OFFSETS:
+                if board[target + offset] == knight and target + offset not in pins:
+                    moves.append(Move(square_coordinates[target + offset], end, self.board))
+            behind = target - forward  # the square pawns move to the target from
+            if board[target] == EMPTY:
+                if board[behind] == pawn:
+                    if behind not in pins:
+                        moves.append(Move(square_coordinates[behind], end, self.board))
+                elif board[behind] == EMPTY and end[0] == (4 if ally == WHITE else 3) and \
+                        board[behind - forward] == pawn and behind - forward not in pins:
+                    moves.append(Move(square_coordinates[behind - forward], end, self.board))
+                if target == enpassant_square:  # en-passant capture onto the blocking square
+                    for square in (behind - 1, behind + 1):
+                        if board[square] == pawn and square not in pins and self.enpassantIsLegal(
+                                square, target, behind, king_square, enemy):
+                            moves.append(Move(square_coordinates[square], end, self.board, is_enpassant_move=True))
+            else:
+                for square in (behind - 1, behind + 1):
+                    if board[square] == pawn and square not in pins:
+                        moves.append(Move(square_coordinates[square], end, self.board))
+        # a pawn that just advanced two squares and gives check can also be captured en-passant
+        if board[check_square] & TYPE_MASK == PAWN and check_square + forward == enpassant_square:
+            for square in (check_square - 1, check_square + 1):
+                if board[square] == pawn and square not in pins and self.enpassantIsLegal(
+                        square, enpassant_square, check_square, king_square, enemy):
+                    moves.append(Move(square_coordinates[square], self.enpassant_possible, self.board,
+                                      is_enpassant_move=True))
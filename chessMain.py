@@ -7,7 +7,7 @@ import pygame as p
 import chessEngine
 import chessAI
 import sys
-from multiprocessing import Process, Queue
+from multiprocessing import Process, Queue, Event
 
 BOARD_WIDTH = BOARD_HEIGHT = 512
 MOVE_LOG_PANEL_WIDTH = 250
@@ -15,6 +15,12 @@ MOVE_LOG_PANEL_HEIGHT = BOARD_HEIGHT
 DIMENSION = 8
 SQUARE_SIZE = BOARD_HEIGHT // DIMENSION
 MAX_FPS = 15
+ANIMATION_FPS = 60  # frame rate while a move is being animated
+AI_TIME_LIMIT = 15  # seconds the AI may think before it has to play its best move so far
+SEARCH_STOP_TIMEOUT = 1  # seconds to wait for a stopped search to return before killing it
+# board representation: chessMailbox.MailboxGameState and chessBitboard.BitboardGameState are drop-in replacements
+GAME_STATE_CLASS = chessEngine.GameState
+ANALYSIS_CACHE_PATH = None  # file of a persistent analysis cache (see chessCache) the AI uses, or None
 IMAGES = {}
 
 
@@ -25,7 +31,194 @@ def loadImages():
     """
     pieces = ['wp', 'wR', 'wN', 'wB', 'wK', 'wQ', 'bp', 'bR', 'bN', 'bB', 'bK', 'bQ']
     for piece in pieces:
-        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"), (SQUARE_SIZE, SQUARE_SIZE))
+        IMAGES[piece] = p.transform.scale(p.image.load("images/" + piece + ".png"),
+                                          (SQUARE_SIZE, SQUARE_SIZE)).convert_alpha()
+
+
+class MoveAnimation:
+    """
+    A piece sliding from the start square of a move to its end square.
+    The main loop advances it every frame, so input is still handled while it runs.
+    """
+    seconds_per_square = 10 / 60  # 10 frames at 60 fps per square
+
+    def __init__(self, move):
+        self.move = move
+        self.duration = (abs(move.end_row - move.start_row) + abs(move.end_col - move.start_col)) * \
+            self.seconds_per_square * 1000
+        self.start_time = p.time.get_ticks()
+        # while the piece is on its way the end square shows the captured piece
+        self.square_overrides = {(move.end_row, move.end_col): "--"}
+        if move.piece_captured != '--':
+            if move.is_enpassant_move:
+                self.square_overrides[(move.start_row, move.end_col)] = move.piece_captured
+            else:
+                self.square_overrides[(move.end_row, move.end_col)] = move.piece_captured
+
+    def finished(self):
+        return p.time.get_ticks() - self.start_time >= self.duration
+
+    def position(self):
+        """
+        Current (row, col) of the moving piece, not necessarily whole numbers.
+        """
+        progress = min((p.time.get_ticks() - self.start_time) / self.duration, 1) if self.duration else 1
+        return (self.move.start_row + (self.move.end_row - self.move.start_row) * progress,
+                self.move.start_col + (self.move.end_col - self.move.start_col) * progress)
+
+
+class BoardRenderer:
+    """
+    Draws the board from cached surfaces.
+    Remembers what every square shows and only redraws the squares that changed,
+    the changed areas are collected so only they are copied to the display.
+    """
+
+    def __init__(self, screen):
+        self.screen = screen
+        # pre-rendered board without pieces
+        self.background = p.Surface((BOARD_WIDTH, BOARD_HEIGHT)).convert()
+        colors = [p.Color("white"), p.Color("gray")]
+        for row in range(DIMENSION):
+            for column in range(DIMENSION):
+                self.background.fill(colors[((row + column) % 2)],
+                                     p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+        self.highlights = {}
+        for name, color in (("last_move", "green"), ("selected", "blue"), ("move", "yellow")):
+            surface = p.Surface((SQUARE_SIZE, SQUARE_SIZE)).convert()
+            surface.set_alpha(100)  # transparency value 0 -> transparent, 255 -> opaque
+            surface.fill(p.Color(color))
+            self.highlights[name] = surface
+        self.drawn_squares = [[None] * DIMENSION for _ in range(DIMENSION)]
+        self.dirty_rects = []
+        self.animation = None
+        self.sprite_squares = []  # squares the animated piece was drawn over on the last frame
+
+    def animate(self, move):
+        self.animation = MoveAnimation(move)
+
+    def cancelAnimation(self):
+        """
+        Skip the rest of the animation, the next frame shows the board as it is.
+        """
+        self.animation = None
+
+    def invalidate(self):
+        """
+        Redraw every square on the next frame, needed after something else has drawn over the board.
+        """
+        self.drawn_squares = [[None] * DIMENSION for _ in range(DIMENSION)]
+
+    def draw(self, game_state, valid_moves, square_selected):
+        if self.animation is not None and self.animation.finished():
+            self.animation = None
+        overrides = self.animation.square_overrides if self.animation is not None else {}
+        for row, column in self.sprite_squares:
+            self.drawn_squares[row][column] = None
+        highlights = getHighlights(game_state, valid_moves, square_selected)
+        for row in range(DIMENSION):
+            for column in range(DIMENSION):
+                square = (overrides.get((row, column), game_state.board[row][column]),
+                          highlights.get((row, column), ()))
+                if self.drawn_squares[row][column] != square:
+                    self.drawSquare(row, column, square[0], square[1])
+                    self.drawn_squares[row][column] = square
+        self.sprite_squares = []
+        if self.animation is not None:
+            row, column = self.animation.position()
+            rect = p.Rect(round(column * SQUARE_SIZE), round(row * SQUARE_SIZE), SQUARE_SIZE, SQUARE_SIZE)
+            self.screen.blit(IMAGES[self.animation.move.piece_moved], rect)
+            self.dirty_rects.append(rect)
+            self.sprite_squares = [(sprite_row, sprite_column)
+                                   for sprite_row in range(int(row), min(int(row) + 2, DIMENSION))
+                                   for sprite_column in range(int(column), min(int(column) + 2, DIMENSION))]
+
+    def drawSquare(self, row, column, piece, highlights):
+        rect = p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
+        self.screen.blit(self.background, rect, rect)
+        for highlight in highlights:
+            self.screen.blit(self.highlights[highlight], rect)
+        if piece != "--":
+            self.screen.blit(IMAGES[piece], rect)
+        self.dirty_rects.append(rect)
+
+    def update(self, extra_rects=()):
+        """
+        Copy the changed areas of the screen to the display.
+        """
+        self.dirty_rects.extend(extra_rects)
+        if self.dirty_rects:
+            p.display.update(self.dirty_rects)
+            self.dirty_rects = []
+
+
+class MoveLogPanel:
+    """
+    The move log next to the board.
+    Rendered text lines are cached, after a move is made or undone only the lines from that move on are rendered again.
+    Lines that don't fit in the panel can be scrolled with the mouse wheel.
+    """
+    moves_per_row = 3
+    padding = 5
+    line_spacing = 2
+
+    def __init__(self, screen, font):
+        self.screen = screen
+        self.font = font
+        self.rect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
+        self.line_height = font.get_linesize() + self.line_spacing
+        self.visible_lines = (MOVE_LOG_PANEL_HEIGHT - 2 * self.padding) // self.line_height
+        self.moves = []  # the moves the cached lines were rendered from
+        self.lines = []  # rendered text lines
+        self.scroll = 0  # index of the first visible line
+        self.dirty = True  # the panel has to be drawn again
+
+    def sync(self, move_log):
+        """
+        Bring the cached lines up to date with the move log.
+        Moves are only ever added or taken back at the end, so only the last lines are compared and rendered.
+        """
+        common = min(len(self.moves), len(move_log))
+        while common > 0 and self.moves[common - 1] is not move_log[common - 1]:
+            common -= 1
+        if common == len(self.moves) == len(move_log):
+            return
+        follow = self.scroll >= self.maxScroll()  # keep showing the latest moves if they were shown
+        del self.moves[common:]
+        self.moves.extend(move_log[common:])
+        plies_per_line = 2 * self.moves_per_row
+        first_line = common // plies_per_line
+        del self.lines[first_line:]
+        for start in range(first_line * plies_per_line, len(self.moves), plies_per_line):
+            text = ""
+            for i in range(start, min(start + plies_per_line, len(self.moves)), 2):
+                text += str(i // 2 + 1) + '. ' + str(self.moves[i]) + " "
+                if i + 1 < len(self.moves):
+                    text += str(self.moves[i + 1]) + "  "
+            self.lines.append(self.font.render(text, True, p.Color('white')))
+        self.scroll = self.maxScroll() if follow else min(self.scroll, self.maxScroll())
+        self.dirty = True
+
+    def maxScroll(self):
+        return max(0, len(self.lines) - self.visible_lines)
+
+    def scrollBy(self, lines):
+        scroll = min(max(self.scroll + lines, 0), self.maxScroll())
+        if scroll != self.scroll:
+            self.scroll = scroll
+            self.dirty = True
+
+    def draw(self):
+        """
+        Draws the visible lines and returns the area of the screen that was drawn.
+        """
+        p.draw.rect(self.screen, p.Color('black'), self.rect)
+        text_y = self.padding
+        for line in self.lines[self.scroll:self.scroll + self.visible_lines]:
+            self.screen.blit(line, self.rect.move(self.padding, text_y))
+            text_y += self.line_height
+        self.dirty = False
+        return self.rect
 
 
 def main():
@@ -37,19 +230,23 @@ def main():
     screen = p.display.set_mode((BOARD_WIDTH + MOVE_LOG_PANEL_WIDTH, BOARD_HEIGHT))
     clock = p.time.Clock()
     screen.fill(p.Color("white"))
-    game_state = chessEngine.GameState()
+    game_state = GAME_STATE_CLASS()
     valid_moves = game_state.getValidMoves()
     move_made = False  # flag variable for when a move is made
     animate = False  # flag variable for when we should animate a move
     loadImages()  # do this only once before while loop
+    renderer = BoardRenderer(screen)
+    move_log_changed = True  # flag variable for when the move log panel has to be brought up to date
     running = True
     square_selected = ()  # no square is selected initially, this will keep track of the last click of the user (tuple(row,col))
     player_clicks = []  # this will keep track of player clicks (two tuples)
     game_over = False
+    end_game_text = None  # text to show when the game is over and the last animation has finished
     ai_thinking = False
     move_undone = False
     move_finder_process = None
-    move_log_font = p.font.SysFont("Arial", 14, False, False)
+    stop_event = None  # set to make the AI search return its best move so far
+    move_log_panel = MoveLogPanel(screen, p.font.SysFont("Arial", 14, False, False))
     player_one = True  # if a human is playing white, then this will be True, else False
     player_two = False  # if a hyman is playing white, then this will be True, else False
 
@@ -59,8 +256,14 @@ def main():
             if e.type == p.QUIT:
                 p.quit()
                 sys.exit()
+            elif e.type == p.VIDEOEXPOSE:  # the window contents were lost, draw everything again
+                renderer.invalidate()
+                move_log_panel.dirty = True
+            elif e.type == p.MOUSEBUTTONDOWN and e.button in (4, 5):  # mouse wheel scrolls the move log
+                move_log_panel.scrollBy(-1 if e.button == 4 else 1)
             # mouse handler
             elif e.type == p.MOUSEBUTTONDOWN:
+                renderer.cancelAnimation()
                 if not game_over:
                     location = p.mouse.get_pos()  # (x, y) location of the mouse
                     col = location[0] // SQUARE_SIZE
@@ -86,33 +289,47 @@ def main():
             # key handler
             elif e.type == p.KEYDOWN:
                 if e.key == p.K_z:  # undo when 'z' is pressed
+                    renderer.cancelAnimation()
                     game_state.undoMove()
                     move_made = True
                     animate = False
+                    if game_over:
+                        renderer.invalidate()  # remove the end game text
                     game_over = False
+                    end_game_text = None
                     if ai_thinking:
-                        move_finder_process.terminate()
+                        stopMoveFinder(move_finder_process, stop_event)
                         ai_thinking = False
                     move_undone = True
                 if e.key == p.K_r:  # reset the game when 'r' is pressed
-                    game_state = chessEngine.GameState()
+                    renderer.cancelAnimation()
+                    game_state = GAME_STATE_CLASS()
                     valid_moves = game_state.getValidMoves()
                     square_selected = ()
                     player_clicks = []
                     move_made = False
                     animate = False
+                    if game_over:
+                        renderer.invalidate()
                     game_over = False
+                    end_game_text = None
+                    move_log_changed = True
                     if ai_thinking:
-                        move_finder_process.terminate()
+                        stopMoveFinder(move_finder_process, stop_event)
                         ai_thinking = False
                     move_undone = True
+                if e.key == p.K_m and ai_thinking:  # make the AI move now when 'm' is pressed
+                    stop_event.set()
 
         # AI move finder
         if not game_over and not human_turn and not move_undone:
             if not ai_thinking:
                 ai_thinking = True
                 return_queue = Queue()  # used to pass data between threads
-                move_finder_process = Process(target=chessAI.findBestMove, args=(game_state, valid_moves, return_queue))
+                stop_event = Event()
+                move_finder_process = Process(target=chessAI.findBestMove,
+                                              args=(game_state, valid_moves, return_queue, stop_event, AI_TIME_LIMIT,
+                                                    ANALYSIS_CACHE_PATH))
                 move_finder_process.start()
 
             if not move_finder_process.is_alive():
@@ -126,120 +343,67 @@ def main():
 
         if move_made:
             if animate:
-                animateMove(game_state.move_log[-1], screen, game_state.board, clock)
+                renderer.animate(game_state.move_log[-1])
             valid_moves = game_state.getValidMoves()
             move_made = False
             animate = False
             move_undone = False
+            move_log_changed = True
 
-        drawGameState(screen, game_state, valid_moves, square_selected)
+        renderer.draw(game_state, valid_moves, square_selected)
+        dirty_rects = []
 
-        if not game_over:
-            drawMoveLog(screen, game_state, move_log_font)
+        if not game_over and move_log_changed:
+            move_log_panel.sync(game_state.move_log)
+            move_log_changed = False
+        if move_log_panel.dirty:
+            dirty_rects.append(move_log_panel.draw())
 
-        if game_state.checkmate:
+        if not game_over and (game_state.checkmate or game_state.stalemate):
             game_over = True
-            if game_state.white_to_move:
-                drawEndGameText(screen, "Black wins by checkmate")
+            if game_state.stalemate:
+                end_game_text = "Stalemate"
+            elif game_state.white_to_move:
+                end_game_text = "Black wins by checkmate"
             else:
-                drawEndGameText(screen, "White wins by checkmate")
-
-        elif game_state.stalemate:
-            game_over = True
-            drawEndGameText(screen, "Stalemate")
-
-        clock.tick(MAX_FPS)
-        p.display.flip()
+                end_game_text = "White wins by checkmate"
+        if end_game_text is not None and renderer.animation is None:  # show it once the last move has arrived
+            dirty_rects.append(drawEndGameText(screen, end_game_text))
+            end_game_text = None
 
-
-def drawGameState(screen, game_state, valid_moves, square_selected):
-    """
-    Responsible for all the graphics within current game state.
-    """
-    drawBoard(screen)  # draw squares on the board
-    highlightSquares(screen, game_state, valid_moves, square_selected)
-    drawPieces(screen, game_state.board)  # draw pieces on top of those squares
+        clock.tick(ANIMATION_FPS if renderer.animation is not None else MAX_FPS)
+        renderer.update(dirty_rects)
 
 
-def drawBoard(screen):
+def stopMoveFinder(move_finder_process, stop_event):
     """
-    Draw the squares on the board.
-    The top left square is always light.
+    Ask the AI search to stop and wait until it has unwound.
     """
-    global colors
-    colors = [p.Color("white"), p.Color("gray")]
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            color = colors[((row + column) % 2)]
-            p.draw.rect(screen, color, p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
+    stop_event.set()
+    move_finder_process.join(SEARCH_STOP_TIMEOUT)
+    if move_finder_process.is_alive():  # only if the search did not notice the stop signal in time
+        move_finder_process.terminate()
 
 
-def highlightSquares(screen, game_state, valid_moves, square_selected):
+def getHighlights(game_state, valid_moves, square_selected):
     """
-    Highlight square selected and moves for piece selected.
+    Highlights of the squares: the last move, the square selected and the moves for the piece selected.
+    Returns a dictionary of (row, col) -> tuple of highlight names in drawing order.
     """
+    highlights = {}
     if (len(game_state.move_log)) > 0:
         last_move = game_state.move_log[-1]
-        s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-        s.set_alpha(100)
-        s.fill(p.Color('green'))
-        screen.blit(s, (last_move.end_col * SQUARE_SIZE, last_move.end_row * SQUARE_SIZE))
+        highlights[(last_move.end_row, last_move.end_col)] = ("last_move",)
     if square_selected != ():
         row, col = square_selected
         if game_state.board[row][col][0] == (
                 'w' if game_state.white_to_move else 'b'):  # square_selected is a piece that can be moved
-            # highlight selected square
-            s = p.Surface((SQUARE_SIZE, SQUARE_SIZE))
-            s.set_alpha(100)  # transparency value 0 -> transparent, 255 -> opaque
-            s.fill(p.Color('blue'))
-            screen.blit(s, (col * SQUARE_SIZE, row * SQUARE_SIZE))
-            # highlight moves from that square
-            s.fill(p.Color('yellow'))
+            highlights[(row, col)] = highlights.get((row, col), ()) + ("selected",)
             for move in valid_moves:
                 if move.start_row == row and move.start_col == col:
-                    screen.blit(s, (move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE))
-
-
-def drawPieces(screen, board):
-    """
-    Draw the pieces on the board using the current game_state.board
-    """
-    for row in range(DIMENSION):
-        for column in range(DIMENSION):
-            piece = board[row][column]
-            if piece != "--":
-                screen.blit(IMAGES[piece], p.Rect(column * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-
-
-def drawMoveLog(screen, game_state, font):
-    """
-    Draws the move log.
-
-    """
-    move_log_rect = p.Rect(BOARD_WIDTH, 0, MOVE_LOG_PANEL_WIDTH, MOVE_LOG_PANEL_HEIGHT)
-    p.draw.rect(screen, p.Color('black'), move_log_rect)
-    move_log = game_state.move_log
-    move_texts = []
-    for i in range(0, len(move_log), 2):
-        move_string = str(i // 2 + 1) + '. ' + str(move_log[i]) + " "
-        if i + 1 < len(move_log):
-            move_string += str(move_log[i + 1]) + "  "
-        move_texts.append(move_string)
-
-    moves_per_row = 3
-    padding = 5
-    line_spacing = 2
-    text_y = padding
-    for i in range(0, len(move_texts), moves_per_row):
-        text = ""
-        for j in range(moves_per_row):
-            if i + j < len(move_texts):
-                text += move_texts[i + j]
-
-        text_object = font.render(text, True, p.Color('white'))
-        text_location = move_log_rect.move(padding, text_y)
-        screen.blit(text_object, text_location)
-        text_y += text_object.get_height() + line_spacing
+                    square = (move.end_row, move.end_col)
+                    highlights[square] = highlights.get(square, ()) + ("move",)
+    return highlights
 
 
 def drawEndGameText(screen, text):
@@ -250,35 +414,7 @@ def drawEndGameText(screen, text):
     screen.blit(text_object, text_location)
     text_object = font.render(text, False, p.Color('black'))
     screen.blit(text_object, text_location.move(2, 2))
-
-
-def animateMove(move, screen, board, clock):
-    """
-    Animating a move
-    """
-    global colors
-    d_row = move.end_row - move.start_row
-    d_col = move.end_col - move.start_col
-    frames_per_square = 10  # frames to move one square
-    frame_count = (abs(d_row) + abs(d_col)) * frames_per_square
-    for frame in range(frame_count + 1):
-        row, col = (move.start_row + d_row * frame / frame_count, move.start_col + d_col * frame / frame_count)
-        drawBoard(screen)
-        drawPieces(screen, board)
-        # erase the piece moved from its ending square
-        color = colors[(move.end_row + move.end_col) % 2]
-        end_square = p.Rect(move.end_col * SQUARE_SIZE, move.end_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-        p.draw.rect(screen, color, end_square)
-        # draw captured piece onto rectangle
-        if move.piece_captured != '--':
-            if move.is_enpassant_move:
-                enpassant_row = move.end_row + 1 if move.piece_captured[0] == 'b' else move.end_row - 1
-                end_square = p.Rect(move.end_col * SQUARE_SIZE, enpassant_row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE)
-            screen.blit(IMAGES[move.piece_captured], end_square)
-        # draw moving piece
-        screen.blit(IMAGES[move.piece_moved], p.Rect(col * SQUARE_SIZE, row * SQUARE_SIZE, SQUARE_SIZE, SQUARE_SIZE))
-        p.display.flip()
-        clock.tick(60)
+    return text_location.inflate(4, 4)
 
 
 if __name__ == "__main__":
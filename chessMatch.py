@@ -0,0 +1,283 @@
+"""
+Headless engine vs engine matches.
+Plays colour-swapped pairs of games from an opening suite across a process pool,
+writes the games as PGN and reports the Elo difference, with an optional SPRT early stop.
+"""
+import argparse
+import datetime
+import importlib
+import math
+import multiprocessing
+import random
+import time
+import chessEngine
+import chessPGN
+
+MAX_GAME_PLIES = 300  # longer games are adjudicated as a draw
+
+# short openings in coordinate notation, each one is played twice with the colours swapped
+DEFAULT_OPENINGS = [
+    "e2e4 e7e5 g1f3 b8c6 f1b5",
+    "e2e4 e7e5 g1f3 b8c6 f1c4",
+    "e2e4 c7c5 g1f3 d7d6",
+    "e2e4 c7c5 b1c3 b8c6",
+    "e2e4 e7e6 d2d4 d7d5",
+    "e2e4 c7c6 d2d4 d7d5",
+    "e2e4 d7d5 e4d5 d8d5",
+    "d2d4 d7d5 c2c4 e7e6",
+    "d2d4 d7d5 c2c4 c7c6",
+    "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4",
+    "d2d4 g8f6 c2c4 g7g6 b1c3 f8g7",
+    "d2d4 f7f5 g2g3 g8f6",
+    "c2c4 e7e5 b1c3 g8f6",
+    "g1f3 d7d5 g2g3 g8f6",
+    "e2e4 e7e5 f2f4 e5f4",
+    "d2d4 d7d5 c1f4 g8f6 e2e3",
+]
+
+
+class EngineConfig:
+    """
+    One side of a match: the search module to use and its search limits.
+    Parsed from strings like "name=new,module=chessAI,depth=3,nodes=20000,time=0.5".
+    "cache=analysis.db" makes the engine use and fill a persistent analysis cache,
+    "pseudo=1" makes it search with pseudo-legal move generation.
+    """
+
+    def __init__(self, text):
+        self.name = None
+        self.module = "chessAI"
+        self.depth = None
+        self.nodes = None
+        self.time = None
+        self.cache = None
+        self.pseudo_legal = False
+        for option in filter(None, text.split(",")):
+            key, _, value = option.partition("=")
+            if key == "name":
+                self.name = value
+            elif key == "module":
+                self.module = value
+            elif key == "depth":
+                self.depth = int(value)
+            elif key == "nodes":
+                self.nodes = int(value)
+            elif key == "time":
+                self.time = float(value)
+            elif key == "cache":
+                self.cache = value
+            elif key == "pseudo":
+                self.pseudo_legal = value != "0"
+            else:
+                raise ValueError("Unknown engine option: " + key)
+        if self.name is None:
+            self.name = text
+
+    def search(self, game_state, valid_moves):
+        """
+        Returns the best move, its score for the side to move, the number of nodes searched
+        and the principal variation.
+        """
+        engine = importlib.import_module(self.module)
+        depth = self.depth if self.depth is not None else engine.DEPTH
+        options = {}  # only the options that are set, engine modules of older versions may not know them
+        if self.cache is not None:
+            options["cache"] = engine.openAnalysisCache(self.cache)
+        if self.pseudo_legal:
+            options["pseudo_legal"] = True
+        return engine.findBestMoveWithLimits(game_state, valid_moves, depth, self.nodes, self.time, **options)
+
+    def analysisCache(self):
+        """
+        The analysis cache of the engine in this process, or None.
+        """
+        if self.cache is None:
+            return None
+        return importlib.import_module(self.module).openAnalysisCache(self.cache)
+
+    def findMove(self, game_state, valid_moves):
+        return self.search(game_state, valid_moves)[0]
+
+
+def loadOpenings(path):
+    """
+    Read an opening suite, one opening per line: either a FEN or moves in coordinate notation.
+    Empty lines and lines starting with '#' are skipped.
+    """
+    if path is None:
+        return list(DEFAULT_OPENINGS)
+    with open(path) as file:
+        return [line.strip() for line in file if line.strip() and not line.startswith("#")]
+
+
+def parseCoordinateMove(game_state, text):
+    """
+    Find the valid move given in coordinate notation, for example "e2e4".
+    """
+    start = (chessEngine.Move.ranks_to_rows[text[1]], chessEngine.Move.files_to_cols[text[0]])
+    end = (chessEngine.Move.ranks_to_rows[text[3]], chessEngine.Move.files_to_cols[text[2]])
+    move = chessEngine.Move(start, end, game_state.board)
+    for valid_move in game_state.getValidMoves():
+        if valid_move == move:
+            return valid_move
+    raise ValueError("Illegal move in opening: " + text)
+
+
+def setUpOpening(opening):
+    """
+    Returns the game state after the opening and the FEN the game started from (None for the start position).
+    """
+    if "/" in opening:
+        return chessEngine.GameState(opening), opening
+    game_state = chessEngine.GameState()
+    for text in opening.split():
+        game_state.makeMove(parseCoordinateMove(game_state, text))
+    return game_state, None
+
+
+def isInsufficientMaterial(board):
+    """
+    Only kings, or kings and a single minor piece are left.
+    """
+    minor_pieces = 0
+    for row in board:
+        for piece in row:
+            if piece == "--" or piece[1] == "K":
+                continue
+            if piece[1] in "pRQ":
+                return False
+            minor_pieces += 1
+    return minor_pieces <= 1
+
+
+def playGame(task):
+    """
+    Play one game. Runs in a worker process.
+    Returns (game index, result from the first engine's point of view, PGN text).
+    """
+    index, opening, first_engine_white, first_engine, second_engine, seed = task
+    random.seed(seed)
+    game_state, start_fen = setUpOpening(opening)
+    white, black = (first_engine, second_engine) if first_engine_white else (second_engine, first_engine)
+    positions_seen = {game_state.zobrist_key: 1}
+    result, termination = "1/2-1/2", "adjudication"
+    while True:
+        valid_moves = game_state.getValidMoves()
+        if game_state.checkmate:
+            result, termination = ("0-1" if game_state.white_to_move else "1-0"), "checkmate"
+            break
+        if game_state.stalemate:
+            termination = "stalemate"
+            break
+        if game_state.halfmove_clock >= 100:
+            termination = "fifty move rule"
+            break
+        if positions_seen[game_state.zobrist_key] >= 3:
+            termination = "threefold repetition"
+            break
+        if isInsufficientMaterial(game_state.board):
+            termination = "insufficient material"
+            break
+        if len(game_state.move_log) >= MAX_GAME_PLIES:
+            break
+        engine = white if game_state.white_to_move else black
+        game_state.makeMove(engine.findMove(game_state, valid_moves))
+        positions_seen[game_state.zobrist_key] = positions_seen.get(game_state.zobrist_key, 0) + 1
+
+    if result == "1/2-1/2":
+        score = 0.5
+    else:
+        score = 1.0 if (result == "1-0") == first_engine_white else 0.0
+    headers = {"Event": "Engine match", "Site": "chessMatch", "Date": datetime.date.today().strftime("%Y.%m.%d"),
+               "Round": str(index + 1), "White": white.name, "Black": black.name, "Result": result,
+               "Termination": termination}
+    return index, score, chessPGN.gameToPGN(headers, game_state.move_log, start_fen)
+
+
+def eloFromScore(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def eloDifference(wins, draws, losses):
+    """
+    Elo difference of the first engine and the half width of its 95% confidence interval.
+    """
+    games = wins + draws + losses
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    return eloFromScore(score), (eloFromScore(score + margin) - eloFromScore(score - margin)) / 2
+
+
+def sprtLogLikelihoodRatio(wins, draws, losses, elo0, elo1):
+    """
+    Log-likelihood ratio of H1 (elo1) against H0 (elo0), using the normal approximation of the game scores.
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    if variance == 0:
+        return 0.0
+    score0 = 1 / (1 + 10 ** (-elo0 / 400))
+    score1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return games * (score1 - score0) * (2 * score - score0 - score1) / (2 * variance)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play engine vs engine games and report the Elo difference.")
+    parser.add_argument("--engine1", default="name=engine1", help="engine under test, e.g. name=new,depth=3")
+    parser.add_argument("--engine2", default="name=engine2", help="baseline engine, e.g. name=old,nodes=20000")
+    parser.add_argument("--games", type=int, default=100, help="maximum number of games, rounded up to pairs")
+    parser.add_argument("--openings", help="opening suite file, one FEN or coordinate move list per line")
+    parser.add_argument("--pgn", default="match.pgn", help="file the games are appended to")
+    parser.add_argument("--workers", type=int, default=multiprocessing.cpu_count())
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sprt", nargs=2, type=float, metavar=("ELO0", "ELO1"),
+                        help="stop early when the SPRT between these Elo hypotheses is decided")
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    args = parser.parse_args()
+
+    first_engine = EngineConfig(args.engine1)
+    second_engine = EngineConfig(args.engine2)
+    openings = loadOpenings(args.openings)
+    rng = random.Random(args.seed)
+    tasks = []
+    for pair in range((args.games + 1) // 2):
+        opening = openings[pair % len(openings)]
+        for first_engine_white in (True, False):
+            tasks.append((len(tasks), opening, first_engine_white, first_engine, second_engine, rng.getrandbits(32)))
+    lower_bound = math.log(args.beta / (1 - args.alpha))
+    upper_bound = math.log((1 - args.beta) / args.alpha)
+
+    wins = draws = losses = 0
+    start = time.perf_counter()
+    with multiprocessing.Pool(args.workers) as pool, open(args.pgn, "a") as pgn_file:
+        for index, score, pgn in pool.imap_unordered(playGame, tasks):
+            pgn_file.write(pgn)
+            if score == 1.0:
+                wins += 1
+            elif score == 0.0:
+                losses += 1
+            else:
+                draws += 1
+            games = wins + draws + losses
+            elo, margin = eloDifference(wins, draws, losses)
+            status = "{} games  +{} ={} -{}  elo {:+.1f} +/- {:.1f}  {:.0f} games/hour".format(
+                games, wins, draws, losses, elo, margin, games * 3600 / (time.perf_counter() - start))
+            if args.sprt is not None:
+                llr = sprtLogLikelihoodRatio(wins, draws, losses, args.sprt[0], args.sprt[1])
+                status += "  llr {:.2f} ({:.2f}, {:.2f})".format(llr, lower_bound, upper_bound)
+                if llr >= upper_bound or llr <= lower_bound:
+                    print(status)
+                    print("SPRT: H1 accepted" if llr >= upper_bound else "SPRT: H0 accepted")
+                    pool.terminate()
+                    break
+            print(status, flush=True)
+
+
+if __name__ == "__main__":
+    main()
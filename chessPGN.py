@@ -0,0 +1,232 @@
+"""
+Reading and writing games in PGN.
+Games are read one at a time, so files of any size are processed in constant memory.
+Moves are converted between SAN and Move objects using GameState.getValidMoves.
+"""
+import argparse
+import re
+import time
+import chessEngine
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black", "Result")
+MAX_LINE_LENGTH = 80
+
+header_pattern = re.compile(r'\[\s*(\w+)\s+"((?:[^"\\]|\\.)*)"\s*\]')
+movetext_token_pattern = re.compile(r"\{[^}]*\}?|;[^\n]*|\$\d+|[()]|[^\s{}();$]+")
+move_number_pattern = re.compile(r"^\d+\.*")
+san_pattern = re.compile(r"^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?$")
+
+
+class PGNGame:
+    """
+    One game of a PGN file: the tag pairs, the moves in SAN and the result.
+    offset is the byte position of the game in the file it was read from.
+    """
+
+    def __init__(self, headers, moves, result, offset=0):
+        self.headers = headers
+        self.moves = moves
+        self.result = result
+        self.offset = offset
+
+    def startingGameState(self):
+        return chessEngine.GameState(self.headers.get("FEN"))
+
+    def replay(self):
+        """
+        Generator over the positions of the game.
+        Yields the game state before every move, its valid moves and the move played.
+        The same GameState is reused and the move is made when the generator is resumed.
+        Raises ValueError on an illegal or ambiguous move.
+        """
+        game_state = self.startingGameState()
+        for san in self.moves:
+            valid_moves = game_state.getValidMoves()
+            move = parseSAN(game_state, san, valid_moves)
+            yield game_state, valid_moves, move
+            game_state.makeMove(move)
+
+
+def parseSAN(game_state, san, valid_moves=None):
+    """
+    Find the valid move of the current position written in SAN.
+    """
+    if valid_moves is None:
+        valid_moves = game_state.getValidMoves()
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        for move in valid_moves:
+            if move.is_castle_move and (move.end_col == 6) == (len(text) == 3):
+                return move
+        raise ValueError("Illegal move: " + san)
+    match = san_pattern.match(text)
+    if match is None:
+        raise ValueError("Invalid SAN: " + san)
+    piece, from_file, from_rank, target, promotion = match.groups()
+    piece = piece or "p"
+    end_row = chessEngine.Move.ranks_to_rows[target[1]]
+    end_col = chessEngine.Move.files_to_cols[target[0]]
+    start_col = None if from_file is None else chessEngine.Move.files_to_cols[from_file]
+    start_row = None if from_rank is None else chessEngine.Move.ranks_to_rows[from_rank]
+    candidates = [move for move in valid_moves
+                  if move.piece_moved[1] == piece and move.end_row == end_row and move.end_col == end_col and
+                  (start_col is None or move.start_col == start_col) and
+                  (start_row is None or move.start_row == start_row) and not move.is_castle_move]
+    if len(candidates) != 1:
+        raise ValueError(("Ambiguous" if candidates else "Illegal") + " move: " + san)
+    move = candidates[0]
+    if move.is_pawn_promotion and promotion is not None and promotion != move.promotion_piece:
+        move = chessEngine.Move((move.start_row, move.start_col), (move.end_row, move.end_col), game_state.board,
+                                promotion_piece=promotion)
+    return move
+
+
+def moveToSAN(game_state, move, valid_moves=None):
+    """
+    SAN of a valid move of the current position, including the check or checkmate mark.
+    """
+    if valid_moves is None:
+        valid_moves = game_state.getValidMoves()
+    san = move.getChessNotation(valid_moves)
+    game_state.makeMove(move)
+    game_state.getValidMoves()
+    if game_state.checkmate:
+        san += "#"
+    elif game_state.in_check:
+        san += "+"
+    game_state.undoMove()
+    return san
+
+
+def readGames(source):
+    """
+    Generator over the games of a PGN file, given as a path or a binary file object.
+    Only the game being read is kept in memory.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as file:
+            yield from readGames(file)
+        return
+    headers = {}
+    movetext = []
+    game_offset = offset = 0
+    in_comment = False
+    for raw_line in source:
+        line = raw_line.decode("utf-8", errors="replace").strip()
+        line_offset = offset
+        offset += len(raw_line)
+        if not in_comment and line.startswith("["):
+            if movetext:  # a tag after movetext starts the next game
+                yield makeGame(headers, movetext, game_offset)
+                headers = {}
+                movetext = []
+            if not headers:
+                game_offset = line_offset
+            match = header_pattern.match(line)
+            if match is not None:
+                headers[match.group(1)] = match.group(2).replace('\\"', '"').replace("\\\\", "\\")
+        elif line.startswith("%") or (not line and not in_comment):
+            continue
+        else:
+            if not headers and not movetext:
+                game_offset = line_offset
+            movetext.append(line)
+            # a brace comment may span lines, tags inside it must not start a new game
+            comment_start = line.rfind("{")
+            comment_end = line.rfind("}")
+            if comment_start != comment_end:
+                in_comment = comment_start > comment_end
+    if headers or movetext:
+        yield makeGame(headers, movetext, game_offset)
+
+
+def makeGame(headers, movetext, offset):
+    moves = []
+    result = headers.get("Result", "*")
+    variation_depth = 0
+    for token in movetext_token_pattern.findall("\n".join(movetext)):
+        if token[0] in "{;$":
+            continue
+        if token == "(":
+            variation_depth += 1
+        elif token == ")":
+            variation_depth = max(variation_depth - 1, 0)
+        elif variation_depth == 0:
+            if token in RESULTS:
+                result = token
+                continue
+            token = move_number_pattern.sub("", token)
+            if token:
+                moves.append(token)
+    return PGNGame(headers, moves, result, offset)
+
+
+def gameToPGN(headers, move_log, start_fen=None, comments=None):
+    """
+    PGN text of a game given as its tag pairs and the list of moves made from start_fen (or the start position).
+    comments, if given, has one comment (or None) for every move, written after the move.
+    """
+    headers = dict(headers)
+    result = headers.get("Result", "*")
+    if start_fen is not None:
+        headers.setdefault("SetUp", "1")
+        headers.setdefault("FEN", start_fen)
+    tags = [(key, headers.get(key, "?")) for key in SEVEN_TAG_ROSTER]
+    tags += [(key, value) for key, value in headers.items() if key not in SEVEN_TAG_ROSTER]
+    lines = ['[{} "{}"]'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+             for key, value in tags]
+    game_state = chessEngine.GameState(start_fen)
+    tokens = []
+    after_comment = False
+    for i, move in enumerate(move_log):
+        if game_state.white_to_move:
+            tokens.append(str(game_state.fullmove_number) + ".")
+        elif not tokens or after_comment:
+            tokens.append(str(game_state.fullmove_number) + "...")
+        tokens.append(moveToSAN(game_state, move))
+        after_comment = comments is not None and comments[i] is not None
+        if after_comment:
+            tokens.extend(("{" + comments[i].replace("}", ")") + "}").split())
+        game_state.makeMove(move)
+    tokens.append(result)
+    return "\n".join(lines) + "\n\n" + "\n".join(wrapTokens(tokens)) + "\n\n"
+
+
+def wrapTokens(tokens):
+    lines = []
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > MAX_LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure PGN reading throughput.")
+    parser.add_argument("pgn", help="PGN file to read")
+    parser.add_argument("--replay", action="store_true", help="also resolve every SAN move against the engine")
+    args = parser.parse_args()
+    games = positions = errors = 0
+    start = time.perf_counter()
+    for game in readGames(args.pgn):
+        games += 1
+        if args.replay:
+            try:
+                for _ in game.replay():
+                    positions += 1
+            except ValueError:
+                errors += 1
+    elapsed = time.perf_counter() - start
+    print("{} games in {:.2f}s, {:.0f} games/s".format(games, elapsed, games / elapsed))
+    if args.replay:
+        print("{} positions, {:.0f} positions/s, {} games with illegal moves".format(
+            positions, positions / elapsed, errors))
+
+
+if __name__ == "__main__":
+    main()
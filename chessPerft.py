@@ -0,0 +1,102 @@
+"""
+Perft - counting all the leaf nodes of the move tree to a given depth.
+Comparing the counts with known values catches move generation bugs
+and the nodes per second give a comparable measure of move generation speed.
+"""
+import argparse
+import time
+import chessBitboard
+import chessEngine
+import chessMailbox
+
+# (name, FEN, depth, expected leaf nodes)
+# the engine only promotes to a queen, so positions where under-promotions appear within the depth are left out
+PERFT_SUITE = [
+    ("start position", chessEngine.STARTING_FEN, 4, 197281),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1", 3, 97862),
+    ("rook endgame", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1", 4, 43238),
+    ("middlegame", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10", 3, 89890),
+]
+
+# board representations with the same GameState interface
+BACKENDS = {"strings": chessEngine.GameState, "mailbox": chessMailbox.MailboxGameState,
+            "bitboard": chessBitboard.BitboardGameState}
+
+
+def perft(game_state, depth):
+    """
+    Count the leaf nodes of the legal move tree of the given depth.
+    """
+    moves = game_state.getValidMoves()
+    if depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        game_state.makeMove(move)
+        nodes += perft(game_state, depth - 1)
+        game_state.undoMove()
+    return nodes
+
+
+def divide(game_state, depth):
+    """
+    Perft split by the root moves, used to find which move a wrong count comes from.
+    """
+    counts = {}
+    for move in game_state.getValidMoves():
+        game_state.makeMove(move)
+        counts[move.getRankFile(move.start_row, move.start_col) + move.getRankFile(move.end_row, move.end_col)] = \
+            perft(game_state, depth - 1) if depth > 1 else 1
+        game_state.undoMove()
+    return counts
+
+
+def runSuite(game_state_class=chessEngine.GameState, max_depth=None):
+    """
+    Run perft on every position of the suite.
+    Returns True if all counts match the expected values.
+    """
+    all_passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, depth, expected in PERFT_SUITE:
+        if max_depth is not None and depth > max_depth:
+            continue
+        game_state = game_state_class(fen)
+        start = time.perf_counter()
+        nodes = perft(game_state, depth)
+        elapsed = time.perf_counter() - start
+        total_nodes += nodes
+        total_time += elapsed
+        passed = nodes == expected
+        all_passed = all_passed and passed
+        print("{:<16} depth {}  {:>9} nodes  {:>8.2f}s  {:>9.0f} nps  {}".format(
+            name, depth, nodes, elapsed, nodes / elapsed, "ok" if passed else "FAILED (expected " + str(expected) + ")"))
+    print("total {} nodes in {:.2f}s, {:.0f} nps".format(total_nodes, total_time, total_nodes / total_time))
+    return all_passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run perft on the engine move generator.")
+    parser.add_argument("--fen", help="run perft on this position instead of the suite")
+    parser.add_argument("--depth", type=int, default=3)
+    parser.add_argument("--divide", action="store_true", help="print the node count of every root move")
+    parser.add_argument("--backend", choices=sorted(BACKENDS), default="strings", help="board representation")
+    args = parser.parse_args()
+    game_state_class = BACKENDS[args.backend]
+    if args.fen is None:
+        raise SystemExit(0 if runSuite(game_state_class) else 1)
+    game_state = game_state_class(args.fen)
+    if args.divide:
+        counts = divide(game_state, args.depth)
+        for move in sorted(counts):
+            print(move, counts[move])
+        print("total", sum(counts.values()))
+    else:
+        start = time.perf_counter()
+        nodes = perft(game_state, args.depth)
+        print(nodes, "nodes in {:.2f}s".format(time.perf_counter() - start))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""
+Game server for many simultaneous games.
+Clients connect over TCP and send one JSON request per line, every reply is one JSON line.
+The games are GameState sessions held in memory, moves are checked against getValidMoves
+and engine moves are searched by a fixed number of worker processes.
+Engine requests wait in a queue that serves the connections in turn, and when the queue is full
+the server stops reading from the connection until there is room again.
+
+Requests (an optional "id" is copied into the reply):
+    {"op": "new", "fen": ..., "time": 60, "increment": 0, "depth": 3}   start a game, all fields optional
+    {"op": "move", "game": 1, "move": "e2e4"}                           play a move in coordinate notation
+    {"op": "go", "game": 1}                                             let the engine play the side to move
+    {"op": "state", "game": 1}
+    {"op": "close", "game": 1}
+    {"op": "stats"}
+The engine loses the game on time when a search uses up what is left of its time budget.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import itertools
+import json
+import multiprocessing
+import time
+import chessAI
+import chessEngine
+import chessMatch
+
+DEFAULT_PORT = 7878
+DEFAULT_GAME_TIME = 60  # seconds of engine thinking time per game
+MOVES_TO_GO = 30  # the engine plans its time as if this many moves were left
+MIN_MOVE_TIME = 0.01
+MAX_LINE_LENGTH = 1 << 16
+
+
+def moveToCoordinates(move):
+    return move.getRankFile(move.start_row, move.start_col) + move.getRankFile(move.end_row, move.end_col)
+
+
+def searchPosition(fen, depth, max_time):
+    """
+    Search a position in an engine worker process.
+    Returns the best move in coordinate notation, its score for the side to move, the nodes searched
+    and the time the search took.
+    """
+    start = time.perf_counter()
+    game_state = chessEngine.GameState(fen)
+    move, score, nodes, _ = chessAI.findBestMoveWithLimits(game_state, game_state.getValidMoves(), depth,
+                                                           max_time=max_time)
+    return None if move is None else moveToCoordinates(move), score, nodes, time.perf_counter() - start
+
+
+class RequestError(Exception):
+    """
+    A request that can not be carried out, the message is sent back to the client.
+    """
+
+
+class Session:
+    """
+    One game: its GameState, the legal moves of the current position and the engine's time budget.
+    """
+
+    def __init__(self, game_id, fen=None, time_budget=DEFAULT_GAME_TIME, increment=0, depth=chessAI.DEPTH):
+        self.game_id = game_id
+        try:
+            self.game_state = chessEngine.GameState(fen)
+        except (ValueError, IndexError, KeyError):
+            raise RequestError("invalid FEN")
+        self.clock = time_budget
+        self.increment = increment
+        self.depth = depth
+        self.searching = False
+        self.positions_seen = collections.Counter([self.game_state.zobrist_key])
+        self.updateValidMoves()
+
+    def updateValidMoves(self):
+        self.valid_moves = {moveToCoordinates(move): move for move in self.game_state.getValidMoves()}
+
+    def status(self):
+        game_state = self.game_state
+        if self.clock <= 0:
+            return "engine lost on time"
+        if game_state.checkmate:
+            return "checkmate"
+        if game_state.stalemate:
+            return "stalemate"
+        if game_state.halfmove_clock >= 100:
+            return "fifty move rule"
+        if self.positions_seen[game_state.zobrist_key] >= 3:
+            return "threefold repetition"
+        if chessMatch.isInsufficientMaterial(game_state.board):
+            return "insufficient material"
+        return "playing"
+
+    def checkPlayable(self):
+        if self.searching:
+            raise RequestError("engine is searching")
+        if self.status() != "playing":
+            raise RequestError("game is over")
+
+    def makeMove(self, text):
+        self.checkPlayable()
+        move = self.valid_moves.get(text[:4])
+        if move is None:
+            raise RequestError("illegal move")
+        self.game_state.makeMove(move)
+        self.positions_seen[self.game_state.zobrist_key] += 1
+        self.updateValidMoves()
+
+    def moveTime(self):
+        """
+        Thinking time for the next engine move, taken from what is left of the game's budget.
+        """
+        return min(max(self.clock / MOVES_TO_GO + self.increment, MIN_MOVE_TIME), self.clock)
+
+    def toDict(self):
+        return {"game": self.game_id, "fen": self.game_state.getFEN(), "status": self.status(),
+                "moves": sorted(self.valid_moves), "clock": round(self.clock, 3)}
+
+
+class FairQueue:
+    """
+    Queue of engine requests that hands them out one client at a time, so a client with many
+    requests waiting can't hold up the others. put waits while max_pending requests are queued.
+    """
+
+    def __init__(self, max_pending):
+        self.max_pending = max_pending
+        self.queues = {}  # client -> deque of its requests
+        self.turns = collections.deque()  # clients with waiting requests, in the order they are served
+        self.pending = 0
+        self.changed = asyncio.Condition()
+
+    async def put(self, client, item):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.pending < self.max_pending)
+            if client not in self.queues:
+                self.queues[client] = collections.deque()
+                self.turns.append(client)
+            self.queues[client].append(item)
+            self.pending += 1
+            self.changed.notify_all()
+
+    async def get(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.pending > 0)
+            client = self.turns.popleft()
+            queue = self.queues[client]
+            item = queue.popleft()
+            if queue:
+                self.turns.append(client)
+            else:
+                del self.queues[client]
+            self.pending -= 1
+            self.changed.notify_all()
+            return item
+
+    async def discard(self, client):
+        """
+        Drop the waiting requests of a client that disconnected.
+        """
+        async with self.changed:
+            queue = self.queues.pop(client, None)
+            if queue is None:
+                return []
+            self.turns.remove(client)
+            self.pending -= len(queue)
+            self.changed.notify_all()
+            return list(queue)
+
+
+class GameServer:
+    def __init__(self, engines, max_pending, max_games):
+        self.engines = engines
+        self.max_games = max_games
+        self.executor = concurrent.futures.ProcessPoolExecutor(engines)
+        self.queue = FairQueue(max_pending)
+        self.sessions = {}
+        self.game_ids = itertools.count(1)
+        self.busy_engines = 0
+        self.searches = 0
+
+    async def runEngine(self):
+        """
+        Take engine requests from the queue and search them, one at a time.
+        One of these runs for every engine process, so no more searches are started than there are engines.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            session, future = await self.queue.get()
+            if future.cancelled():
+                continue
+            self.busy_engines += 1
+            try:
+                result = await loop.run_in_executor(self.executor, searchPosition, session.game_state.getFEN(),
+                                                    session.depth, session.moveTime())
+            except Exception as error:  # a crashed worker fails the request, not the server
+                if not future.done():
+                    future.set_exception(error)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                self.busy_engines -= 1
+                self.searches += 1
+
+    async def queueSearch(self, client, session):
+        """
+        Queue an engine move for the session, waiting while the queue is full.
+        Returns a coroutine that waits for the search, plays the move and returns the reply.
+        """
+        session.checkPlayable()
+        session.searching = True
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await self.queue.put(client, (session, future))
+        except BaseException:
+            session.searching = False
+            raise
+        return self.engineMove(session, future)
+
+    async def engineMove(self, session, future):
+        try:
+            text, score, nodes, search_time = await future
+        finally:
+            session.searching = False
+        # only the search itself is charged to the game, not the time it waited for an engine
+        if search_time >= session.clock:  # the budget ran out before the move was played
+            session.clock = 0
+            reply = session.toDict()
+            reply.update({"nodes": nodes, "search_time": round(search_time, 4)})
+            return reply
+        session.clock += session.increment - search_time
+        if text is None:
+            raise RequestError("no move found")
+        session.makeMove(text)
+        reply = session.toDict()
+        reply.update({"engine_move": text, "score": score, "nodes": nodes, "search_time": round(search_time, 4)})
+        return reply
+
+    def getSession(self, games, request):
+        session = games.get(request.get("game"))
+        if session is None:
+            raise RequestError("unknown game")
+        return session
+
+    async def handleRequest(self, client, games, request):
+        op = request.get("op")
+        if op == "new":
+            if len(self.sessions) >= self.max_games:
+                raise RequestError("too many games")
+            session = Session(next(self.game_ids), request.get("fen"), float(request.get("time", DEFAULT_GAME_TIME)),
+                              float(request.get("increment", 0)), int(request.get("depth", chessAI.DEPTH)))
+            games[session.game_id] = self.sessions[session.game_id] = session
+            return session.toDict()
+        if op == "move":
+            session = self.getSession(games, request)
+            session.makeMove(str(request.get("move", "")))
+            return session.toDict()
+        if op == "go":
+            return await self.queueSearch(client, self.getSession(games, request))
+        if op == "state":
+            return self.getSession(games, request).toDict()
+        if op == "close":
+            session = self.getSession(games, request)
+            del games[session.game_id]
+            del self.sessions[session.game_id]
+            return {"game": session.game_id, "closed": True}
+        if op == "stats":
+            return {"games": len(self.sessions), "engines": self.engines, "busy_engines": self.busy_engines,
+                    "queued": self.queue.pending, "searches": self.searches}
+        raise RequestError("unknown op")
+
+    async def send(self, writer, write_lock, request, reply):
+        if "id" in request:
+            reply["id"] = request["id"]
+        async with write_lock:
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+
+    async def sendWhenDone(self, writer, write_lock, request, search):
+        try:
+            reply = await search
+        except RequestError as error:
+            reply = {"error": str(error)}
+        except (concurrent.futures.process.BrokenProcessPool, OSError) as error:
+            reply = {"error": "engine failed: {}".format(error)}
+        await self.send(writer, write_lock, request, reply)
+
+    async def handleClient(self, reader, writer):
+        """
+        Serve one connection. Requests are handled in order, but engine moves are answered when their search
+        finishes, so a connection can play many games at once. Queueing an engine move waits while the queue
+        is full and nothing more is read from the connection until then.
+        The games of the connection are closed when it disconnects.
+        """
+        client = object()
+        games = {}
+        write_lock = asyncio.Lock()
+        searches = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("request is not an object")
+                except ValueError:
+                    await self.send(writer, write_lock, {}, {"error": "invalid JSON"})
+                    continue
+                try:
+                    reply = await self.handleRequest(client, games, request)
+                except RequestError as error:
+                    reply = {"error": str(error)}
+                except (TypeError, ValueError) as error:
+                    reply = {"error": "bad request: {}".format(error)}
+                if asyncio.iscoroutine(reply):
+                    task = asyncio.create_task(self.sendWhenDone(writer, write_lock, request, reply))
+                    searches.add(task)
+                    task.add_done_callback(searches.discard)
+                else:
+                    await self.send(writer, write_lock, request, reply)
+        except (ConnectionError, ValueError):  # ValueError: a line longer than MAX_LINE_LENGTH
+            pass
+        finally:
+            for task in list(searches):
+                task.cancel()
+            for _, future in await self.queue.discard(client):
+                future.cancel()
+            for game_id in games:
+                self.sessions.pop(game_id, None)
+            writer.close()
+
+    async def serve(self, host, port):
+        engine_tasks = [asyncio.create_task(self.runEngine()) for _ in range(self.engines)]
+        server = await asyncio.start_server(self.handleClient, host, port, limit=MAX_LINE_LENGTH)
+        print("serving on {}:{} with {} engines".format(host, port, self.engines), flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in engine_tasks:
+                task.cancel()
+            self.executor.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve many games at once over TCP with a pool of engines.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--engines", type=int, default=multiprocessing.cpu_count(), help="engine worker processes")
+    parser.add_argument("--max-pending", type=int, default=256,
+                        help="engine requests that may wait in the queue before clients are held back")
+    parser.add_argument("--max-games", type=int, default=10000)
+    args = parser.parse_args()
+    try:
+        asyncio.run(GameServer(args.engines, args.max_pending, args.max_games).serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Per-square lookup tables for move generation.
+Squares are indexed by row * 8 + col and the tables hold (row, col) tuples the generators use directly,
+so they don't need to compute target squares and check the board bounds on every call.
+The tables are built once and cached in a binary file next to this module,
+which is loaded at import instead of building them again in every process.
+"""
+import marshal
+import os
+import sys
+
+TABLES_VERSION = 1  # increase when the contents of the tables change
+TABLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "chessTables.bin")
+
+# the order of the directions is the one checkForPinsAndChecks relies on: 4 orthogonal then 4 diagonal
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+KNIGHT_JUMPS = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+KING_STEPS = ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1))
+
+
+def buildTables():
+    """
+    knight_targets[square] and king_targets[square]: squares reached from the square.
+    pawn_attacks[color][square]: squares a pawn of the color ("w" or "b") on the square attacks.
+    rays[square][direction]: squares from the square outwards in each of the DIRECTIONS.
+    between_squares[a][b]: squares strictly between a and b when they share a rank, file or diagonal.
+    line_through[a][b]: all squares of the rank, file or diagonal through a and b, or empty.
+    """
+    def jumps(square, steps):
+        row, col = divmod(square, 8)
+        return tuple((row + row_step, col + col_step) for row_step, col_step in steps
+                     if 0 <= row + row_step <= 7 and 0 <= col + col_step <= 7)
+
+    def ray(square, direction):
+        row, col = divmod(square, 8)
+        squares = []
+        row, col = row + direction[0], col + direction[1]
+        while 0 <= row <= 7 and 0 <= col <= 7:
+            squares.append((row, col))
+            row, col = row + direction[0], col + direction[1]
+        return tuple(squares)
+
+    rays = [tuple(ray(square, direction) for direction in DIRECTIONS) for square in range(64)]
+    between_squares = [[()] * 64 for _ in range(64)]
+    line_through = [[()] * 64 for _ in range(64)]
+    for square in range(64):
+        for direction_index, squares in enumerate(rays[square]):
+            opposite = rays[square][direction_index ^ 2 if direction_index < 4 else 11 - direction_index]
+            line = tuple(reversed(opposite)) + (divmod(square, 8),) + squares
+            for i, (row, col) in enumerate(squares):
+                between_squares[square][row * 8 + col] = squares[:i]
+                line_through[square][row * 8 + col] = line
+    return {"version": TABLES_VERSION,
+            "knight_targets": tuple(jumps(square, KNIGHT_JUMPS) for square in range(64)),
+            "king_targets": tuple(jumps(square, KING_STEPS) for square in range(64)),
+            "pawn_attacks": {"w": tuple(jumps(square, ((-1, -1), (-1, 1))) for square in range(64)),
+                             "b": tuple(jumps(square, ((1, -1), (1, 1))) for square in range(64))},
+            "rays": tuple(rays),
+            "between_squares": tuple(tuple(row) for row in between_squares),
+            "line_through": tuple(tuple(row) for row in line_through)}
+
+
+def loadTables(path=TABLES_PATH):
+    """
+    Read the tables from the cache file, or build them and try to write the file.
+    A missing, outdated or unreadable file (marshal data depends on the Python version) is replaced,
+    and when the directory is not writable the tables are just built.
+    """
+    try:
+        with open(path, "rb") as file:
+            tables = marshal.loads(file.read())
+        if tables.get("version") == TABLES_VERSION and tables.get("python") == sys.version_info[:2]:
+            return tables
+    except (OSError, EOFError, ValueError, TypeError, AttributeError):
+        pass
+    tables = buildTables()
+    tables["python"] = sys.version_info[:2]
+    temporary_path = "{}.{}.tmp".format(path, os.getpid())
+    try:
+        with open(temporary_path, "wb") as file:
+            marshal.dump(tables, file)
+        os.replace(temporary_path, path)  # other processes never see a half written file
+    except OSError:
+        pass
+    return tables
+
+
+tables = loadTables()
+knight_targets = tables["knight_targets"]
+king_targets = tables["king_targets"]
+pawn_attacks = tables["pawn_attacks"]
+rays = tables["rays"]
+between_squares = tables["between_squares"]
+line_through = tables["line_through"]
@@ -0,0 +1,262 @@
+"""
+Texel tuning of the evaluation in chessAI.
+Labelled positions are loaded once into flat NumPy arrays with one entry per piece,
+then the piece values and piece-square tables are fitted by gradient descent on the error between
+the game results and the sigmoid of the evaluation, a whole batch of positions at a time.
+The tuned values are written as JSON that chessAI.loadEvaluation reads.
+"""
+import argparse
+import array
+import json
+import math
+import time
+import numpy as np
+import chessAI
+import chessPGN
+
+PIECE_TYPES = ("p", "N", "B", "R", "Q")  # the king has no value or table
+TABLE_NAMES = {"p": "pawn_scores", "N": "knight_scores", "B": "bishop_scores", "R": "rook_scores",
+               "Q": "queen_scores"}
+FEN_PIECE_INDEXES = {char: PIECE_TYPES.index(piece_type) for char, piece_type in
+                     (("P", "p"), ("N", "N"), ("B", "B"), ("R", "R"), ("Q", "Q"))}
+RESULT_SCORES = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5, "1.0": 1.0, "0.0": 0.0, "0.5": 0.5}
+
+
+class PositionSet:
+    """
+    Positions in flat arrays: every piece other than a king has a table index
+    (piece type * 64 + square seen from its own side), a sign (1 for white, -1 for black)
+    and the number of the position it belongs to. Positions are stored in order,
+    so offsets[i]:offsets[i + 1] are the pieces of position i.
+    The compact types keep several million positions in well under a gigabyte.
+    """
+
+    def __init__(self, indexes, signs, offsets, results):
+        self.indexes = indexes
+        self.signs = signs
+        self.offsets = offsets
+        self.results = results
+        self.positions = np.repeat(np.arange(len(results), dtype=np.int32), np.diff(offsets))
+
+    def __len__(self):
+        return len(self.results)
+
+    def batch(self, start, end):
+        """
+        Pieces, signs, position numbers counted from start, and results of the positions start to end.
+        """
+        first, last = self.offsets[start], self.offsets[end]
+        return (self.indexes[first:last], self.signs[first:last], self.positions[first:last] - start,
+                self.results[start:end])
+
+
+class PositionSetBuilder:
+    def __init__(self):
+        self.indexes = array.array("h")
+        self.signs = array.array("b")
+        self.offsets = array.array("q", [0])
+        self.results = array.array("d")
+
+    def addBoardField(self, placement, result):
+        """
+        Add a position given as the piece placement field of a FEN.
+        """
+        count = 0
+        row = col = 0
+        for char in placement:
+            if char == "/":
+                row += 1
+                col = 0
+            elif char.isdigit():
+                col += int(char)
+            else:
+                piece_index = FEN_PIECE_INDEXES.get(char.upper())
+                if piece_index is not None:
+                    if char.isupper():
+                        self.indexes.append(piece_index * 64 + row * 8 + col)
+                        self.signs.append(1)
+                    else:  # black pieces use the tables upside down
+                        self.indexes.append(piece_index * 64 + (7 - row) * 8 + col)
+                        self.signs.append(-1)
+                    count += 1
+                col += 1
+        self.offsets.append(self.offsets[-1] + count)
+        self.results.append(result)
+
+    def addGameState(self, game_state, result):
+        self.addBoardField(game_state.getFEN().split()[0], result)
+
+    def build(self):
+        return PositionSet(np.frombuffer(self.indexes, dtype=np.int16), np.frombuffer(self.signs, dtype=np.int8),
+                           np.frombuffer(self.offsets, dtype=np.int64), np.frombuffer(self.results, dtype=np.float64))
+
+
+def parseResult(token):
+    return RESULT_SCORES.get(token.strip('[]";,'))
+
+
+def loadPositions(paths, skip_plies=8):
+    """
+    Read labelled positions. Text files have one position per line: the FEN followed by the result
+    of the game (1-0, 0-1, 1/2-1/2 or 1.0, 0.0, 0.5, also in brackets or quotes as in EPD files).
+    PGN files add every position of every game with a result, after the first skip_plies plies.
+    """
+    builder = PositionSetBuilder()
+    for path in paths:
+        if path.lower().endswith(".pgn"):
+            for game in chessPGN.readGames(path):
+                result = RESULT_SCORES.get(game.result)
+                if result is None:
+                    continue
+                try:
+                    for ply, (game_state, _, _) in enumerate(game.replay()):
+                        if ply >= skip_plies:
+                            builder.addGameState(game_state, result)
+                except ValueError:
+                    continue
+            continue
+        with open(path) as file:
+            for line in file:
+                fields = line.split()
+                result = None
+                for token in reversed(fields[1:]):
+                    result = parseResult(token)
+                    if result is not None:
+                        break
+                if result is not None:
+                    builder.addBoardField(fields[0], result)
+    return builder.build()
+
+
+def initialParameters():
+    """
+    The piece values followed by the 64 entries of every piece-square table, in PIECE_TYPES order.
+    """
+    values = [chessAI.piece_score[piece_type] for piece_type in PIECE_TYPES]
+    for piece_type in PIECE_TYPES:
+        for row in getattr(chessAI, TABLE_NAMES[piece_type]):
+            values.extend(row)
+    return np.array(values, dtype=np.float64)
+
+
+def evaluate(parameters, indexes, signs, positions, count):
+    """
+    Evaluation of a batch of positions: the sum over the pieces of sign * (piece value + table entry).
+    """
+    piece_values = parameters[indexes >> 6] + parameters[len(PIECE_TYPES) + indexes]
+    return np.bincount(positions, weights=signs * piece_values, minlength=count)
+
+
+def sigmoid(evaluations, scaling):
+    """
+    Expected game result for white from an evaluation in pawns.
+    """
+    return 1 / (1 + np.power(10.0, -scaling * evaluations / 4))
+
+
+def meanError(parameters, position_set, scaling, batch_size):
+    total = 0.0
+    for start in range(0, len(position_set), batch_size):
+        end = min(start + batch_size, len(position_set))
+        indexes, signs, positions, results = position_set.batch(start, end)
+        evaluations = evaluate(parameters, indexes, signs, positions, end - start)
+        total += np.sum((results - sigmoid(evaluations, scaling)) ** 2)
+    return total / len(position_set)
+
+
+def fitScaling(parameters, position_set, batch_size):
+    """
+    The sigmoid scaling that best fits the current evaluation, found by a coarse then fine scan.
+    """
+    candidates = np.arange(0.1, 4.0, 0.1)
+    errors = [meanError(parameters, position_set, scaling, batch_size) for scaling in candidates]
+    best_scaling = float(candidates[int(np.argmin(errors))])
+    candidates = np.arange(best_scaling - 0.09, best_scaling + 0.095, 0.01)
+    errors = [meanError(parameters, position_set, scaling, batch_size) for scaling in candidates]
+    return float(candidates[int(np.argmin(errors))])
+
+
+def gradient(parameters, indexes, signs, positions, results, scaling):
+    """
+    Gradient of the summed squared error of a batch.
+    """
+    evaluations = evaluate(parameters, indexes, signs, positions, len(results))
+    predictions = sigmoid(evaluations, scaling)
+    # derivative of the error of every position with respect to its evaluation
+    slopes = -2 * (results - predictions) * predictions * (1 - predictions) * math.log(10) * scaling / 4
+    piece_slopes = signs * slopes[positions]
+    piece_gradient = np.bincount(indexes >> 6, weights=piece_slopes, minlength=len(PIECE_TYPES))
+    table_gradient = np.bincount(indexes, weights=piece_slopes, minlength=len(PIECE_TYPES) * 64)
+    return np.concatenate((piece_gradient, table_gradient))
+
+
+def tune(position_set, parameters, scaling, epochs=50, batch_size=1 << 16, learning_rate=0.01, verbose=True):
+    """
+    Adam gradient descent over shuffled batches of positions. Returns the tuned parameters.
+    """
+    first_moment = np.zeros_like(parameters)
+    second_moment = np.zeros_like(parameters)
+    beta1, beta2, epsilon = 0.9, 0.999, 1e-8
+    step = 0
+    batch_starts = np.arange(0, len(position_set), batch_size)
+    for epoch in range(epochs):
+        start_time = time.perf_counter()
+        for start in np.random.permutation(batch_starts):
+            end = min(start + batch_size, len(position_set))
+            indexes, signs, positions, results = position_set.batch(start, end)
+            step += 1
+            batch_gradient = gradient(parameters, indexes, signs, positions, results, scaling) / (end - start)
+            first_moment = beta1 * first_moment + (1 - beta1) * batch_gradient
+            second_moment = beta2 * second_moment + (1 - beta2) * batch_gradient ** 2
+            corrected_first = first_moment / (1 - beta1 ** step)
+            corrected_second = second_moment / (1 - beta2 ** step)
+            parameters = parameters - learning_rate * corrected_first / (np.sqrt(corrected_second) + epsilon)
+        if verbose:
+            print("epoch {}  error {:.6f}  {:.1f}s".format(
+                epoch + 1, meanError(parameters, position_set, scaling, batch_size),
+                time.perf_counter() - start_time), flush=True)
+    return parameters
+
+
+def parametersToEvaluation(parameters):
+    """
+    The parameters in the format of chessAI.loadEvaluation.
+    """
+    evaluation = {"piece_score": {piece_type: round(float(parameters[i]), 3)
+                                  for i, piece_type in enumerate(PIECE_TYPES)}}
+    for i, piece_type in enumerate(PIECE_TYPES):
+        table = parameters[len(PIECE_TYPES) + i * 64:len(PIECE_TYPES) + (i + 1) * 64].reshape(8, 8)
+        evaluation[TABLE_NAMES[piece_type]] = [[round(float(value), 3) for value in row] for row in table]
+    return evaluation
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune the evaluation on positions labelled with game results.")
+    parser.add_argument("positions", nargs="+", help="files of 'FEN result' lines or PGN games")
+    parser.add_argument("--output", default="evaluation.json", help="file the tuned evaluation is written to")
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=1 << 16)
+    parser.add_argument("--learning-rate", type=float, default=0.01)
+    parser.add_argument("--scaling", type=float, help="sigmoid scaling (default: fitted to the initial evaluation)")
+    parser.add_argument("--skip-plies", type=int, default=8, help="opening plies of PGN games that are not used")
+    parser.add_argument("--start", help="evaluation JSON to start from instead of the chessAI tables")
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    position_set = loadPositions(args.positions, args.skip_plies)
+    print("{} positions, {} pieces loaded in {:.1f}s".format(
+        len(position_set), len(position_set.indexes), time.perf_counter() - start_time))
+    if args.start is not None:
+        chessAI.loadEvaluation(args.start)
+    parameters = initialParameters()
+    scaling = args.scaling if args.scaling is not None else fitScaling(parameters, position_set, args.batch_size)
+    print("scaling {:.2f}  initial error {:.6f}".format(
+        scaling, meanError(parameters, position_set, scaling, args.batch_size)))
+    parameters = tune(position_set, parameters, scaling, args.epochs, args.batch_size, args.learning_rate)
+    with open(args.output, "w") as file:
+        json.dump(parametersToEvaluation(parameters), file, indent=1)
+    print("written to", args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+import io
+import unittest
+import chessEngine
+import chessIndex
+import chessPGN
+
+
+class IndexGameTest(unittest.TestCase):
+    def indexPGN(self, text):
+        game = next(chessPGN.readGames(io.BytesIO(text.encode())))
+        packed, count, error = chessIndex.indexGame(game)
+        self.assertIsNone(error)
+        return list(chessIndex.RECORD.iter_unpack(packed))
+
+    def testLastRecordIsTheFinalPosition(self):
+        records = self.indexPGN('[Result "*"]\n\n1. e4 e5 2. Nf3 *\n')
+        game_state = chessIndex.setUpPosition(None, ["e2e4", "e7e5", "g1f3"])
+        self.assertEqual(len(records), 4)
+        self.assertEqual(records[-1][0], game_state.zobrist_key)
+        self.assertEqual(records[-1][2], chessIndex.NO_MOVE)
+
+    def testGameWithoutMoves(self):
+        records = self.indexPGN('[Result "*"]\n\n*\n')
+        self.assertEqual(records, [(chessEngine.GameState().zobrist_key, 0, chessIndex.NO_MOVE)])
+
+
+if __name__ == "__main__":
+    unittest.main()
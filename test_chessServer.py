@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+import chessServer
+
+
+class TimeBudgetTest(unittest.TestCase):
+    def playEngineMove(self, server, session, result):
+        async def play():
+            future = asyncio.get_running_loop().create_future()
+            future.set_result(result)
+            session.searching = True
+            return await server.engineMove(session, future)
+        return asyncio.run(play())
+
+    def testSearchOverTheBudgetLosesOnTime(self):
+        server = chessServer.GameServer(1, 10, 10)
+        session = chessServer.Session(1, time_budget=0.05)
+        reply = self.playEngineMove(server, session, ("e2e4", 0.1, 100, 0.2))
+        self.assertEqual(reply["status"], "engine lost on time")
+        self.assertEqual(session.game_state.move_log, [])
+        with self.assertRaises(chessServer.RequestError):
+            asyncio.run(server.queueSearch(0, session))
+        with self.assertRaises(chessServer.RequestError):
+            session.makeMove("e2e4")
+        server.executor.shutdown()
+
+    def testSearchWithinTheBudgetIsCharged(self):
+        server = chessServer.GameServer(1, 10, 10)
+        session = chessServer.Session(1, time_budget=1.0, increment=0.1)
+        reply = self.playEngineMove(server, session, ("e2e4", 0.1, 100, 0.3))
+        self.assertEqual(reply["status"], "playing")
+        self.assertEqual(reply["engine_move"], "e2e4")
+        self.assertAlmostEqual(session.clock, 0.8)
+        self.assertLessEqual(session.moveTime(), session.clock)
+        server.executor.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()